@@ -1,38 +1,90 @@
-from flask import Flask, jsonify, Response, render_template
-import json
-import requests
+from flask import Flask, g, jsonify, Response, render_template, request
 import datetime
+import time
+
+import numpy as np
+
+import reference
+import tiles
+from schedule import seconds_since_midnight
+from compression import compression_cache, finalize_json_response
+from config import (
+    batch_max_lines, stops_nearest_max, stops_nearest_max_distance, stops_within_max_radius, vehicles_range_max_moments
+)
+from spatial import StopIndex
+from prefetch import line_prefetcher
+from province_vehicles import province_vehicle_engine
+from negotiation import negotiated_response
+from service import (
+    DirectionTrajectories, UpstreamError, find_stop, format_time, get_line_directions, get_vehicle_positions, get_vehicle_positions_batch,
+    get_vehicle_positions_range, schedule_cache, stops_json, stops_to_columnar
+)
+from shared_schedules import shared_schedules
+from store import schedule_store
+from stream import vehicle_broadcaster, vehicles_error_json
+from delijn_client import delijn_client, open_weather_client
+from metrics import Counter, Gauge, http_request_duration, http_requests_in_flight, registry
+from upstream import upstream_cache, upstream_flight
+from weather import get_weather as get_weather_at, get_weather_bulk, weather_cache
 
 app = Flask(__name__, template_folder="./html/")
 
-open_weather_key = "XXXX"
+# key of the WSGI environ under which the ASGI server passes the results it already retrieved for a request
+PREFETCHED_ENVIRON_KEY = "delijn.service_memo"
 
-delijn_req_header = {
-    'Ocp-Apim-Subscription-Key': 'XXXX'
-}
+# serve the provinces, lines, colors and stops from the local snapshot and keep it up to date in the background
+reference.reference_data.add_listener(tiles.on_reference_snapshot)
+reference.reference_data.start()
 
+# keep the most used lines in the upstream cache, starting with those that were most used before a restart
+line_prefetcher.start()
 
-def make_get_request(url, **kwargs) -> (bool, dict):
-    """
-        Send a GET request to the specified URL with the specified arguments. This
-        will return (False, status code None) in case of a problem, or (True, status code, data) in case of
-        success with "data" a dict representation of the JSON response and "status code" the HTTP status code.
-    """
 
-    print("Making call to '{}'...".format(url))
-    resp = requests.get(url, **kwargs)
-    print("Received response.")
+@app.before_request
+def start_request_timer() -> None:
+    g.request_start = time.perf_counter()
+    http_requests_in_flight.inc()
 
-    if not resp.ok:
-        try:
-            return False, resp.status_code, json.loads(resp.content)
-        except:
-            print("Severe error when receiving response. An error occurred and no error data was received!")
-            return False, resp.status_code, {
-                "boodschap": "unknown error (server did not respond with JSON error data)"
-            }
+    # results that the ASGI server already retrieved for this request (see asgi.py)
+    if PREFETCHED_ENVIRON_KEY in request.environ:
+        g.service_memo = request.environ[PREFETCHED_ENVIRON_KEY]
+
+
+# NOTE: registered before finalize_response(), so it runs after it and sees the final status code (e.g. 304)
+@app.after_request
+def observe_request(response: Response) -> Response:
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        http_request_duration.observe(time.perf_counter() - g.request_start, (request.method, route, str(response.status_code)))
+
+    return response
+
+
+@app.teardown_request
+def end_request(error) -> None:
+    if "request_start" in g:
+        http_requests_in_flight.dec()
+
+
+@app.after_request
+def finalize_response(response: Response) -> Response:
+    # ETag, conditional GET and compression of JSON responses
+    return finalize_json_response(request, response)
+
+
+def upstream_error_json(error: UpstreamError) -> dict:
+
+    return {
+        'causeErrorStatus': error.cause_status,
+        'causeErrorMessage': error.cause_message,
+        'errorMessage': error.message,
+        'responseCode': 500
+    }
+
+
+def upstream_error_response(error: UpstreamError) -> (Response, int):
 
-    return True, resp.status_code, json.loads(resp.content)
+    return jsonify(upstream_error_json(error)), 500
 
 
 @app.errorhandler(500)
@@ -53,56 +105,154 @@ def index() -> (Response, int):
     return render_template('index.html')
 
 
+@app.route('/api/cache/')
+def get_cache_stats() -> (Response, int):
+    """
+        Retrieve the hit/miss counters of the caches, and the state of the upstream clients.
+    """
+
+    return jsonify({
+        'upstream': upstream_cache.stats(),
+        'schedules': schedule_cache.stats(),
+        'weather': weather_cache.stats(),
+        'compression': compression_cache.stats(),
+        'tiles': tiles.tile_cache.stats(),
+        'provinceVehicles': province_vehicle_engine.stats(),
+        'scheduleStore': schedule_store.stats() if schedule_store is not None else None,
+        'sharedSchedules': shared_schedules.stats() if shared_schedules is not None else None,
+        'prefetch': line_prefetcher.stats(),
+        'coalescing': upstream_flight.stats(),
+        'delijn': delijn_client.stats(),
+        'openWeather': open_weather_client.stats(),
+        'responseCode': 200
+    }), 200
+
+
+def component_metrics() -> list:
+    """
+        Retrieve the metrics of the caches and upstream clients, computed from their counters on every scrape.
+    """
+
+    cache_lookups = Counter("cache_lookups_total", "Number of cache lookups by result.", ("cache", "result"))
+    cache_hit_ratio = Gauge("cache_hit_ratio", "Fraction of cache lookups that found an entry (fresh or stale).", ("cache",))
+    cache_bytes = Gauge("cache_bytes", "Approximate size of the cached values.", ("cache",))
+    cache_evictions = Counter("cache_evictions_total", "Number of entries evicted to stay within the byte budget.", ("cache",))
+
+    caches = {
+        'upstream': upstream_cache,
+        'schedules': schedule_cache,
+        'weather': weather_cache,
+        'compression': compression_cache,
+        'tiles': tiles.tile_cache,
+    }
+    for name, cache in caches.items():
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['staleHits'] + stats['misses']
+
+        cache_lookups.inc((name, "hit"), stats['hits'])
+        cache_lookups.inc((name, "stale"), stats['staleHits'])
+        cache_lookups.inc((name, "miss"), stats['misses'])
+        cache_hit_ratio.set((name,), (stats['hits'] + stats['staleHits']) / lookups if lookups > 0 else 0.0)
+        cache_bytes.set((name,), stats['bytes'])
+        cache_evictions.inc((name,), stats['evictions'])
+
+    coalescing = upstream_flight.stats()
+    coalesced_in_flight = Gauge("upstream_coalesced_in_flight", "Number of distinct upstream calls that callers are waiting for.")
+    coalesced_in_flight.set((), coalescing['inFlight'])
+    coalesced_followers = Counter("upstream_coalesced_total", "Number of callers that shared the upstream call of another caller.")
+    coalesced_followers.inc((), coalescing['followers'])
+
+    client_calls = Counter("upstream_client_calls_total", "Number of calls made by an upstream client, by kind.", ("client", "kind"))
+    client_breaker_open = Gauge("upstream_circuit_breaker_open", "1 while the circuit breaker of an upstream client is not closed.", ("client",))
+    for name, client in (("delijn", delijn_client), ("openWeather", open_weather_client)):
+        stats = client.stats()
+
+        client_calls.inc((name, "call"), stats['calls'])
+        client_calls.inc((name, "retry"), stats['retries'])
+        client_calls.inc((name, "rejected"), stats['rejected'])
+        client_breaker_open.set((name,), 0 if stats['breakerState'] == "closed" else 1)
+
+    return [
+        cache_lookups, cache_hit_ratio, cache_bytes, cache_evictions,
+        coalesced_in_flight, coalesced_followers, client_calls, client_breaker_open
+    ]
+
+
+registry.register_collector(component_metrics)
+
+
+@app.route('/metrics')
+def get_metrics() -> Response:
+    """
+        Expose the request, upstream and cache metrics in the Prometheus text format.
+    """
+
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/api/provinces/')
 def get_provinces() -> (Response, int):
 
-    # make request to delijn
-    get_prov_url = "https://api.delijn.be/DLKernOpenData/api/v1/entiteiten"
-    flag, status_code, data = make_get_request(get_prov_url, headers=delijn_req_header)
-    if not flag:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': data["boodschap"] if "boodschap" in data else "",
-            'errorMessage': "Cannot retrieve provinces from DeLijn API.",
-            'responseCode': 500
-        }), 500
+    try:
+        provinces = reference.get_provinces()
+    except UpstreamError as e:
+        return upstream_error_response(e)
 
     return jsonify({
-        'provinces': [
-            {
-                'id': int(entiteit['entiteitnummer']),
-                'name': entiteit['omschrijving'],
-            } for entiteit in data["entiteiten"]
-        ],
+        'provinces': provinces,
         'responseCode': 200,
     }), 200
 
 
+@app.route('/api/provinces/<int:province_id>/vehicles/')
+def get_province_vehicles(province_id: int) -> (Response, int):
+    """
+        Retrieve the vehicles of all lines in the specified province from the latest snapshot of the province
+        vehicle engine, optionally only those inside "?bbox=<west>,<south>,<east>,<north>" (in degrees).
+        The first requests for a province only contain the lines that have been loaded so far ("linesLoaded").
+    """
+
+    bbox = None
+    if 'bbox' in request.args:
+        try:
+            bbox = [float(part) for part in request.args['bbox'].split(",")]
+        except ValueError:
+            bbox = []
+
+        if len(bbox) != 4:
+            return bad_request_response("Specify the bounding box as '?bbox=<west>,<south>,<east>,<north>'.")
+
+    # unknown provinces are not watched
+    try:
+        reference.get_lines(province_id)
+    except UpstreamError as e:
+        return upstream_error_response(e)
+
+    snapshot = province_vehicle_engine.get_snapshot(province_id)
+    indices = snapshot.in_bbox(*bbox) if bbox is not None else np.arange(len(snapshot.lats))
+
+    def make_document(to_document) -> dict:
+        retval = to_document(indices)
+        retval['responseCode'] = 200
+        return retval
+
+    return negotiated_response(request, 200, lambda: make_document(snapshot.to_json), lambda: make_document(snapshot.to_columnar))
+
+
 @app.route('/api/provinces/<int:province_id>/lines/')
 def get_lines(province_id: int) -> (Response, int):
     """
         Retrieve a list of lines in the specified province.
     """
 
-    # make call to get all lines
-    url_lines = "https://api.delijn.be/DLKernOpenData/api/v1/entiteiten/{}/lijnen".format(province_id)
-    flag, status_code, data_lines = make_get_request(url_lines, headers=delijn_req_header)
-    if not flag:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': data_lines["boodschap"] if "boodschap" in data_lines else "",
-            'errorMessage': "Cannot retrieve list of lines from DeLijn API.",
-            'responseCode': 500
-        }), 500
+    try:
+        lines = reference.get_lines(province_id)
+    except UpstreamError as e:
+        return upstream_error_response(e)
 
     # compile response
     return jsonify({
-        'lines': [
-            {
-                'id': int(lijn["lijnnummer"]),
-                'name': lijn['omschrijving'],
-            } for lijn in data_lines["lijnen"]
-        ],
+        'lines': lines,
         'responseCode': 200
     }), 200
 
@@ -114,124 +264,154 @@ def get_stops(province_id: int, line_id: int) -> (Response, int):
         Retrieve a list of stops per direction for the specified line.
     """
 
-    url_dirs = "https://api.delijn.be/DLKernOpenData/api/v1/lijnen/{}/{}/lijnrichtingen".format(province_id, line_id)
-    flag, status_code, data_dirs = make_get_request(url_dirs, headers=delijn_req_header)
-    if not flag:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': data_dirs["boodschap"] if "boodschap" in data_dirs else "",
-            'errorMessage': "Cannot retrieve line directions from DeLijn API.",
-            'responseCode': 500
-        }), 500
+    try:
+        directions = get_line_directions(province_id, line_id)
+    except UpstreamError as e:
+        return upstream_error_response(e)
+
+    def make_json() -> dict:
+        retval = stops_json(directions)
+        retval['responseCode'] = 200
+        return retval
+
+    def make_columnar() -> dict:
+        return {
+            'dirs': [
+                {
+                    'type':  direction.type,
+                    'name':  direction.name,
+                    'stops': stops_to_columnar(direction.stops)
+                } for direction in directions
+            ],
+            'responseCode': 200
+        }
+
+    return negotiated_response(request, 200, make_json, make_columnar)
+
 
-    retval = {
-        'dirs': [],
+@app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/color/')
+def get_line_color(province_id: int, line_id: int) -> (Response, int):
+    """
+        Retrieve the color of the specified line.
+    """
+
+    try:
+        color = reference.get_line_color(province_id, line_id)
+    except UpstreamError as e:
+        return upstream_error_response(e)
+
+    return jsonify({
+        'color': color,
         'responseCode': 200
-    }
+    }), 200
 
-    for direction in data_dirs["lijnrichtingen"]:
-        dir_type = direction["richting"]
-        dir_name = direction["omschrijving"]
-
-        # determine haltes
-        # retrieve list of stops with corresponding information
-        url_stops = "https://api.delijn.be/DLKernOpenData/api/v1/lijnen/{}/{}/lijnrichtingen/{}/haltes".format(province_id, line_id, dir_type)
-        flag, status_code, data_stops = make_get_request(url_stops, headers=delijn_req_header)
-        if not flag:
-            return jsonify({
-                'causeErrorStatus': status_code,
-                'causeErrorMessage': data_stops["boodschap"] if "boodschap" in data_stops else "",
-                'errorMessage': "Cannot retrieve stops from DeLijn API.",
-                'responseCode': 500
-            }), 500
-
-        # retrieve list of stop ids in correct order
-        url_rides = "https://api.delijn.be/DLKernOpenData/api/v1/lijnen/{}/{}/lijnrichtingen/{}/dienstregelingen".format(province_id, line_id, dir_type)
-        flag, status_code, data_rides = make_get_request(url_rides, headers=delijn_req_header)
-        if not flag:
-            return jsonify({
-                'causeErrorStatus': status_code,
-                'causeErrorMessage': data_rides["boodschap"] if "boodschap" in data_rides else "",
-                'errorMessage': "Cannot retrieve schedule from DeLijn API.",
-                'responseCode': 500
-            }), 500
-
-        if len(data_rides["ritDoorkomsten"]) > 0:
-            dir_stops = get_sorted_stoplist(data_stops, data_rides)
-        else:
-            dir_stops = []  # do not return an error, since the other direction could be working fine.
 
-        retval['dirs'].append({
-            'type':  dir_type,
-            'name':  dir_name,
-            'stops': dir_stops
-        })
+def bad_request_response(message: str) -> (Response, int):
+
+    return jsonify({
+        'causeErrorStatus': -1,
+        'causeErrorMessage': "N/A",
+        'errorMessage': message,
+        'responseCode': 400
+    }), 400
+
+
+def stops_unavailable_response() -> (Response, int):
+
+    return jsonify({
+        'causeErrorStatus': -1,
+        'causeErrorMessage': "N/A",
+        'errorMessage': "The stops are not available yet, the reference data is still being retrieved from the DeLijn API.",
+        'responseCode': 503
+    }), 503
 
-    return jsonify(retval), 200
 
+def valid_coordinate(lat: float, long: float) -> bool:
+    # NOTE: this also rejects NaN, which float() accepts
+    return -90.0 <= lat <= 90.0 and -180.0 <= long <= 180.0
 
-def get_sorted_stoplist(stop_data: dict, ride_data: dict) -> list:
+
+def stops_response(get_stops, *args) -> (Response, int):
     """
-        Given data about stops and rides, retrieve a list of stops
-        that are sorted in the order that they appear on the ride.
+        Answer a query of the spatial stop index: "get_stops" is called on the index with the specified arguments.
     """
 
-    # NOTE: we only show the user stops which are part of a ride. This is correct since the animated
-    # vehicles will also depend on rides and will never stop at unused stops.
+    index = reference.reference_data.get_stop_index()
+    if index is None:
+        return stops_unavailable_response()
 
-    # retrieve a list of stop id's in correct order
-    sorted_stop_ids = [int(stop["haltenummer"]) for stop in ride_data["ritDoorkomsten"][0]["doorkomsten"]]
+    stops = []
+    for province_id, stop, distance in get_stops(index, *args):
+        stop_json = stop.to_json()
+        stop_json['province'] = province_id
+        stop_json['distance'] = round(distance, 1)
+        stops.append(stop_json)
 
-    # map stop ids to stop data
-    stop_map = {
-        int(stop["haltenummer"]): stop for stop in stop_data["haltes"]
-    }
+    return jsonify({
+        'stops': stops,
+        'responseCode': 200
+    }), 200
 
-    # compile list of stops
-    return [
-        {
-            'id': int(halte['haltenummer']),
-            'name': halte['omschrijving'],
-            'city': halte['omschrijvingGemeente'],
-            'coord': {
-                'lat': float(halte['geoCoordinaat']['latitude']),
-                'long': float(halte['geoCoordinaat']['longitude']),
-            }
-        } for halte in [stop_map[stop_id] for stop_id in sorted_stop_ids if stop_id in stop_map]
-    ]
 
+@app.route('/api/stops/nearest')
+def get_nearest_stops() -> (Response, int):
+    """
+        Retrieve the "k" (default 10) stops closest to "?lat=...&lon=...", closest first, with their distance in meters.
+        Stops farther away than config.stops_nearest_max_distance are left out.
+    """
+
+    try:
+        lat, long = float(request.args['lat']), float(request.args['lon'])
+        k = int(request.args.get('k', 10))
+    except (KeyError, ValueError):
+        return bad_request_response("Specify the coordinate as '?lat=<latitude>&lon=<longitude>' and optionally '&k=<number of stops>'.")
 
-@app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/color/')
-def get_line_color(province_id: int, line_id: int) -> (Response, int):
+    if not valid_coordinate(lat, long):
+        return bad_request_response("The latitude must be between -90 and 90, the longitude between -180 and 180.")
+
+    if not 1 <= k <= stops_nearest_max:
+        return bad_request_response("Between 1 and {} stops can be retrieved at once.".format(stops_nearest_max))
+
+    return stops_response(StopIndex.nearest, lat, long, k, stops_nearest_max_distance)
+
+
+@app.route('/api/stops/within')
+def get_stops_within() -> (Response, int):
     """
-        Retrieve the color of the specified line.
+        Retrieve all stops within "radius" meters of "?lat=...&lon=...", closest first, with their distance in meters.
     """
 
-    url_colorcodes = "https://api.delijn.be/DLKernOpenData/api/v1/kleuren"
-    flag, status_code, data_colorcodes = make_get_request(url_colorcodes, headers=delijn_req_header)
-    if not flag:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': data_colorcodes["boodschap"] if "boodschap" in data_colorcodes else "",
-            'errorMessage': "Cannot retrieve color codes from DeLijn API.",
-            'responseCode': 500
-        }), 500
+    try:
+        lat, long = float(request.args['lat']), float(request.args['lon'])
+        radius = float(request.args['radius'])
+    except (KeyError, ValueError):
+        return bad_request_response("Specify the area as '?lat=<latitude>&lon=<longitude>&radius=<meters>'.")
 
-    colormap = {colorcode["code"]: colorcode["hex"] for colorcode in data_colorcodes["kleuren"]}
+    if not valid_coordinate(lat, long):
+        return bad_request_response("The latitude must be between -90 and 90, the longitude between -180 and 180.")
 
-    url_line_color = "https://api.delijn.be/DLKernOpenData/api/v1/lijnen/{}/{}/lijnkleuren".format(province_id, line_id)
-    flag, status_code, data_line_color = make_get_request(url_line_color, headers=delijn_req_header)
-    if not flag:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': data_line_color["boodschap"] if "boodschap" in data_line_color else "",
-            'errorMessage': "Cannot retrieve line colors from DeLijn API.",
-            'responseCode': 500
-        }), 500
+    if not 0 <= radius <= stops_within_max_radius:
+        return bad_request_response("The radius must be between 0 and {} meters.".format(stops_within_max_radius))
 
-    return jsonify({
-        'color': "#" + colormap[data_line_color["achtergrond"]["code"]],
-        'responseCode': 200
+    return stops_response(StopIndex.within, lat, long, radius)
+
+
+@app.route('/tiles/stops/<int:z>/<int:x>/<int:y>')
+def get_stop_tile(z: int, x: int, y: int) -> (Response, int):
+    """
+        Retrieve the stops in the specified map tile as GeoJSON. Up to config.tile_cluster_max_zoom,
+        stops that are close to each other are merged into cluster features.
+    """
+
+    if not tiles.is_valid_tile(z, x, y):
+        return bad_request_response("The tile {}/{}/{} does not exist.".format(z, x, y))
+
+    body = tiles.get_stop_tile(z, x, y)
+    if body is None:
+        return stops_unavailable_response()
+
+    return Response(body, mimetype="application/geo+json", headers={
+        'Cache-Control': "public, max-age=3600"
     }), 200
 
 
@@ -241,176 +421,247 @@ def get_weather(province_id: int, line_id: int, stop_id: int) -> (Response, int)
         Retrieve weather information for the specified stop.
     """
 
-    get_stop_resp, status_code = get_stops(province_id, line_id)
-    stops = json.loads(get_stop_resp.get_data())  # this is fine, JSON is always returned even in case of error!
+    try:
+        directions = get_line_directions(province_id, line_id)
+    except UpstreamError as e:
+        return jsonify({
+            'causeErrorStatus': 500,
+            'causeErrorMessage': e.message,
+            'errorMessage': "Cannot determine weather: cannot retrieve stops from internal API.",
+            'responseCode': 500
+        }), 500
 
-    if status_code != 200:
+    stop = find_stop(directions, stop_id)
+    if stop is None:
         return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': stops["errorMessage"] if "errorMessage" in stops else "",
+            'causeErrorStatus': -1,
+            'causeErrorMessage': "N/A",
+            'errorMessage': "Specified stop does not exist according to the DeLijn API.",
+            'responseCode': 500
+        }), 500
+
+    try:
+        weather = get_weather_at(stop.lat, stop.long)
+    except UpstreamError as e:
+        return upstream_error_response(e)
+
+    retval = weather.to_json()
+    retval['responseCode'] = 200
+
+    return jsonify(retval), 200
+
+
+@app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/weather/')
+def get_line_weather(province_id: int, line_id: int) -> (Response, int):
+    """
+        Retrieve weather information for every stop of the specified line. A stop of which the weather cannot be
+        retrieved gets "weather": null and the error document of get_weather() next to it. Only if this is the
+        case for every stop, the line gets the error document.
+    """
+
+    try:
+        directions = get_line_directions(province_id, line_id)
+    except UpstreamError as e:
+        return jsonify({
+            'causeErrorStatus': 500,
+            'causeErrorMessage': e.message,
             'errorMessage': "Cannot determine weather: cannot retrieve stops from internal API.",
             'responseCode': 500
         }), 500
 
-    for direction in stops["dirs"]:
-        for stop in direction['stops']:
-            if stop['id'] == stop_id:
-                lat = stop["coord"]["lat"]
-                long = stop["coord"]["long"]
-
-                # make call to weather API
-                url_weather = "http://api.openweathermap.org/data/2.5/weather?lat={}&lon={}&units=metric&appid={}".format(lat, long, open_weather_key)
-                flag, status_code, data_weather = make_get_request(url_weather)
-                if not flag:
-                    return jsonify({
-                        'causeErrorStatus': status_code,
-                        'causeErrorMessage': data_weather["message"] if "message" in data_weather else "",
-                        'errorMessage': "Cannot retrieve line colors from DeLijn API.",
-                        'responseCode': 500
-                    }), 500
-
-                return jsonify({
-                    'clouds':    float(data_weather["clouds"]["all"]),
-                    'windSpeed': (float(data_weather["wind"]["speed"]) * 3600.0) / 1000.0,
-                    'humidity':  float(data_weather["main"]["humidity"]),
-                    'temp':      float(data_weather["main"]["temp"]),
-                    'OWM_icon_url': "http://openweathermap.org/img/wn/{}@2x.png".format(data_weather["weather"][0]["icon"]),
-                    'responseCode': 200,
-                }), 200
+    # a stop that is part of both directions is only listed once
+    stops = list({stop.id: stop for direction in directions for stop in direction.stops}.values())
+
+    weather_list = get_weather_bulk([(stop.lat, stop.long) for stop in stops])
+
+    if len(weather_list) > 0 and all(isinstance(weather, UpstreamError) for weather in weather_list):
+        return upstream_error_response(weather_list[0])
 
     return jsonify({
-        'causeErrorStatus': -1,
-        'causeErrorMessage': "N/A",
-        'errorMessage': "Specified stop does not exist according to the DeLijn API.",
-        'responseCode': 500
-    }), 500
+        'stops': [
+            {
+                'id': stop.id,
+                'weather': weather.to_json()
+            } if not isinstance(weather, UpstreamError) else {
+                'id': stop.id,
+                'weather': None,
+                **upstream_error_json(weather)
+            } for stop, weather in zip(stops, weather_list)
+        ],
+        'responseCode': 200
+    }), 200
 
 
 @app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/vehicles/')
 def get_vehicles(province_id, line_id) -> (Response, int):
     """
         Retrieve a list of all vehicles on the specified line in the specified province.
+        With "?mode=segments" every vehicle also contains the segment (previous and next stop with their scheduled
+        times) it is driving on, and "validUntil" tells when the first of these segments ends or a new ride starts.
     """
 
-    get_stop_resp, status_code = get_stops(province_id, line_id)
-    stops = json.loads(get_stop_resp.get_data())  # this is fine, JSON is always returned even in case of error!
+    current_time = datetime.datetime.now()
 
-    if status_code != 200:
-        return jsonify({
-            'causeErrorStatus': status_code,
-            'causeErrorMessage': stops["errorMessage"] if "errorMessage" in stops else "",
-            'errorMessage': "Cannot retrieve vehicles: cannot retrieve stops from internal API.",
-            'responseCode': 500
-        }), 500
+    try:
+        positions = get_vehicle_positions(province_id, line_id, current_time)
+    except UpstreamError as e:
+        return jsonify(vehicles_error_json(e)), 500
 
-    retval = {
-        'dirs': [],
-        'responseCode': 200
-    }
+    segments = request.args.get('mode') == "segments"
 
-    # foreach direction
-    for direction in stops["dirs"]:
-        dir_type = direction["type"]
-        dir_name = direction["name"]
+    def make_json() -> dict:
+        retval = vehicles_json(positions, current_time, segments)
+        retval['responseCode'] = 200
+        return retval
 
-        # there are not stops for this direction => this direction is useless
-        if len(direction["stops"]) == 0:
-            continue
+    def make_columnar() -> dict:
+        # segments are not columnar, these get the JSON document encoded as MessagePack
+        if segments:
+            return make_json()
 
-        # map stop ids to stop data
-        stop_map = {
-            stop["id"]: stop for stop in direction["stops"]
+        return {
+            'dirs': [direction_vehicles.to_columnar() for direction_vehicles in positions],
+            'responseCode': 200
         }
 
-        url_ritten = "https://api.delijn.be/DLKernOpenData/api/v1/lijnen/{}/{}/lijnrichtingen/{}/dienstregelingen".format(province_id, line_id, dir_type)
-        flag, status_code, data_ritten = make_get_request(url_ritten, headers=delijn_req_header)
-        if not flag:
-            jsonify({
-                'causeErrorStatus': status_code,
-                'causeErrorMessage': data_ritten["boodschap"] if "boodschap" in data_ritten else "",
-                'errorMessage': "Cannot retrieve schedule from DeLijn API.",
-                'responseCode': 500,
-            }), 500
-
-        vehicles = []
-
-        # foreach rit
-        for rit in data_ritten["ritDoorkomsten"]:
-            doorkomsten = [doorkomst for doorkomst in rit["doorkomsten"] if "dienstregelingTijdstip" in doorkomst and int(doorkomst["haltenummer"]) in stop_map]
-
-            # rit moet minstens twee haltes hebben
-            if len(doorkomsten) < 2:
-                continue
-
-            rit_nr = int(rit["ritnummer"])
-
-            # get begin,end time of this ride
-            begin_time_string = doorkomsten[0]["dienstregelingTijdstip"]
-            end_time_string = doorkomsten[-1]["dienstregelingTijdstip"]
-
-            time_format_str = "%Y-%m-%dT%H:%M:%S"
-            begin_time = datetime.datetime.strptime(begin_time_string, time_format_str)
-            end_time = datetime.datetime.strptime(end_time_string, time_format_str)
-            current_time = datetime.datetime.now()
-
-            # determine if rit is relevant w.r.t. current time
-            if current_time.time() < begin_time.time():
-                # rit is niet valid want de begintijd is not niet aangebroken
-                # alle volgende ritten zullen ook niet geldig zijn want deze beginnen later
-                break
-
-            elif end_time.time() < current_time.time():
-                # deze rit is niet geldig want deze is al afgelopen
-                # latere ritten kunnen wel nog geldig zijn
-                continue
-
-            prev_stop_id = None
-            next_stop_id = None
-
-            # foreach halte i = 0 -> n-2
-            for i in range(0, len(doorkomsten)-1):
-                prev_stop = doorkomsten[i]
-                next_stop = doorkomsten[i+1]
-
-                prev_stop_id = int(prev_stop["haltenummer"])
-                next_stop_id = int(next_stop["haltenummer"])
-
-                prev_stop_time = datetime.datetime.strptime(prev_stop["dienstregelingTijdstip"], time_format_str)
-                next_stop_time = datetime.datetime.strptime(next_stop["dienstregelingTijdstip"], time_format_str)
-
-                # check if vehicle is in between stops
-                if prev_stop_time.time() <= current_time.time() and current_time.time() <= next_stop_time.time():
-                    break  # stop checking for other stops
-
-            if prev_stop_id is None or next_stop_id is None:
-                # vehicle was not found
-                continue
-
-            # get coords
-            prev_coords = [stop_map[prev_stop_id]["coord"]["lat"], stop_map[prev_stop_id]["coord"]["long"]]
-            next_coords = [stop_map[next_stop_id]["coord"]["lat"], stop_map[next_stop_id]["coord"]["long"]]
-
-            # interpolate
-            time_frac = (current_time - prev_stop_time) / (next_stop_time - prev_stop_time)
-
-            lat_vehicle = prev_coords[0] + (next_coords[0] - prev_coords[0]) * time_frac
-            long_vehicle = prev_coords[1] + (next_coords[1] - prev_coords[1]) * time_frac
-
-            vehicles.append({
-                "seqNr": rit_nr,
-                "coord": {
-                    "lat": lat_vehicle,
-                    "long": long_vehicle
-                }
-            })
-
-        retval["dirs"].append({
-            "name": dir_name,
-            "type": dir_type,
-            "vehicles": vehicles
-        })
+    return negotiated_response(request, 200, make_json, make_columnar)
 
-    return jsonify(retval), 200
+
+def parse_moment(value: str, day: datetime.date) -> (datetime.datetime, bool):
+    """
+        Parse "HH:MM[:SS]" (on the specified day) or "YYYY-MM-DDTHH:MM[:SS]". This returns (moment, whether
+        only a time was specified). Raises ValueError if the value is neither.
+    """
+
+    if "T" in value:
+        return datetime.datetime.fromisoformat(value), False
+
+    return datetime.datetime.combine(day, datetime.time.fromisoformat(value)), True
+
+
+@app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/vehicles/range/')
+def get_vehicles_range(province_id: int, line_id: int) -> (Response, int):
+    """
+        Retrieve the positions of all vehicles on the specified line every "step" seconds (default 10) from "start" up
+        to and including "end", e.g. "?start=07:00&end=09:00&step=10". Times without a date are taken on the current
+        day, and an end time before the start time is taken on the next day. Every direction contains a
+        (times x vehicles) matrix of latitudes and one of longitudes, with null where a vehicle is not under way.
+    """
+
+    today = datetime.date.today()
+
+    try:
+        start, start_time_only = parse_moment(request.args['start'], today)
+        end, end_time_only = parse_moment(request.args['end'], today)
+        step = float(request.args.get('step', 10))
+    except (KeyError, ValueError):
+        return bad_request_response("Specify the range as '?start=<HH:MM[:SS]>&end=<HH:MM[:SS]>&step=<seconds>' (times may include a date).")
+
+    # a range such as 23:00 - 01:00 crosses midnight
+    if start_time_only and end_time_only and end < start:
+        end += datetime.timedelta(days=1)
+
+    if step <= 0 or end < start:
+        return bad_request_response("The step must be positive and the end must not be before the start.")
+
+    num_moments = int((end - start).total_seconds() // step) + 1
+    if num_moments > vehicles_range_max_moments:
+        return bad_request_response("At most {} moments can be evaluated at once.".format(vehicles_range_max_moments))
+
+    moments = [start + datetime.timedelta(seconds=i * step) for i in range(num_moments)]
+
+    try:
+        trajectories = get_vehicle_positions_range(province_id, line_id, moments)
+    except UpstreamError as e:
+        return jsonify(vehicles_error_json(e)), 500
+
+    def make_document(direction_to_document) -> dict:
+        return {
+            'times': [moment.strftime("%Y-%m-%dT%H:%M:%S") for moment in moments],
+            'dirs': [direction_to_document(direction_trajectories) for direction_trajectories in trajectories],
+            'responseCode': 200
+        }
+
+    return negotiated_response(request, 200, lambda: make_document(DirectionTrajectories.to_json), lambda: make_document(DirectionTrajectories.to_columnar))
+
+
+def vehicles_json(positions: list, current_time: datetime.datetime, segments: bool) -> dict:
+    """
+        Retrieve the JSON document with the specified vehicle positions of a single line. If "segments" is set,
+        the segment every vehicle is on is included as well, so the client can animate it by itself.
+    """
+
+    if not segments:
+        return {
+            'dirs': [direction_vehicles.to_json() for direction_vehicles in positions]
+        }
+
+    midnight = datetime.datetime.combine(current_time.date(), datetime.time())
+    seconds = seconds_since_midnight(current_time)
+
+    valid_until = [moment for moment in (direction_vehicles.valid_until(seconds) for direction_vehicles in positions) if moment is not None]
+
+    return {
+        'dirs': [direction_vehicles.to_segments_json(midnight) for direction_vehicles in positions],
+        'time': format_time(midnight, int(seconds)),
+        'validUntil': format_time(midnight, min(valid_until)) if len(valid_until) > 0 else None
+    }
+
+
+@app.route('/api/vehicles/')
+def get_vehicles_batch() -> (Response, int):
+    """
+        Retrieve the vehicles of several lines at once. The lines are specified as "?lines=1:32,1:33" (province:line).
+        Every line gets the same document as get_vehicles(), or its error document if it cannot be retrieved.
+        "?mode=segments" is supported as well.
+    """
+
+    try:
+        keys = [tuple(int(part) for part in pair.split(":")) for pair in request.args.get('lines', "").split(",") if pair != ""]
+    except ValueError:
+        keys = None
+
+    if keys is None or len(keys) == 0 or any(len(key) != 2 for key in keys):
+        return bad_request_response("Specify the lines as '?lines=<province>:<line>,<province>:<line>,...'.")
+
+    # the same line is only computed once
+    keys = list(dict.fromkeys(keys))
+
+    if len(keys) > batch_max_lines:
+        return bad_request_response("At most {} lines can be retrieved at once.".format(batch_max_lines))
+
+    current_time = datetime.datetime.now()
+    segments = request.args.get('mode') == "segments"
+
+    lines = []
+    for key, positions in get_vehicle_positions_batch(keys, current_time).items():
+        if isinstance(positions, UpstreamError):
+            line = vehicles_error_json(positions)
+        else:
+            line = vehicles_json(positions, current_time, segments)
+            line['responseCode'] = 200
+
+        line['province'] = key[0]
+        line['line'] = key[1]
+        lines.append(line)
+
+    return jsonify({
+        'lines': lines,
+        'responseCode': 200
+    }), 200
+
+
+@app.route('/api/provinces/<int:province_id>/lines/<int:line_id>/vehicles/stream/')
+def stream_vehicles(province_id: int, line_id: int) -> Response:
+    """
+        Stream the positions of all vehicles on the specified line as Server-Sent Events. Every event
+        contains the same JSON document as get_vehicles(), an "error" event contains the error document.
+    """
+
+    return Response(vehicle_broadcaster.stream(province_id, line_id), mimetype="text/event-stream", headers={
+        'Cache-Control': "no-cache",
+        'X-Accel-Buffering': "no"
+    })
 
 
 if __name__ == '__main__':
@@ -0,0 +1,295 @@
+"""
+    Serves app.py with an ASGI server instead of the Flask development server, e.g.:
+
+        uvicorn asgi:application --port 5000
+
+    The upstream data that a request needs is retrieved on the event loop with the async upstream client before the
+    Flask view runs, so requests that wait for the DeLijn or OpenWeatherMap API do not hold a thread:
+
+    - the lines of the stops, vehicles and weather views, which the view finds in its request memo (see
+      request_memoized()),
+    - the weather of the stops of the weather views, which the view finds in the weather cache,
+    - the provinces, lines and colors that are not in the reference snapshot (yet), which the view finds in the
+      upstream cache.
+
+    The view then runs on one of config.asgi_render_threads threads, so the responses are exactly those of app.py.
+    NOTE: data that could not be prefetched (an upstream error other than of a line) is retrieved again by the view,
+    which then does hold its thread. Vehicle streams are served on the event loop as well.
+"""
+
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import reference
+from app import PREFETCHED_ENVIRON_KEY, app
+from async_upstream import close_async_clients, make_get_request_async
+from config import asgi_render_threads, batch_max_lines, delijn_req_header, vehicle_stream_keepalive
+from metrics import http_request_duration, http_requests_in_flight
+from service import UpstreamError, find_stop, get_line_directions_async
+from stream import LoopSubscriber, vehicle_broadcaster
+from weather import get_cell, get_cell_weather_async
+
+# pool on which the Flask views run
+render_pool = ThreadPoolExecutor(max_workers=asgi_render_threads)
+
+# paths of the views that need the directions of a single line
+LINE_PATH = re.compile(r"^/api/provinces/(\d+)/lines/(\d+)/(stops|vehicles|weather)/")
+
+# path of the batch vehicles view, which needs the directions of the lines in "?lines="
+BATCH_PATH = "/api/vehicles/"
+
+# paths of the views that need the weather of all stops of a line, or of a single stop
+WEATHER_PATH = re.compile(r"^/api/provinces/(\d+)/lines/(\d+)/(?:stops/(\d+)/)?weather/$")
+
+# paths of the views that read the reference snapshot: provinces, lines of a province and color of a line
+REFERENCE_PATH = re.compile(r"^/api/provinces/(?:(\d+)/lines/(?:(\d+)/color/)?)?$")
+
+STREAM_PATH = re.compile(r"^/api/provinces/(\d+)/lines/(\d+)/vehicles/stream/$")
+STREAM_RULE = "/api/provinces/<int:province_id>/lines/<int:line_id>/vehicles/stream/"
+
+
+async def application(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await serve_lifespan(receive, send)
+        return
+
+    if scope["type"] != "http":
+        return  # websockets are not supported
+
+    match = STREAM_PATH.match(scope["path"])
+    if match and scope["method"] == "GET":
+        await serve_stream(int(match.group(1)), int(match.group(2)), receive, send)
+        return
+
+    environ = make_environ(scope, await read_body(receive))
+    if scope["method"] in ("GET", "HEAD"):
+        environ[PREFETCHED_ENVIRON_KEY] = await prefetch(scope["path"], environ["QUERY_STRING"])
+
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(render_pool, call_wsgi, environ)
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def prefetch(path: str, query_string: str) -> dict:
+    """
+        Retrieve the upstream data that the view of the specified path will need. This returns the lines as the memo
+        of request_memoized(), the rest ends up in the caches that the view reads. A line that cannot be retrieved is
+        remembered as its UpstreamError, so the view reports it without trying again.
+    """
+
+    match = REFERENCE_PATH.match(path)
+    if match:
+        await prefetch_reference(*[int(group) if group is not None else None for group in match.groups()])
+        return {}
+
+    match = LINE_PATH.match(path)
+    if match:
+        keys = [(int(match.group(1)), int(match.group(2)))]
+    elif path == BATCH_PATH:
+        keys = get_batch_keys(query_string)
+    else:
+        return {}
+
+    results = await asyncio.gather(*[get_line_directions_async(*key) for key in keys], return_exceptions=True)
+
+    # NOTE: other exceptions are left to the view, which then retrieves the line by itself
+    memo = {
+        ("get_line_directions",) + key: result for key, result in zip(keys, results) if isinstance(result, (list, UpstreamError))
+    }
+
+    match = WEATHER_PATH.match(path)
+    if match and isinstance(results[0], list):
+        await prefetch_weather(results[0], int(match.group(3)) if match.group(3) is not None else None)
+
+    return memo
+
+
+async def prefetch_reference(province_id: int, line_id: int) -> None:
+    """
+        Retrieve the reference data that is not in the snapshot into the upstream cache (see reference.get_missing_urls()).
+    """
+
+    # NOTE: errors are left to the view, which reports them after trying again
+    await asyncio.gather(*[
+        make_get_request_async(url, headers=delijn_req_header) for url in reference.get_missing_urls(province_id, line_id)
+    ], return_exceptions=True)
+
+
+async def prefetch_weather(directions: list, stop_id: int) -> None:
+    """
+        Retrieve the weather of the stops of a line, or of the specified stop only, into the weather cache.
+    """
+
+    if stop_id is not None:
+        stop = find_stop(directions, stop_id)
+        stops = [stop] if stop is not None else []
+    else:
+        stops = [stop for direction in directions for stop in direction.stops]
+
+    # NOTE: errors are left to the view, which reports them after trying again
+    await asyncio.gather(*[get_cell_weather_async(cell) for cell in {get_cell(stop.lat, stop.long) for stop in stops}], return_exceptions=True)
+
+
+def get_batch_keys(query_string: str) -> list:
+    """
+        Retrieve the lines of a batch vehicles request like app.get_vehicles_batch() does, or an empty list if the
+        view rejects them anyway.
+    """
+
+    try:
+        keys = [tuple(int(part) for part in pair.split(":")) for pair in parse_qs(query_string).get("lines", [""])[0].split(",") if pair != ""]
+    except ValueError:
+        return []
+
+    keys = list(dict.fromkeys(keys))
+    if len(keys) > batch_max_lines or any(len(key) != 2 for key in keys):
+        return []
+
+    return keys
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    return body
+
+
+def make_environ(scope, body: bytes) -> dict:
+    """
+        Build the WSGI environ of an ASGI HTTP request.
+    """
+
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+
+        value = value.decode("latin1")
+        environ[key] = environ[key] + "," + value if key in environ else value
+
+    return environ
+
+
+def call_wsgi(environ: dict) -> (int, list, bytes):
+    """
+        Let the Flask app handle a request. This returns (status code, headers, body).
+    """
+
+    response = {}
+    chunks = []
+
+    def start_response(status: str, headers: list, exc_info=None):
+        response['status'] = int(status.split(" ", 1)[0])
+        response['headers'] = headers
+        return chunks.append
+
+    body = app(environ, start_response)
+    try:
+        chunks.extend(body)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+    return response['status'], response['headers'], b"".join(chunks)
+
+
+async def serve_stream(province_id: int, line_id: int, receive, send) -> None:
+    """
+        Like app.stream_vehicles(), but an open stream only waits on the event loop instead of holding a thread.
+    """
+
+    start = time.perf_counter()
+    http_requests_in_flight.inc()
+
+    subscriber = vehicle_broadcaster.subscribe(province_id, line_id, LoopSubscriber(asyncio.get_running_loop()))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ]
+        })
+        http_request_duration.observe(time.perf_counter() - start, ("GET", STREAM_RULE, "200"))
+
+        while True:
+            getter = asyncio.ensure_future(subscriber.get(vehicle_stream_keepalive))
+            await asyncio.wait({getter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+
+            if disconnected.done():
+                getter.cancel()
+                break
+
+            event = getter.result()
+            await send({
+                "type": "http.response.body",
+                "body": (event if event is not None else ": keepalive\n\n").encode(),
+                "more_body": True
+            })
+    finally:
+        disconnected.cancel()
+        vehicle_broadcaster.unsubscribe(province_id, line_id, subscriber)
+        http_requests_in_flight.dec()
+
+
+async def wait_for_disconnect(receive) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def serve_lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,193 @@
+import asyncio
+import time
+
+from config import singleflight_timeout, upstream_async_connections, upstream_connect_timeout, upstream_deadline, upstream_max_retries
+from delijn_client import RETRYABLE_STATUS_CODES, UpstreamClient, UpstreamUnavailable, get_client
+from log import logger
+from metrics import upstream_errors, upstream_request_duration, upstream_requests_in_flight
+from singleflight import AsyncSingleFlight, SingleFlightTimeout
+from upstream import get_cache_key, get_endpoint_class, get_metric_labels, handle_response, revalidate_in_background, upstream_cache
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None  # aiohttp is only needed to serve the app with an ASGI server (see asgi.py)
+
+# upstream calls of coroutines that are in progress, so identical concurrent calls can share them
+async_upstream_flight = AsyncSingleFlight()
+
+
+class AsyncUpstreamClient:
+    """
+        Makes GET requests to an upstream API on the event loop, over a pool of keep-alive connections. The rate
+        limit, circuit breaker and counters are those of the (synchronous) UpstreamClient of the same API, so
+        both kinds of calls count towards the same quota.
+    """
+
+    def __init__(self, client: UpstreamClient):
+        self.client = client
+        self.session = None
+
+    def get_session(self):
+        # NOTE: a session belongs to the event loop on which it is created, so it is created on first use
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=upstream_async_connections))
+
+        return self.session
+
+    async def acquire(self, deadline: float) -> bool:
+        """
+            Take a token of the rate limit, waiting until one is available. Returns False if this is not possible
+            before the deadline.
+        """
+
+        while True:
+            wait = self.client.bucket.try_acquire()
+            if wait == 0.0:
+                return True
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            await asyncio.sleep(min(wait, remaining))
+
+    async def get(self, url: str, deadline: float = None, **kwargs) -> (int, bytes):
+        """
+            Send a GET request and return (status code, body), like UpstreamClient.get().
+            Raises UpstreamUnavailable if no response can be obtained in time.
+        """
+
+        client = self.client
+
+        if deadline is None:
+            deadline = time.monotonic() + upstream_deadline
+
+        attempt = 0
+        while True:
+            if not await self.acquire(deadline):
+                client.rejected += 1
+                raise UpstreamUnavailable(429, "{} rate limit: no call possible before the deadline".format(client.name))
+
+            # NOTE: every call that the breaker allows must be recorded, so this check comes right before the call
+            epoch = client.breaker.allow()
+            if epoch is None:
+                client.rejected += 1
+                raise UpstreamUnavailable(503, "{} is unavailable (circuit breaker open)".format(client.name))
+
+            remaining = max(deadline - time.monotonic(), 0.001)
+            client.calls += 1
+
+            try:
+                timeout = aiohttp.ClientTimeout(total=remaining, connect=min(upstream_connect_timeout, remaining))
+                async with self.get_session().get(url, timeout=timeout, **kwargs) as resp:
+                    status_code, content = resp.status, await resp.read()
+
+                ok = status_code not in RETRYABLE_STATUS_CODES
+                error = None if ok else UpstreamUnavailable(status_code, "{} responded with status {}".format(client.name, status_code))
+            except asyncio.TimeoutError:
+                status_code, ok = None, False
+                error = UpstreamUnavailable(504, "{} did not respond in time".format(client.name))
+            except aiohttp.ClientError:
+                status_code, ok = None, False
+                error = UpstreamUnavailable(502, "cannot connect to {}".format(client.name))
+
+            client.breaker.record(epoch, ok)
+
+            if ok:
+                return status_code, content
+
+            # back off before trying again, if there is time left for it
+            backoff = 0.2 * (2 ** attempt)
+            if attempt >= upstream_max_retries or time.monotonic() + backoff >= deadline:
+                if status_code is not None:
+                    return status_code, content     # the caller reports the error data of the upstream
+                raise error
+
+            attempt += 1
+            client.retries += 1
+            await asyncio.sleep(backoff)
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# UpstreamClient -> AsyncUpstreamClient
+async_clients = {}
+
+
+def get_async_client(url: str) -> AsyncUpstreamClient:
+    """
+        Retrieve the async client that must be used for the specified URL.
+    """
+
+    client = get_client(url)
+    if client not in async_clients:
+        async_clients[client] = AsyncUpstreamClient(client)
+
+    return async_clients[client]
+
+
+async def close_async_clients() -> None:
+    for async_client in async_clients.values():
+        await async_client.close()
+
+
+async def make_get_request_async(url, **kwargs) -> (bool, dict):
+    """
+        Like make_get_request(), but the call is made on the event loop. Responses are shared with the synchronous
+        calls through the upstream cache. A stale response is refreshed on a background thread like make_get_request()
+        does. Calls on the event loop do not take part in the priorities of the rate limit: they only get a token when
+        no synchronous call is waiting for one.
+    """
+
+    endpoint_class = get_endpoint_class(url)
+    cache_key = get_cache_key(url, **kwargs)
+
+    if endpoint_class is not None:
+        found, fresh, data = upstream_cache.get(cache_key)
+
+        if found:
+            if not fresh:
+                revalidate_in_background(cache_key, endpoint_class, url, **kwargs)
+            return True, 200, data
+
+    cache_key_to_store = cache_key if endpoint_class is not None else None
+
+    try:
+        return await async_upstream_flight.do(
+            cache_key, lambda: send_get_request_async(url, cache_key_to_store, endpoint_class, **kwargs), singleflight_timeout
+        )
+    except SingleFlightTimeout:
+        return False, 504, {
+            "boodschap": "timed out waiting for an identical request to '{}'".format(url)
+        }
+
+
+async def send_get_request_async(url, cache_key=None, endpoint_class=None, **kwargs) -> (bool, dict):
+    """
+        Like send_get_request(), but the call is made on the event loop.
+    """
+
+    host, endpoint = get_metric_labels(url)
+
+    upstream_requests_in_flight.inc((host,))
+    start = time.perf_counter()
+    try:
+        status_code, content = await get_async_client(url).get(url, **kwargs)
+    except UpstreamUnavailable as e:
+        upstream_errors.inc((host, endpoint, str(e.status_code)))
+        logger.warning("Cannot make upstream call.", extra={'fields': {'url': url, 'status': e.status_code, 'reason': e.message}})
+        return False, e.status_code, {
+            "boodschap": e.message
+        }
+    finally:
+        duration = time.perf_counter() - start
+        upstream_request_duration.observe(duration, (host, endpoint))
+        upstream_requests_in_flight.dec((host,))
+
+    logger.debug("Upstream call.", extra={'fields': {'url': url, 'status': status_code, 'duration': duration}})
+
+    return handle_response(url, status_code, content, cache_key, endpoint_class)
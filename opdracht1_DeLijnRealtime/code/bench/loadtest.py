@@ -0,0 +1,148 @@
+"""
+    Drive the /api/... endpoints of a running app at a fixed concurrency and report latency percentiles and
+    throughput per endpoint as JSON, so results can be compared between changes:
+
+        python bench/loadtest.py --url http://localhost:5000 --concurrency 16 --duration 30 --output result.json
+
+    The lines that are requested are discovered through the API itself (the first --lines lines of every
+    province), so the app is best pointed at standin.py.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def discover_targets(base_url: str, num_lines: int) -> dict:
+    """
+        Retrieve the URLs to request, grouped by endpoint name.
+    """
+
+    session = requests.Session()
+    provinces = session.get(base_url + "/api/provinces/").json()["provinces"]
+
+    keys = []
+    for province in provinces:
+        lines = session.get("{}/api/provinces/{}/lines/".format(base_url, province["id"])).json()["lines"]
+        keys.extend((province["id"], line["id"]) for line in lines[:num_lines])
+
+    stop_urls = []
+    for province_id, line_id in keys:
+        stops = session.get("{}/api/provinces/{}/lines/{}/stops/".format(base_url, province_id, line_id)).json()
+        for direction in stops.get("dirs", []):
+            stop_urls.extend(
+                "{}/api/provinces/{}/lines/{}/stops/{}/weather/".format(base_url, province_id, line_id, stop["id"])
+                for stop in direction["stops"]
+            )
+
+    line_url = base_url + "/api/provinces/{}/lines/{}"
+
+    return {
+        'provinces':      [base_url + "/api/provinces/"],
+        'lines':          ["{}/api/provinces/{}/lines/".format(base_url, province["id"]) for province in provinces],
+        'stops':          [line_url.format(*key) + "/stops/" for key in keys],
+        'color':          [line_url.format(*key) + "/color/" for key in keys],
+        'vehicles':       [line_url.format(*key) + "/vehicles/" for key in keys],
+        'vehiclesBatch':  ["{}/api/vehicles/?lines={}".format(base_url, ",".join("{}:{}".format(*key) for key in keys[:10]))],
+        'stopWeather':    stop_urls,
+        'lineWeather':    [line_url.format(*key) + "/weather/" for key in keys],
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if len(sorted_values) == 0:
+        return None
+
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput': (len(latencies) + errors) / elapsed if elapsed > 0 else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'mean': sum(latencies) / len(latencies) if latencies else None,
+    }
+
+
+def run(targets: dict, concurrency: int, duration: float, endpoints: list, seed: int) -> dict:
+    """
+        Request random targets of the specified endpoints from "concurrency" threads for "duration" seconds.
+        Latencies are reported in seconds.
+    """
+
+    endpoints = [endpoint for endpoint in endpoints if len(targets.get(endpoint, [])) > 0]
+
+    latencies = {endpoint: [] for endpoint in endpoints}
+    errors = {endpoint: 0 for endpoint in endpoints}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(seed + worker_id)
+        session = requests.Session()
+
+        while time.monotonic() < stop_at:
+            endpoint = rng.choice(endpoints)
+            url = rng.choice(targets[endpoint])
+
+            start = time.perf_counter()
+            try:
+                ok = session.get(url, headers={'Accept-Encoding': "gzip"}).status_code == 200
+            except requests.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+
+            with lock:
+                if ok:
+                    latencies[endpoint].append(latency)
+                else:
+                    errors[endpoint] += 1
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+    elapsed = time.monotonic() - start
+
+    all_latencies = [latency for endpoint in endpoints for latency in latencies[endpoint]]
+
+    return {
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'endpoints': {endpoint: summarize(latencies[endpoint], errors[endpoint], elapsed) for endpoint in endpoints},
+        'total': summarize(all_latencies, sum(errors.values()), elapsed),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the /api/... endpoints of the app.")
+    parser.add_argument("--url", default="http://localhost:5000", help="base URL of the app")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--lines", type=int, default=10, help="number of lines per province to request")
+    parser.add_argument("--endpoints", default="provinces,lines,stops,color,vehicles,vehiclesBatch,stopWeather,lineWeather",
+                        help="comma separated endpoint names")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON report to (default: stdout)")
+    args = parser.parse_args()
+
+    report = run(discover_targets(args.url, args.lines), args.concurrency, args.duration, args.endpoints.split(","), args.seed)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
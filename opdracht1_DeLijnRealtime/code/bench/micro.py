@@ -0,0 +1,267 @@
+"""
+    Micro-benchmarks of the functions on the hot paths of the app, on synthetic responses (see synthetic.py) of a
+    realistic size. Every benchmark reports its throughput and the memory it allocates per call, and is compared
+    against a stored baseline, so the effect of an optimization can be shown:
+
+        python bench/micro.py --save-baseline bench/micro_baseline.json     # before the change
+        python bench/micro.py --baseline bench/micro_baseline.json          # after the change
+
+    With --baseline, the exit code is 1 if a benchmark became slower than the baseline by more than --tolerance.
+    Baselines are only comparable on the same machine, so a baseline stores the machine and the Python version it was
+    recorded on. bench/micro_baseline.json is the baseline of the current code, with the default settings.
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule import CompiledSchedule, seconds_since_midnight  # noqa: E402
+from service import Direction, get_sorted_stoplist, line_vehicle_positions, stops_json  # noqa: E402
+from synthetic import make_dienstregelingen, make_haltes  # noqa: E402
+
+
+def make_line(num_stops: int, num_rides: int, day: datetime.date, seed: int) -> (dict, list):
+    """
+        Generate (haltes response, directions) of a single line, as get_line_directions() retrieves it.
+    """
+
+    rng = random.Random(seed)
+
+    data_stops = make_haltes(1000, num_stops, rng)
+    stop_ids = [int(halte["haltenummer"]) for halte in data_stops["haltes"]]
+
+    directions = []
+    for dir_type, dir_stop_ids in (("HEEN", stop_ids), ("TERUG", stop_ids[::-1])):
+        data_rides = make_dienstregelingen(dir_stop_ids, num_rides, day, rng)
+
+        directions.append(Direction(
+            type=dir_type,
+            name="Lijn 1 {}".format(dir_type.lower()),
+            stops=get_sorted_stoplist(data_stops, data_rides),
+            ride_data=data_rides,
+            schedule_url="micro/lijnen/1/1/lijnrichtingen/{}/dienstregelingen".format(dir_type)
+        ))
+
+    return data_stops, directions
+
+
+def make_benchmarks(num_stops: int, num_rides: int, seed: int) -> dict:
+    """
+        Retrieve the benchmarks as name -> function without arguments.
+    """
+
+    day = datetime.date.today()
+    data_stops, directions = make_line(num_stops, num_rides, day, seed)
+    direction = directions[0]
+    schedule = CompiledSchedule(direction.ride_data, direction.stop_map)
+
+    # the moments at which the vehicles are located go round the day, so every call searches other segments
+    moments = [datetime.datetime.combine(day, datetime.time(hour=5)) + datetime.timedelta(seconds=37 * i) for i in range(1000)]
+    moment_seconds = [seconds_since_midnight(moment) for moment in moments]
+    counter = iter(range(1 << 62))
+
+    def sorted_stoplist():
+        get_sorted_stoplist(data_stops, direction.ride_data)
+
+    def compile_schedule():
+        CompiledSchedule(direction.ride_data, direction.stop_map)
+
+    def segment_search():
+        schedule.interpolate(moment_seconds[next(counter) % len(moment_seconds)])
+
+    def vehicles_response():
+        positions = line_vehicle_positions(directions, moments[next(counter) % len(moments)])
+        json.dumps({'dirs': [direction_vehicles.to_json() for direction_vehicles in positions], 'responseCode': 200})
+
+    def stops_response():
+        retval = stops_json(directions)
+        retval['responseCode'] = 200
+        json.dumps(retval)
+
+    # compile the schedules once, like the schedule cache does
+    for line_direction in directions:
+        line_direction.get_schedule()
+
+    return {
+        'get_sorted_stoplist': sorted_stoplist,
+        'compile_schedule': compile_schedule,
+        'segment_search': segment_search,
+        'vehicles_response': vehicles_response,
+        'stops_response': stops_response,
+    }
+
+
+def measure_speed(func, min_time: float, repeats: int) -> float:
+    """
+        Retrieve the number of calls per second: the best of "repeats" runs of at least "min_time" seconds each.
+    """
+
+    # determine the number of calls that takes at least min_time
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        elapsed = time.perf_counter() - start
+
+        if elapsed >= min_time:
+            break
+        calls *= 2
+
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, time.perf_counter() - start)
+
+    return calls / best
+
+
+def measure_allocations(func, calls: int = 20) -> (float, float):
+    """
+        Retrieve (peak of the memory allocated during a call, memory still allocated after a call) in bytes, as
+        traced by tracemalloc. The peak includes the temporary objects that are freed before the call returns.
+    """
+
+    func()  # warm up caches and lazily created objects
+
+    gc.collect()
+
+    peak = 0
+    retained = 0
+    for _ in range(calls):
+        # tracing starts afresh for every call, so the peak is that of the call (tracemalloc.reset_peak() needs Python 3.9)
+        tracemalloc.start()
+        try:
+            func()
+
+            call_retained, call_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        peak = max(peak, call_peak)
+        retained += call_retained
+
+    return peak, retained / calls
+
+
+def describe_machine() -> dict:
+    """
+        Describe the machine and the versions on which the results are measured.
+    """
+
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+    }
+
+
+def run(benchmarks: dict, min_time: float, repeats: int) -> dict:
+    results = {}
+
+    for name, func in benchmarks.items():
+        ops_per_sec = measure_speed(func, min_time, repeats)
+        peak_bytes, retained_bytes = measure_allocations(func)
+
+        results[name] = {
+            'opsPerSec': ops_per_sec,
+            'peakBytes': peak_bytes,
+            'retainedBytes': retained_bytes,
+        }
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """
+        Print the results next to the baseline. Returns False if a benchmark became slower than the baseline by more
+        than the tolerance (a fraction).
+    """
+
+    ok = True
+
+    print("{:<22} {:>12} {:>12} {:>8} {:>12} {:>12} {:>10}".format("benchmark", "ops/s", "baseline", "change", "peak bytes", "baseline", "retained"))
+
+    for name, result in results.items():
+        base = baseline.get(name)
+
+        if base is None:
+            print("{:<22} {:>12.0f} {:>12} {:>8} {:>12.0f} {:>12} {:>10.0f}".format(
+                name, result['opsPerSec'], "-", "-", result['peakBytes'], "-", result['retainedBytes']
+            ))
+            continue
+
+        change = result['opsPerSec'] / base['opsPerSec'] - 1.0
+        slower = change < -tolerance
+        ok = ok and not slower
+
+        print("{:<22} {:>12.0f} {:>12.0f} {:>+7.1f}% {:>12.0f} {:>12.0f} {:>10.0f}{}".format(
+            name, result['opsPerSec'], base['opsPerSec'], change * 100, result['peakBytes'], base['peakBytes'],
+            result['retainedBytes'], "  SLOWER" if slower else ""
+        ))
+
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the micro-benchmarks of the hot paths of the app.")
+    parser.add_argument("--stops", type=int, default=40, help="number of stops of the line")
+    parser.add_argument("--rides", type=int, default=300, help="number of rides per direction")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum duration of a measurement in seconds")
+    parser.add_argument("--repeats", type=int, default=5, help="number of measurements of which the best is kept")
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run (default: all)")
+    parser.add_argument("--baseline", help="JSON file with the results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="fraction by which a benchmark may be slower than the baseline")
+    parser.add_argument("--save-baseline", help="store the results as a baseline in this JSON file")
+    args = parser.parse_args()
+
+    benchmarks = make_benchmarks(args.stops, args.rides, args.seed)
+    if args.only is not None:
+        benchmarks = {name: func for name, func in benchmarks.items() if name in args.only}
+
+    results = run(benchmarks, args.min_time, args.repeats)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline_data = json.load(baseline_file)
+
+        baseline = baseline_data['results']
+
+        machine = baseline_data.get('machine')
+        if machine is not None:
+            print("baseline recorded on {} ({}, {} CPUs), Python {}, numpy {}".format(
+                machine['platform'], machine['processor'], machine['cpus'], machine['python'], machine['numpy']
+            ))
+
+    ok = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump({
+                'settings': {'stops': args.stops, 'rides': args.rides, 'seed': args.seed},
+                'machine': describe_machine(),
+                'results': results
+            }, baseline_file, indent=2)
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+    A local stand-in for the DeLijn and OpenWeatherMap APIs that replays recorded responses (fixtures), so the app
+    can be load tested without using any API quota. Start it, then point the app at it:
+
+        python bench/standin.py --fixtures bench/fixtures --port 5001 --latency 0.05 --jitter 0.02
+        DELIJN_API_URL=http://localhost:5001/delijn OPEN_WEATHER_API_URL=http://localhost:5001/owm python app.py
+
+    A fixture is the JSON body of a response, stored at "<fixtures>/delijn/<API path>.json" (e.g.
+    "delijn/lijnen/1/32/lijnrichtingen/HEEN/dienstregelingen.json") or "<fixtures>/owm/weather.json" (used for
+    every coordinate). Scheduled times in dienstregelingen are moved to the current day, so old recordings
+    keep working. With --record, missing fixtures are retrieved from the real APIs and stored first.
+    Use synthetic.py to generate a fixture directory without recording anything.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+import requests
+from flask import Flask, Response, request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import delijn_req_header, open_weather_key  # noqa: E402
+from store import shift_to_day  # noqa: E402
+
+REAL_DELIJN_API_URL = "https://api.delijn.be/DLKernOpenData/api/v1"
+REAL_OPEN_WEATHER_API_URL = "http://api.openweathermap.org/data/2.5"
+
+standin = Flask(__name__)
+
+settings = {
+    'fixtures': os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"),
+    'latency': 0.0,
+    'jitter': 0.0,
+    'record': False,
+}
+
+
+def record(fixture_path: str, upstream_url: str, **kwargs) -> bool:
+    """
+        Retrieve a response from a real API and store it as a fixture. Returns False if this is not possible.
+    """
+
+    resp = requests.get(upstream_url, timeout=10, **kwargs)
+    if not resp.ok:
+        return False
+
+    os.makedirs(os.path.dirname(fixture_path), exist_ok=True)
+    with open(fixture_path, "wb") as fixture_file:
+        fixture_file.write(resp.content)
+
+    return True
+
+
+def replay(fixture_path: str) -> (Response, int):
+    # simulate the latency of the real API
+    delay = settings['latency'] + random.uniform(-settings['jitter'], settings['jitter'])
+    if delay > 0:
+        time.sleep(delay)
+
+    if not os.path.isfile(fixture_path):
+        return Response(json.dumps({"boodschap": "no fixture for this request"}), status=404, mimetype="application/json")
+
+    with open(fixture_path) as fixture_file:
+        data = json.load(fixture_file)
+
+    if fixture_path.endswith("dienstregelingen.json"):
+        data = shift_to_day(data, datetime.date.today())
+
+    return Response(json.dumps(data), status=200, mimetype="application/json")
+
+
+@standin.route('/delijn/<path:path>')
+def delijn(path: str) -> (Response, int):
+    fixture_path = os.path.join(settings['fixtures'], "delijn", path.strip("/") + ".json")
+
+    if settings['record'] and not os.path.isfile(fixture_path):
+        record(fixture_path, "{}/{}".format(REAL_DELIJN_API_URL, path.strip("/")), headers=delijn_req_header)
+
+    return replay(fixture_path)
+
+
+@standin.route('/owm/weather')
+def weather() -> (Response, int):
+    fixture_path = os.path.join(settings['fixtures'], "owm", "weather.json")
+
+    if settings['record'] and not os.path.isfile(fixture_path):
+        record(fixture_path, "{}/weather".format(REAL_OPEN_WEATHER_API_URL), params={
+            'lat': request.args.get('lat'),
+            'lon': request.args.get('lon'),
+            'units': "metric",
+            'appid': open_weather_key
+        })
+
+    return replay(fixture_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded DeLijn/OpenWeatherMap responses.")
+    parser.add_argument("--fixtures", default=settings['fixtures'], help="directory with the fixtures")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random deviation of the latency")
+    parser.add_argument("--record", action="store_true", help="retrieve missing fixtures from the real APIs")
+    args = parser.parse_args()
+
+    settings['fixtures'] = args.fixtures
+    settings['latency'] = args.latency
+    settings['jitter'] = args.jitter
+    settings['record'] = args.record
+
+    standin.run(port=args.port, threaded=True)
@@ -0,0 +1,145 @@
+"""
+    Generate synthetic DeLijn API responses, and write them as a fixture directory for standin.py:
+
+        python bench/synthetic.py --output bench/fixtures --lines 20
+
+    The responses have the same shape as the real ones. Rides run from early morning until after midnight,
+    so the last rides of the day cross midnight.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+
+
+def make_haltes(first_stop_id: int, num_stops: int, rng: random.Random) -> dict:
+    """
+        Generate a "haltes" response with "num_stops" stops along a more or less straight route.
+    """
+
+    lat = rng.uniform(50.8, 51.3)
+    long = rng.uniform(3.0, 5.5)
+    heading_lat = rng.uniform(-0.004, 0.004)
+    heading_long = rng.uniform(-0.006, 0.006)
+
+    haltes = []
+    for i in range(num_stops):
+        lat += heading_lat + rng.uniform(-0.001, 0.001)
+        long += heading_long + rng.uniform(-0.001, 0.001)
+
+        haltes.append({
+            "entiteitnummer": "1",
+            "haltenummer": str(first_stop_id + i),
+            "omschrijving": "Halte {}".format(first_stop_id + i),
+            "omschrijvingGemeente": "Gemeente {}".format((first_stop_id + i) % 37),
+            "geoCoordinaat": {
+                "latitude": round(lat, 6),
+                "longitude": round(long, 6)
+            }
+        })
+
+    return {"haltes": haltes}
+
+
+def make_dienstregelingen(stop_ids: list, num_rides: int, day: datetime.date, rng: random.Random,
+                          first_departure: int = 5 * 3600, last_departure: int = 23 * 3600 + 30 * 60) -> dict:
+    """
+        Generate a "dienstregelingen" response with "num_rides" rides that visit the specified stops in order,
+        departing at regular intervals between "first_departure" and "last_departure" (seconds after midnight).
+    """
+
+    midnight = datetime.datetime.combine(day, datetime.time())
+    interval = (last_departure - first_departure) // max(num_rides - 1, 1)
+
+    # every ride takes the same time between two stops, like a real timetable
+    hops = [rng.randint(1, 4) * 60 for _ in range(len(stop_ids) - 1)]
+
+    rides = []
+    for r in range(num_rides):
+        moment = midnight + datetime.timedelta(seconds=first_departure + r * interval - (first_departure + r * interval) % 60)
+
+        doorkomsten = []
+        for i, stop_id in enumerate(stop_ids):
+            doorkomsten.append({
+                "haltenummer": str(stop_id),
+                "dienstregelingTijdstip": moment.strftime("%Y-%m-%dT%H:%M:%S")
+            })
+
+            if i < len(hops):
+                moment += datetime.timedelta(seconds=hops[i])
+
+        rides.append({
+            "ritnummer": str(1000 + r),
+            "doorkomsten": doorkomsten
+        })
+
+    return {"ritDoorkomsten": rides}
+
+
+def make_weather(rng: random.Random) -> dict:
+    return {
+        "clouds": {"all": rng.randint(0, 100)},
+        "wind": {"speed": round(rng.uniform(0, 12), 1)},
+        "main": {"humidity": rng.randint(40, 100), "temp": round(rng.uniform(-5, 30), 1)},
+        "weather": [{"icon": "04d"}]
+    }
+
+
+def make_fixtures(num_lines: int, num_stops: int, num_rides: int, day: datetime.date, seed: int = 42) -> dict:
+    """
+        Generate the responses of all DeLijn endpoints the app uses for a single province with "num_lines" lines.
+        This returns a dict that maps fixture paths (see standin.py) to responses.
+    """
+
+    rng = random.Random(seed)
+    fixtures = {
+        "delijn/entiteiten": {"entiteiten": [{"entiteitnummer": "1", "omschrijving": "Synthetisch"}]},
+        "delijn/kleuren": {"kleuren": [{"code": "C{}".format(i), "hex": "{:06X}".format(rng.randint(0, 0xFFFFFF))} for i in range(10)]},
+        "delijn/entiteiten/1/lijnen": {"lijnen": []},
+        "delijn/entiteiten/1/haltes": {"haltes": []},
+        "owm/weather": make_weather(rng),
+    }
+
+    for line_id in range(1, num_lines + 1):
+        fixtures["delijn/entiteiten/1/lijnen"]["lijnen"].append({"lijnnummer": str(line_id), "omschrijving": "Lijn {}".format(line_id)})
+        fixtures["delijn/lijnen/1/{}/lijnkleuren".format(line_id)] = {"achtergrond": {"code": "C{}".format(line_id % 10)}}
+        fixtures["delijn/lijnen/1/{}/lijnrichtingen".format(line_id)] = {
+            "lijnrichtingen": [
+                {"richting": "HEEN", "omschrijving": "Lijn {} heen".format(line_id)},
+                {"richting": "TERUG", "omschrijving": "Lijn {} terug".format(line_id)}
+            ]
+        }
+
+        haltes = make_haltes(line_id * 1000, num_stops, rng)
+        stop_ids = [int(halte["haltenummer"]) for halte in haltes["haltes"]]
+        fixtures["delijn/entiteiten/1/haltes"]["haltes"].extend(haltes["haltes"])
+
+        for dir_type, dir_stop_ids in (("HEEN", stop_ids), ("TERUG", stop_ids[::-1])):
+            prefix = "delijn/lijnen/1/{}/lijnrichtingen/{}".format(line_id, dir_type)
+            fixtures[prefix + "/haltes"] = haltes
+            fixtures[prefix + "/dienstregelingen"] = make_dienstregelingen(dir_stop_ids, num_rides, day, rng)
+
+    return fixtures
+
+
+def write_fixtures(fixtures: dict, directory: str) -> None:
+    for path, data in fixtures.items():
+        file_path = os.path.join(directory, path + ".json")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        with open(file_path, "w") as fixture_file:
+            json.dump(data, fixture_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic fixture directory for standin.py.")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--stops", type=int, default=30)
+    parser.add_argument("--rides", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    write_fixtures(make_fixtures(args.lines, args.stops, args.rides, datetime.date.today(), args.seed), args.output)
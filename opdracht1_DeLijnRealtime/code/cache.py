@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    """
+        A single cached value together with its bookkeeping information.
+    """
+
+    __slots__ = ("value", "size", "fresh_until", "stale_until")
+
+    def __init__(self, value, size: int, fresh_until: float, stale_until: float):
+        self.value = value
+        self.size = size
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """
+        A thread safe LRU cache with a budget expressed in bytes. Every entry has a TTL during which
+        it is fresh and an additional grace period during which it is stale but may still be served
+        while a new value is being retrieved (stale-while-revalidate).
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, count: bool = True) -> (bool, bool, object):
+        """
+            Look up the specified key. This will return (found, fresh, value). A value that is found
+            but not fresh is stale and should be refreshed by the caller. Lookups with "count" False
+            (e.g. those of background work) are left out of the hit and miss counters.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry.stale_until < now:
+                if entry is not None:
+                    self._remove(key)
+                if count:
+                    self.misses += 1
+                return False, False, None
+
+            self._entries.move_to_end(key)
+
+            if entry.fresh_until < now:
+                if count:
+                    self.stale_hits += 1
+                return True, False, entry.value
+
+            if count:
+                self.hits += 1
+            return True, True, entry.value
+
+    def put(self, key, value, size: int, ttl: float, stale_ttl: float = 0.0) -> None:
+        """
+            Store a value of approximately "size" bytes. Values that are larger than the
+            complete budget are not stored at all.
+        """
+
+        if size > self.max_bytes:
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = CacheEntry(value, size, now + ttl, now + ttl + stale_ttl)
+            self.current_bytes += size
+
+            # evict least recently used entries until we are within budget again
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def time_to_live(self, key):
+        """
+            Retrieve the number of seconds during which the entry of the specified key is still fresh (negative
+            if it is stale), or None if there is no such entry. This does not count as a lookup.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.stale_until < now:
+                return None
+
+            return entry.fresh_until - now
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        """
+            Retrieve the counters of this cache.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'staleHits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRatio': (self.hits + self.stale_hits) / lookups if lookups > 0 else 0.0,
+            }
+
+    def _remove(self, key) -> None:
+        # NOTE: the lock must be held by the caller
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+
+from flask import Request, Response
+
+from cache import TTLCache
+from config import compression_cache_max_bytes, compression_min_size, compression_ttl
+
+try:
+    import brotli
+except ImportError:
+    brotli = None   # brotli is optional, gzip is used when it is not installed
+
+# types of the responses that get an ETag and are compressed
+FINALIZED_MIMETYPES = {"application/json", "application/geo+json", "application/msgpack"}
+
+# headers of a response that are repeated in the 304 Not Modified that replaces it
+NOT_MODIFIED_HEADERS = ("ETag", "Vary", "Cache-Control", "Expires", "Content-Location")
+
+# compressed response bodies, keyed on (ETag of the uncompressed body, encoding)
+compression_cache = TTLCache(compression_cache_max_bytes)
+
+
+def compute_etag(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def choose_encoding(request: Request):
+    """
+        Retrieve the best content encoding that the client accepts, or None if it accepts none that we support.
+    """
+
+    if brotli is not None and request.accept_encodings["br"] > 0:
+        return "br"
+
+    if request.accept_encodings["gzip"] > 0:
+        return "gzip"
+
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+
+    return gzip.compress(body, compresslevel=6)
+
+
+def finalize_json_response(request: Request, response: Response) -> Response:
+    """
+        Add a strong ETag to a successful JSON (or MessagePack) response, answer a matching "If-None-Match" with
+        304 Not Modified, and compress the body if the client accepts it. Compressed bodies are cached by ETag, so identical
+        responses are only compressed once. Every encoding of a body is a separate representation with an ETag of its own.
+    """
+
+    if response.status_code != 200 or response.mimetype not in FINALIZED_MIMETYPES or response.is_streamed:
+        return response
+
+    body = response.get_data()
+    body_etag = compute_etag(body)
+
+    encoding = choose_encoding(request)
+    if len(body) < compression_min_size:
+        encoding = None
+
+    etag = body_etag if encoding is None else "{}-{}".format(body_etag, encoding)
+
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+
+    if request.if_none_match.contains(etag):
+        not_modified = Response(status=304)
+        # a 304 carries the headers that describe the representation like a 200 would (RFC 7232, section 4.1)
+        for header in NOT_MODIFIED_HEADERS:
+            if header in response.headers:
+                not_modified.headers[header] = response.headers[header]
+        return not_modified
+
+    if encoding is None:
+        return response
+
+    found, _, compressed = compression_cache.get((body_etag, encoding))
+    if not found:
+        compressed = compress(body, encoding)
+        compression_cache.put((body_etag, encoding), compressed, len(compressed), compression_ttl)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+
+    return response
@@ -0,0 +1,199 @@
+import os
+import re
+
+open_weather_key = "XXXX"
+
+# base URLs of the upstream APIs, these can be pointed elsewhere (e.g. bench/standin.py) through the environment
+delijn_api_url = os.environ.get("DELIJN_API_URL", "https://api.delijn.be/DLKernOpenData/api/v1")
+open_weather_api_url = os.environ.get("OPEN_WEATHER_API_URL", "http://api.openweathermap.org/data/2.5")
+
+delijn_req_header = {
+    'Ocp-Apim-Subscription-Key': 'XXXX'
+}
+
+# byte budget of the cache that holds upstream responses
+upstream_cache_max_bytes = 64 * 1024 * 1024
+
+# byte budget of the cache that holds compiled schedules (see schedule.py)
+schedule_cache_max_bytes = 32 * 1024 * 1024
+
+# number of threads of upstream.upstream_pool, which is shared by the whole process: the fan-out of every request
+# and the weather lookups. Its queue is first in, first out, whatever the priority of the calls (see delijn_client.py).
+upstream_pool_size = 8
+
+# classes of upstream endpoints that may be cached: (name, URL pattern, TTL, stale period), both in seconds
+# NOTE: the first matching pattern is used, so more specific patterns must come first.
+upstream_endpoint_classes = [
+    ("dienstregelingen", re.compile(r"/lijnrichtingen/[^/]+/dienstregelingen$"), 5 * 60, 60),
+    ("haltes",           re.compile(r"/lijnrichtingen/[^/]+/haltes$"),           6 * 3600, 24 * 3600),
+    ("lijnrichtingen",   re.compile(r"/lijnen/\d+/\d+/lijnrichtingen$"),         6 * 3600, 24 * 3600),
+    ("lijnkleuren",      re.compile(r"/lijnen/\d+/\d+/lijnkleuren$"),            24 * 3600, 24 * 3600),
+    ("lijnen",           re.compile(r"/entiteiten/\d+/lijnen$"),                 24 * 3600, 24 * 3600),
+    ("entiteithaltes",   re.compile(r"/entiteiten/\d+/haltes$"),                 24 * 3600, 24 * 3600),
+    ("entiteiten",       re.compile(r"/entiteiten$"),                            24 * 3600, 24 * 3600),
+    ("kleuren",          re.compile(r"/kleuren$"),                               24 * 3600, 24 * 3600),
+]
+
+# size (in degrees of latitude and longitude) of the grid cells that share a single weather report
+weather_cell_size = 0.02
+
+# number of seconds a weather report is used before it is retrieved again
+weather_ttl = 10 * 60
+
+# byte budget of the cache that holds weather reports
+weather_cache_max_bytes = 4 * 1024 * 1024
+
+# file in which the reference data (provinces, lines, colors, stops) is kept between restarts
+reference_snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "reference_snapshot.json")
+
+# number of seconds after which the reference data is downloaded again
+reference_refresh_interval = 24 * 3600
+
+# number of seconds to wait before trying again when the reference data cannot be downloaded
+reference_retry_interval = 5 * 60
+
+# number of background threads that download the reference data, separate from the upstream pool so the
+# thousands of calls of a snapshot never queue in front of the calls that requests are waiting for
+reference_pool_size = 2
+
+# size (in degrees of latitude and longitude) of the grid cells of the spatial stop index
+stop_index_cell_size = 0.01
+
+# maximum number of stops that can be requested from /api/stops/nearest
+stops_nearest_max = 100
+
+# /api/stops/nearest never returns stops farther away than this (in meters), which bounds the search around
+# coordinates that are far from all stops
+stops_nearest_max_distance = 20000
+
+# maximum radius (in meters) that can be requested from /api/stops/within
+stops_within_max_radius = 5000
+
+# highest zoom level for which stop tiles are served
+tile_max_zoom = 20
+
+# up to this zoom level, the stops in a tile are merged into clusters of "tile_cluster_size" by "tile_cluster_size" pixels
+tile_cluster_max_zoom = 14
+tile_cluster_size = 32
+
+# stop tiles up to this zoom level are generated as soon as the reference data is available
+tile_pregenerate_max_zoom = 10
+
+# byte budget of the cache that holds stop tiles, and the number of seconds a tile is kept
+# NOTE: tiles are dropped anyway when the reference data changes
+tile_cache_max_bytes = 32 * 1024 * 1024
+tile_ttl = 24 * 3600
+
+# number of seconds between two updates of the streamed vehicle positions
+vehicle_stream_interval = 5
+
+# number of seconds after which an idle vehicle stream sends a comment to keep the connection open
+vehicle_stream_keepalive = 15
+
+# number of seconds between two updates of the vehicle positions of a whole province
+province_vehicles_interval = 5
+
+# number of seconds after which the schedules of a line of a watched province are loaded again (see the dienstregelingen TTL)
+province_vehicles_reload_interval = 5 * 60
+
+# number of seconds without requests after which a province is no longer watched
+province_vehicles_idle_timeout = 10 * 60
+
+# maximum number of lines of a province that are loaded at the same time, by threads of their own
+province_vehicles_load_batch = 8
+
+# SQLite file with imported schedules (see importer.py), from which line directions are read instead of the DeLijn API
+# NOTE: lines that are not in the file are still retrieved from the DeLijn API
+schedule_store_path = os.environ.get("SCHEDULE_STORE")
+
+# byte budget of the cache that holds lines read from the schedule store, and the number of seconds a line is kept
+schedule_store_cache_max_bytes = 32 * 1024 * 1024
+schedule_store_ttl = 10 * 60
+
+# directory in which importer.py --publish puts the compiled schedules of the schedule store, which every worker
+# process then maps read-only instead of compiling its own copy (see shared_schedules.py)
+shared_schedules_dir = os.environ.get("SHARED_SCHEDULES")
+
+# number of seconds after which a worker checks whether a new generation of the shared schedules was published
+shared_schedules_check_interval = 10
+
+# half-life (in seconds) of the access counts of lines, which decide the lines that are prefetched
+prefetch_half_life = 3600
+
+# number of most used lines of which the upstream responses are refreshed before they expire, and warmed at startup
+prefetch_top_lines = 100
+
+# lines with a (decayed) access count below this are never prefetched, 0.5 is a single access one half-life ago
+prefetch_min_count = 0.5
+
+# cached responses of prefetched lines are refreshed when they stop being fresh within this number of seconds
+# NOTE: this must be larger than the prefetch interval and smaller than the TTL of dienstregelingen
+prefetch_margin = 60
+
+# number of seconds between two rounds of the prefetcher
+prefetch_interval = 30
+
+# file in which the access counts of lines are kept between restarts, and the number of seconds between two saves
+line_popularity_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "line_popularity.json")
+line_popularity_save_interval = 5 * 60
+
+# maximum number of moments at which the vehicles of a line can be evaluated in a single range request
+vehicles_range_max_moments = 2000
+
+# maximum number of lines in a single batch vehicles request
+batch_max_lines = 50
+
+# maximum number of lines of a batch vehicles request that are handled at the same time
+batch_pool_size = 8
+
+# maximum number of seconds to wait for an identical upstream call that is already in progress
+singleflight_timeout = 30
+
+# maximum number of open connections to an upstream API of the async client (when served with asgi.py)
+upstream_async_connections = 100
+
+# number of threads on which asgi.py runs the Flask views, once the upstream data of a request has been retrieved
+asgi_render_threads = 8
+
+# rate limit of our DeLijn subscription key: calls per second on average, and the largest burst
+delijn_rate_limit = 10
+delijn_burst = 20
+
+# rate limit of our OpenWeatherMap key (60 calls per minute)
+open_weather_rate_limit = 1
+open_weather_burst = 10
+
+# fraction of the rate limit (and of the burst) of an upstream API that calls with background priority (province
+# schedules, prefetching, revalidation, reference data) may use, the rest is always left to requests
+upstream_background_share = 0.5
+
+# number of seconds in which an upstream call (including waiting for the rate limit and retries) must complete
+upstream_deadline = 10
+
+# number of seconds in which a connection to an upstream API must be made
+upstream_connect_timeout = 3
+
+# number of times an upstream call is retried after a connection problem, throttling or a server error
+upstream_max_retries = 2
+
+# an upstream API is no longer called for "cooldown" seconds when more than "error rate" of the calls in the
+# last "window" seconds failed (with at least "min calls" calls in that window)
+upstream_breaker_window = 30
+upstream_breaker_error_rate = 0.5
+upstream_breaker_min_calls = 10
+upstream_breaker_cooldown = 15
+
+# JSON responses smaller than this number of bytes are not compressed
+compression_min_size = 1024
+
+# byte budget of the cache that holds compressed response bodies
+compression_cache_max_bytes = 16 * 1024 * 1024
+
+# number of seconds a compressed response body is kept
+compression_ttl = 10 * 60
+
+# level of the JSON log lines that are written to stderr (DEBUG logs every upstream call)
+log_level = os.environ.get("LOG_LEVEL", "INFO")
+
+# maximum number of log records waiting to be written, records beyond this are dropped
+log_queue_size = 10000
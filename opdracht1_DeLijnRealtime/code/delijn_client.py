@@ -0,0 +1,290 @@
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    delijn_burst, delijn_rate_limit, open_weather_api_url, open_weather_burst, open_weather_rate_limit,
+    upstream_background_share, upstream_breaker_cooldown, upstream_breaker_error_rate, upstream_breaker_min_calls,
+    upstream_breaker_window, upstream_connect_timeout, upstream_deadline, upstream_max_retries, upstream_pool_size
+)
+
+# priorities of upstream calls: callers that wait for a token of the rate limiter are served lowest value first
+# NOTE: this only orders the waits for tokens, not the queue of the executor that runs a call (e.g. upstream_pool)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# status codes after which a call may be retried, these also count as upstream errors for the circuit breaker
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """
+        Raised when an upstream call cannot be made or does not complete in time. "status_code" is the
+        HTTP status code that best describes the problem.
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class TokenBucket:
+    """
+        A rate limiter that allows "rate" calls per second on average and bursts of up to "burst" calls.
+        Callers that have to wait are served in order of priority and then in order of arrival.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+        self._waiters = []  # heap of (priority, arrival)
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, priority: int, deadline: float) -> bool:
+        """
+            Take a token, waiting until one is available. Returns False if this is not possible before the
+            deadline (a time.monotonic() value).
+        """
+
+        with self._cond:
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiters, ticket)
+
+            try:
+                while True:
+                    self._refill()
+
+                    first = self._waiters[0] == ticket
+                    if first and self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return True
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+
+                    # only the first waiter knows when the next token arrives, the others wait until it is served
+                    if first:
+                        self._cond.wait(min(remaining, (1.0 - self.tokens) / self.rate))
+                    else:
+                        self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def try_acquire(self) -> float:
+        """
+            Take a token without waiting. Callers that are waiting in acquire() go first. Returns 0 if a token
+            was taken, or else the number of seconds after which it makes sense to try again.
+        """
+
+        with self._cond:
+            self._refill()
+
+            if len(self._waiters) == 0 and self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+
+            return max((1.0 - self.tokens) / self.rate, 0.01)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class CircuitBreaker:
+    """
+        Stops calls to an upstream whose error rate over the last "window" seconds exceeds "error_rate" (after at
+        least "min_calls" calls). After "cooldown" seconds a single trial call is let through: if it succeeds
+        the breaker closes again, otherwise it stays open for another cooldown.
+
+        Every change of state starts a new epoch. Only outcomes of calls that were allowed in the current epoch
+        are counted, so a call that was started before the breaker opened cannot close it: while half-open, only
+        the trial call decides.
+    """
+
+    def __init__(self, window: float, error_rate: float, min_calls: int, cooldown: float):
+        self.window = window
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+        self._epoch = 0
+        self._outcomes = collections.deque()   # (time, ok)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+            Check whether a call may be made. Returns None if it may not, or else the epoch that must be passed
+            to record() together with the outcome of the call.
+        """
+
+        with self._lock:
+            if self.state == "closed":
+                return self._epoch
+
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self._set_state("half-open")
+                return self._epoch  # this is the trial call
+
+            return None
+
+    def record(self, epoch: int, ok: bool) -> None:
+        now = time.monotonic()
+
+        with self._lock:
+            if epoch != self._epoch:
+                return  # the call was allowed before the last change of state
+
+            if self.state == "half-open":
+                if ok:
+                    self._set_state("closed")
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, ok))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+
+            errors = sum(1 for _, outcome in self._outcomes if not outcome)
+            if self.state == "closed" and len(self._outcomes) >= self.min_calls and errors / len(self._outcomes) > self.error_rate:
+                self._open(now)
+
+    def _set_state(self, state: str) -> None:
+        # NOTE: the lock must be held by the caller
+        self.state = state
+        self._epoch += 1
+
+    def _open(self, now: float) -> None:
+        # NOTE: the lock must be held by the caller
+        self._set_state("open")
+        self.opened_at = now
+        self.times_opened += 1
+        self._outcomes.clear()
+
+
+class UpstreamClient:
+    """
+        Makes GET requests to a single upstream API over pooled keep-alive connections. Every call has a
+        deadline, is rate limited to the quota of our key, and is rejected right away while the circuit
+        breaker of the upstream is open.
+
+        Calls with background priority also need a token of a second bucket with "background_share" of the
+        rate and burst, so background work can never take more than that share of the quota.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, background_share: float = upstream_background_share):
+        self.name = name
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=upstream_pool_size * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.bucket = TokenBucket(rate, burst)
+        self.background_bucket = TokenBucket(rate * background_share, max(1, int(burst * background_share)))
+        self.breaker = CircuitBreaker(upstream_breaker_window, upstream_breaker_error_rate, upstream_breaker_min_calls, upstream_breaker_cooldown)
+
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def get(self, url: str, priority: int = PRIORITY_INTERACTIVE, deadline: float = None, **kwargs) -> requests.Response:
+        """
+            Send a GET request and return the response. Throttling, server errors and connection problems are
+            retried as long as the deadline (default: config.upstream_deadline seconds from now) allows it.
+            Raises UpstreamUnavailable if no response can be obtained in time.
+        """
+
+        if deadline is None:
+            deadline = time.monotonic() + upstream_deadline
+
+        attempt = 0
+        while True:
+            if priority != PRIORITY_INTERACTIVE and not self.background_bucket.acquire(priority, deadline):
+                self.rejected += 1
+                raise UpstreamUnavailable(429, "{} rate limit: no background call possible before the deadline".format(self.name))
+
+            if not self.bucket.acquire(priority, deadline):
+                self.rejected += 1
+                raise UpstreamUnavailable(429, "{} rate limit: no call possible before the deadline".format(self.name))
+
+            # NOTE: every call that the breaker allows must be recorded, so this check comes right before the call
+            epoch = self.breaker.allow()
+            if epoch is None:
+                self.rejected += 1
+                raise UpstreamUnavailable(503, "{} is unavailable (circuit breaker open)".format(self.name))
+
+            remaining = max(deadline - time.monotonic(), 0.001)
+            self.calls += 1
+
+            try:
+                resp = self.session.get(url, timeout=(min(upstream_connect_timeout, remaining), remaining), **kwargs)
+                ok = resp.status_code not in RETRYABLE_STATUS_CODES
+                error = None if ok else UpstreamUnavailable(resp.status_code, "{} responded with status {}".format(self.name, resp.status_code))
+            except requests.Timeout:
+                resp, ok = None, False
+                error = UpstreamUnavailable(504, "{} did not respond in time".format(self.name))
+            except requests.RequestException:
+                resp, ok = None, False
+                error = UpstreamUnavailable(502, "cannot connect to {}".format(self.name))
+
+            self.breaker.record(epoch, ok)
+
+            if ok:
+                return resp
+
+            # back off before trying again, if there is time left for it
+            backoff = 0.2 * (2 ** attempt)
+            if attempt >= upstream_max_retries or time.monotonic() + backoff >= deadline:
+                if resp is not None:
+                    return resp     # the caller reports the error data of the upstream
+                raise error
+
+            attempt += 1
+            self.retries += 1
+            time.sleep(backoff)
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'tokens': self.bucket.tokens,
+            'backgroundTokens': self.background_bucket.tokens,
+            'breakerState': self.breaker.state,
+            'breakerOpened': self.breaker.times_opened,
+        }
+
+
+delijn_client = UpstreamClient("DeLijn API", delijn_rate_limit, delijn_burst)
+open_weather_client = UpstreamClient("OpenWeatherMap API", open_weather_rate_limit, open_weather_burst)
+
+
+def get_client(url: str) -> UpstreamClient:
+    """
+        Retrieve the client that must be used for the specified URL.
+    """
+
+    if url.startswith(open_weather_api_url):
+        return open_weather_client
+
+    return delijn_client
@@ -0,0 +1,174 @@
+"""
+    Imports the directions, stops and schedules of lines into the schedule store (see store.py), from which the app
+    serves them instead of calling the DeLijn API:
+
+        python importer.py --store data/schedules.sqlite --dump bench/fixtures
+        python importer.py --store data/schedules.sqlite --province 1 --lines 1 2 32
+        SCHEDULE_STORE=data/schedules.sqlite python app.py
+
+    A dump is a directory with DeLijn API responses in the layout of the fixtures of bench/standin.py (as recorded
+    with --record or generated by bench/synthetic.py): "<dump>/delijn/lijnen/<province>/<line>/lijnrichtingen.json"
+    and "<dump>/delijn/lijnen/<province>/<line>/lijnrichtingen/<direction>/{haltes,dienstregelingen}.json".
+    With --province, the lines are retrieved from the DeLijn API instead (all lines of the province unless --lines
+    is specified), which is how the store is refreshed.
+
+    With --publish, the schedules of all lines in the store are then compiled and published as a new generation of
+    the shared schedules (see shared_schedules.py), which the worker processes pick up by themselves:
+
+        python importer.py --store data/schedules.sqlite --province 1 --publish data/shared
+        SHARED_SCHEDULES=data/shared gunicorn --workers 8 app:app
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from config import delijn_api_url, delijn_req_header
+from log import logger
+from schedule import CompiledSchedule
+from service import get_stored_line_directions
+from shared_schedules import REFERENCE_DAY, write_segment
+from store import ScheduleStore
+from upstream import send_get_request
+
+
+def read_dump_line(line_dir: str) -> (dict, dict):
+    """
+        Read (lijnrichtingen response, {direction type: (haltes response, dienstregelingen response)}) of a line
+        from a dump. Directions without a haltes or dienstregelingen file are left out.
+    """
+
+    with open(os.path.join(line_dir, "lijnrichtingen.json")) as dirs_file:
+        data_dirs = json.load(dirs_file)
+
+    directions = {}
+    for direction in data_dirs["lijnrichtingen"]:
+        dir_path = os.path.join(line_dir, "lijnrichtingen", direction["richting"])
+
+        try:
+            with open(os.path.join(dir_path, "haltes.json")) as stops_file, open(os.path.join(dir_path, "dienstregelingen.json")) as rides_file:
+                directions[direction["richting"]] = (json.load(stops_file), json.load(rides_file))
+        except FileNotFoundError:
+            logger.warning("Direction missing from dump.", extra={'fields': {'path': dir_path}})
+
+    return data_dirs, directions
+
+
+def import_dump(store: ScheduleStore, dump_dir: str) -> int:
+    """
+        Import every line of a dump. Returns the number of imported lines.
+    """
+
+    imported = 0
+
+    for dirs_path in sorted(glob.glob(os.path.join(dump_dir, "delijn", "lijnen", "*", "*", "lijnrichtingen.json"))):
+        line_dir = os.path.dirname(dirs_path)
+        province_id, line_id = int(os.path.basename(os.path.dirname(line_dir))), int(os.path.basename(line_dir))
+
+        store.put_line(province_id, line_id, *read_dump_line(line_dir))
+        imported += 1
+
+    return imported
+
+
+def retrieve(url: str) -> dict:
+    flag, status_code, data = send_get_request(url, headers=delijn_req_header)
+    if not flag:
+        raise RuntimeError("Cannot retrieve {} ({}).".format(url, status_code))
+
+    return data
+
+
+def import_api(store: ScheduleStore, province_id: int, line_ids: list) -> int:
+    """
+        Retrieve the specified lines (all lines of the province if None) from the DeLijn API and import them.
+        A line that cannot be retrieved keeps its previous import. Returns the number of imported lines.
+    """
+
+    if line_ids is None:
+        line_ids = [int(line["lijnnummer"]) for line in retrieve("{}/entiteiten/{}/lijnen".format(delijn_api_url, province_id))["lijnen"]]
+
+    imported = 0
+
+    for line_id in line_ids:
+        url_dirs = "{}/lijnen/{}/{}/lijnrichtingen".format(delijn_api_url, province_id, line_id)
+
+        try:
+            data_dirs = retrieve(url_dirs)
+            directions = {
+                direction["richting"]: (
+                    retrieve("{}/{}/haltes".format(url_dirs, direction["richting"])),
+                    retrieve("{}/{}/dienstregelingen".format(url_dirs, direction["richting"]))
+                ) for direction in data_dirs["lijnrichtingen"]
+            }
+        except RuntimeError as e:
+            logger.warning("Cannot import line.", extra={'fields': {'province': province_id, 'line': line_id, 'reason': str(e)}})
+            continue
+
+        store.put_line(province_id, line_id, data_dirs, directions)
+        imported += 1
+
+    return imported
+
+
+def publish(store: ScheduleStore, directory: str) -> str:
+    """
+        Compile the schedules of all lines in the store and publish them in the specified directory.
+        Returns the file name of the new generation.
+    """
+
+    lines = {}
+
+    for province_id, line_id in store.line_keys():
+        line, _ = store.read_line(province_id, line_id, REFERENCE_DAY)
+
+        lines[(province_id, line_id)] = [
+            (
+                direction.type,
+                direction.name,
+                [tuple(stop) for stop in direction.stops],
+                CompiledSchedule(direction.ride_data, direction.stop_map) if len(direction.stops) > 0 else None
+            ) for direction in get_stored_line_directions("", *line)
+        ]
+
+    return write_segment(directory, lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import line schedules into the schedule store.")
+    parser.add_argument("--store", required=True, help="SQLite file of the schedule store, created if it does not exist")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--dump", help="directory with DeLijn API responses in the layout of the stand-in fixtures")
+    source.add_argument("--province", type=int, help="retrieve the lines of this province from the DeLijn API")
+    parser.add_argument("--lines", type=int, nargs="+", help="lines to retrieve with --province (default: all)")
+    parser.add_argument("--publish", metavar="DIRECTORY", help="publish the compiled schedules of the store in this directory")
+    args = parser.parse_args()
+
+    if args.dump is None and args.province is None and args.publish is None:
+        parser.error("specify --dump, --province and/or --publish")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.store)), exist_ok=True)
+    store = ScheduleStore(args.store)
+
+    if args.dump is not None or args.province is not None:
+        if args.dump is not None:
+            imported = import_dump(store, args.dump)
+        else:
+            imported = import_api(store, args.province, args.lines)
+
+        logger.info("Imported lines.", extra={'fields': {'lines': imported, 'store': store.stats()}})
+
+        if imported == 0:
+            return 1
+
+    if args.publish is not None:
+        name = publish(store, args.publish)
+        logger.info("Published schedules.", extra={'fields': {'directory': args.publish, 'segment': name}})
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
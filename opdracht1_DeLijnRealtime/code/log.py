@@ -0,0 +1,72 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from config import log_level, log_queue_size
+
+
+class JsonFormatter(logging.Formatter):
+    """
+        Formats a log record as a single line of JSON. Structured fields are passed as
+        extra={'fields': {...}} and end up as top-level keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        document.update(getattr(record, "fields", {}))
+
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(document, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+        Hands records to a bounded queue that is written out on a separate thread, so logging never waits for I/O.
+        When the writer cannot keep up, records are dropped (and counted) instead of blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def make_logger(name: str) -> logging.Logger:
+    """
+        Create a logger that writes JSON lines to stderr on a background thread.
+    """
+
+    log_queue = queue.Queue(maxsize=log_queue_size)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)  # write out what is still in the queue
+
+    new_logger = logging.getLogger(name)
+    new_logger.setLevel(log_level)
+    new_logger.addHandler(DroppingQueueHandler(log_queue))
+    new_logger.propagate = False
+
+    return new_logger
+
+
+logger = make_logger("delijn")
@@ -0,0 +1,180 @@
+import bisect
+import threading
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    parts = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for name, value in zip(label_names, label_values)
+    ]
+    if extra:
+        parts.append(extra)
+
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value))
+
+
+class Metric:
+    """
+        A named metric with zero or more labels. The label values are passed as a tuple in the order of "label_names".
+    """
+
+    type = None
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+
+        self._values = {}   # label values -> value
+        self._lock = threading.Lock()
+
+    def render(self) -> list:
+        """
+            Retrieve the lines of this metric in the Prometheus text format.
+        """
+
+        values = self._snapshot()
+
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.type)]
+        for label_values, value in sorted(values):
+            lines.extend(self._render_value(label_values, value))
+
+        return lines
+
+    def _snapshot(self) -> list:
+        with self._lock:
+            return list(self._values.items())
+
+    def _render_value(self, label_values: tuple, value) -> list:
+        return ["{}{} {}".format(self.name, format_labels(self.label_names, label_values), format_value(value))]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, label_values: tuple = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, label_values: tuple = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, label_values: tuple = (), amount: float = 1.0) -> None:
+        self.inc(label_values, -amount)
+
+    def set(self, label_values: tuple = (), value: float = 0.0) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """
+        Counts observations (e.g. latencies) in buckets with the specified upper bounds, and keeps their sum.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, label_values: tuple = ()) -> None:
+        # the last slot counts the observations above the largest bound
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+            state[0][index] += 1
+            state[1] += value
+
+    def _snapshot(self) -> list:
+        # copy the counts while holding the lock, they are modified in place
+        with self._lock:
+            return [(label_values, (list(state[0]), state[1])) for label_values, state in self._values.items()]
+
+    def _render_value(self, label_values: tuple, value) -> list:
+        counts, total = value
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = format_labels(self.label_names, label_values, 'le="{}"'.format(format_value(bound)))
+            lines.append("{}_bucket{} {}".format(self.name, labels, cumulative))
+
+        labels = format_labels(self.label_names, label_values)
+        lines.append("{}_sum{} {}".format(self.name, labels, format_value(total)))
+        lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+
+        return lines
+
+
+class Registry:
+    """
+        Holds the metrics that are exported. Besides metrics that are updated as things happen, collectors can be
+        registered: functions that are called on every scrape and return metrics with their current values.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+            Retrieve all metrics in the Prometheus text format.
+        """
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        for collector in self.collectors:
+            for metric in collector():
+                lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("method", "route", "status")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Number of requests that are being handled.", ()
+))
+
+upstream_request_duration = registry.register(Histogram(
+    "upstream_request_duration_seconds", "Duration of upstream calls, including rate limiting and retries.", ("host", "endpoint")
+))
+upstream_errors = registry.register(Counter(
+    "upstream_errors_total", "Number of upstream calls that did not succeed.", ("host", "endpoint", "status")
+))
+upstream_requests_in_flight = registry.register(Gauge(
+    "upstream_requests_in_flight", "Number of upstream calls in progress.", ("host",)
+))
@@ -0,0 +1,45 @@
+import numpy as np
+from flask import Request, Response, jsonify
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # msgpack is optional, only JSON is offered when it is not installed
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+
+def wants_msgpack(request: Request) -> bool:
+    """
+        Determine whether the client prefers MessagePack over JSON according to its Accept header.
+        JSON is used when the client has no preference.
+    """
+
+    if msgpack is None:
+        return False
+
+    return request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE
+
+
+def negotiated_response(request: Request, status: int, make_json, make_columnar) -> (Response, int):
+    """
+        Respond with the JSON document of make_json(), or with the columnar document of make_columnar() as
+        MessagePack if the client asks for it. Columnar documents hold numbers in packed arrays (see pack_array()).
+    """
+
+    if wants_msgpack(request):
+        response = Response(msgpack.packb(make_columnar(), use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(make_json())
+
+    response.vary.add("Accept")
+
+    return response, status
+
+
+def pack_array(values, dtype: str) -> bytes:
+    """
+        Pack numbers as a little-endian array of the specified NumPy type, "<f8" (float64) or "<i8" (int64).
+    """
+
+    return np.asarray(values, dtype=dtype).tobytes()
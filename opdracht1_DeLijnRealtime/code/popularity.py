@@ -0,0 +1,88 @@
+import json
+import math
+import os
+import threading
+import time
+
+from config import prefetch_half_life
+
+
+class LinePopularity:
+    """
+        Access counts of lines that decay exponentially with the specified half-life (in seconds), so the counts
+        follow the daily pattern of the traffic. The counts use the wall clock, so saved counts keep decaying
+        while the app is not running.
+    """
+
+    def __init__(self, half_life: float):
+        self.decay_rate = math.log(2) / half_life
+
+        self._counts = {}   # (province id, line id) -> (count, time.time() of the count)
+        self._lock = threading.Lock()
+
+    def record(self, province_id: int, line_id: int) -> None:
+        now = time.time()
+        key = (province_id, line_id)
+
+        with self._lock:
+            count, updated = self._counts.get(key, (0.0, now))
+            self._counts[key] = (self._decayed(count, updated, now) + 1.0, now)
+
+    def top(self, n: int, min_count: float = 0.0) -> list:
+        """
+            Retrieve the (province id, line id) of the (at most) "n" lines with the highest current count,
+            highest first. Lines with a count below "min_count" are left out.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            counts = [(self._decayed(count, updated, now), key) for key, (count, updated) in self._counts.items()]
+
+        counts.sort(reverse=True)
+
+        return [key for count, key in counts[:n] if count >= min_count]
+
+    def load(self, path: str) -> None:
+        """
+            Load the counts that were saved with save(), if there are any.
+        """
+
+        try:
+            with open(path) as counts_file:
+                saved = json.load(counts_file)
+        except (OSError, ValueError):
+            return
+
+        with self._lock:
+            for province_id, line_id, count, updated in saved['counts']:
+                self._counts[(province_id, line_id)] = (count, updated)
+
+    def save(self, path: str) -> None:
+        """
+            Store the counts on disk. Counts that have decayed to (almost) nothing are dropped.
+        """
+
+        now = time.time()
+
+        with self._lock:
+            for key in [key for key, (count, updated) in self._counts.items() if self._decayed(count, updated, now) < 0.01]:
+                del self._counts[key]
+
+            saved = {
+                'counts': [[key[0], key[1], count, updated] for key, (count, updated) in self._counts.items()]
+            }
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as counts_file:
+            json.dump(saved, counts_file)
+        os.replace(path + ".tmp", path)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _decayed(self, count: float, updated: float, now: float) -> float:
+        return count * math.exp(-self.decay_rate * max(now - updated, 0.0))
+
+
+line_popularity = LinePopularity(prefetch_half_life)
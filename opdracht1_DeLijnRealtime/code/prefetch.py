@@ -0,0 +1,120 @@
+import threading
+import time
+
+from config import (
+    delijn_api_url, delijn_req_header, line_popularity_path, line_popularity_save_interval, prefetch_interval,
+    prefetch_margin, prefetch_min_count, prefetch_top_lines
+)
+from delijn_client import PRIORITY_BACKGROUND
+from log import logger
+from popularity import LinePopularity, line_popularity
+from service import UpstreamError, get_direction_urls, get_line_directions, get_local_line_directions
+from upstream import get_cache_key, refresh_before_expiry, upstream_cache
+
+
+class LinePrefetcher:
+    """
+        Keeps the upstream responses of the most used lines (see LinePopularity) in the upstream cache: every round,
+        the responses of these lines that are about to stop being fresh are retrieved again with background priority,
+        so requests for them never wait for the DeLijn API. The lines that were most used before a restart are
+        warmed right after it.
+    """
+
+    def __init__(self, popularity: LinePopularity, top_lines: int, min_count: float, margin: float, interval: float):
+        self.popularity = popularity
+        self.top_lines = top_lines
+        self.min_count = min_count
+        self.margin = margin
+        self.interval = interval
+
+        self.rounds = 0
+        self.refreshed = 0
+        self.failed = 0
+
+        self._thread = None
+
+    def start(self) -> None:
+        """
+            Load the saved access counts and start prefetching in the background.
+        """
+
+        if self._thread is not None:
+            return
+
+        self.popularity.load(line_popularity_path)
+
+        self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._thread.start()
+
+    def prefetch(self) -> None:
+        """
+            Refresh the expiring responses of the most used lines, and compile their schedules.
+        """
+
+        for province_id, line_id in self.popularity.top(self.top_lines, self.min_count):
+            try:
+                self.refreshed += self.prefetch_line(province_id, line_id)
+            except UpstreamError as e:
+                self.failed += 1
+                logger.warning("Cannot prefetch line.", extra={'fields': {'province': province_id, 'line': line_id, 'reason': e.message}})
+
+        self.rounds += 1
+
+    def prefetch_line(self, province_id: int, line_id: int) -> int:
+        """
+            Refresh the responses of a line that are not cached or about to stop being fresh. Returns the
+            number of upstream calls that were made. Raises UpstreamError if the line cannot be retrieved.
+        """
+
+        url_dirs = "{}/lijnen/{}/{}/lijnrichtingen".format(delijn_api_url, province_id, line_id)
+
+        # lines that are read locally never wait for the DeLijn API
+        if get_local_line_directions(province_id, line_id, url_dirs) is not None:
+            return 0
+
+        calls = int(refresh_before_expiry(url_dirs, self.margin, headers=delijn_req_header))
+
+        found, _, data_dirs = upstream_cache.get(get_cache_key(url_dirs, headers=delijn_req_header), count=False)
+        if found:
+            for direction in data_dirs["lijnrichtingen"]:
+                for url in get_direction_urls(url_dirs, direction["richting"]):
+                    calls += refresh_before_expiry(url, self.margin, headers=delijn_req_header)
+
+        # everything is cached by now (unless a call failed), this compiles the schedules that changed
+        for direction in get_line_directions(province_id, line_id, priority=PRIORITY_BACKGROUND):
+            if len(direction.stops) > 0:
+                direction.get_schedule(count=False)
+
+        return calls
+
+    def stats(self) -> dict:
+        return {
+            'trackedLines': len(self.popularity),
+            'topLines': ["{}:{}".format(*key) for key in self.popularity.top(10, self.min_count)],
+            'rounds': self.rounds,
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+        }
+
+    def _prefetch_loop(self) -> None:
+        saved = time.monotonic()
+
+        while True:
+            start = time.monotonic()
+
+            try:
+                self.prefetch()
+            except Exception:
+                logger.exception("Cannot prefetch lines.")
+
+            if start - saved >= line_popularity_save_interval:
+                saved = start
+                try:
+                    self.popularity.save(line_popularity_path)
+                except OSError:
+                    logger.error("Cannot store line access counts.", extra={'fields': {'path': line_popularity_path}})
+
+            time.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+
+line_prefetcher = LinePrefetcher(line_popularity, prefetch_top_lines, prefetch_min_count, prefetch_margin, prefetch_interval)
@@ -0,0 +1,298 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import reference
+from config import province_vehicles_idle_timeout, province_vehicles_interval, province_vehicles_load_batch, province_vehicles_reload_interval
+from delijn_client import PRIORITY_BACKGROUND
+from log import logger
+from negotiation import pack_array
+from schedule import seconds_since_midnight
+from service import UpstreamError, format_time, get_line_directions
+
+# loads the schedules of the lines of watched provinces, separate from the pool of the batch endpoint (service.line_pool)
+load_pool = ThreadPoolExecutor(max_workers=province_vehicles_load_batch)
+
+
+class ProvinceVehicles:
+    """
+        An immutable snapshot of the positions of all vehicles in a province at a single moment,
+        stored as flat arrays with one element per vehicle.
+    """
+
+    def __init__(self, province_id: int, moment: datetime.datetime, line_ids: np.ndarray, dir_types: np.ndarray,
+                 ride_numbers: np.ndarray, lats: np.ndarray, longs: np.ndarray, lines_loaded: int, lines_total: int):
+        self.province_id = province_id
+        self.moment = moment
+        self.line_ids = line_ids
+        self.dir_types = dir_types
+        self.ride_numbers = ride_numbers
+        self.lats = lats
+        self.longs = longs
+        self.lines_loaded = lines_loaded    # number of lines of which the schedules are known
+        self.lines_total = lines_total
+
+    @staticmethod
+    def empty(province_id: int, moment: datetime.datetime, lines_total: int):
+        return ProvinceVehicles(
+            province_id, moment, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object),
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64), 0, lines_total
+        )
+
+    def in_bbox(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        """
+            Retrieve the positions (in the arrays of this snapshot) of the vehicles inside the specified bounding box.
+        """
+
+        return np.flatnonzero((self.lats >= south) & (self.lats <= north) & (self.longs >= west) & (self.longs <= east))
+
+    def to_json(self, indices: np.ndarray) -> dict:
+        midnight = datetime.datetime.combine(self.moment.date(), datetime.time())
+
+        return {
+            'time': format_time(midnight, int(seconds_since_midnight(self.moment))),
+            'linesLoaded': self.lines_loaded,
+            'linesTotal': self.lines_total,
+            'vehicles': [
+                {
+                    'line': int(self.line_ids[i]),
+                    'dir': self.dir_types[i],
+                    'seqNr': int(self.ride_numbers[i]),
+                    'coord': {
+                        'lat': float(self.lats[i]),
+                        'long': float(self.longs[i])
+                    }
+                } for i in indices
+            ]
+        }
+
+    def to_columnar(self, indices: np.ndarray) -> dict:
+        """
+            Like to_json(), but with the vehicles as parallel columns and their numbers in packed arrays (see pack_array()).
+        """
+
+        midnight = datetime.datetime.combine(self.moment.date(), datetime.time())
+
+        return {
+            'time': format_time(midnight, int(seconds_since_midnight(self.moment))),
+            'linesLoaded': self.lines_loaded,
+            'linesTotal': self.lines_total,
+            'lines': pack_array(self.line_ids[indices], "<i8"),
+            'dirs': self.dir_types[indices].tolist(),
+            'seqNrs': pack_array(self.ride_numbers[indices], "<i8"),
+            'lats': pack_array(self.lats[indices], "<f8"),
+            'longs': pack_array(self.longs[indices], "<f8"),
+        }
+
+
+class ProvinceState:
+    """
+        The compiled schedules of the lines of a province that is being watched.
+    """
+
+    def __init__(self, province_id: int):
+        self.province_id = province_id
+        self.last_access = time.monotonic()
+        self.line_ids = []
+        self.schedules = {}     # line id -> [(direction type, CompiledSchedule)]
+        self.loaded_at = {}     # line id -> time.monotonic() of the last attempt to load the line
+        self.snapshot = ProvinceVehicles.empty(province_id, datetime.datetime.now(), 0)
+
+
+class ProvinceVehicleEngine:
+    """
+        Keeps the compiled schedules of every line of the provinces that are being watched in memory, and
+        recomputes the positions of all their vehicles once per tick. Readers get the latest immutable
+        snapshot, so the cost of a read does not depend on the number of lines.
+
+        A province is watched from its first request until no request has asked for it during the idle timeout.
+        The lines are loaded (and reloaded as their schedules expire) on a separate thread with background
+        priority, so the first snapshots of a province only contain the lines that have been loaded so far.
+    """
+
+    def __init__(self, interval: float, reload_interval: float, idle_timeout: float, load_batch: int):
+        self.interval = interval
+        self.reload_interval = reload_interval
+        self.idle_timeout = idle_timeout
+        self.load_batch = load_batch
+
+        self._provinces = {}    # province id -> ProvinceState
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = None
+
+    def get_snapshot(self, province_id: int) -> ProvinceVehicles:
+        """
+            Retrieve the latest snapshot of the specified province, and start watching it if that is not the case yet.
+        """
+
+        with self._lock:
+            state = self._provinces.get(province_id)
+            if state is None:
+                state = self._provinces[province_id] = ProvinceState(province_id)
+
+            state.last_access = time.monotonic()
+
+            if self._threads is None:
+                self._threads = [
+                    threading.Thread(target=self._tick_loop, daemon=True),
+                    threading.Thread(target=self._load_loop, daemon=True)
+                ]
+                for thread in self._threads:
+                    thread.start()
+
+        self._wakeup.set()
+
+        return state.snapshot
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                str(province_id): {
+                    'linesLoaded': state.snapshot.lines_loaded,
+                    'linesTotal': state.snapshot.lines_total,
+                    'vehicles': len(state.snapshot.lats),
+                } for province_id, state in self._provinces.items()
+            }
+
+    def tick(self) -> None:
+        """
+            Compute a new snapshot for every province that is being watched, and stop watching idle provinces.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            for province_id in [province_id for province_id, state in self._provinces.items() if now - state.last_access > self.idle_timeout]:
+                del self._provinces[province_id]
+
+            states = list(self._provinces.values())
+
+        moment = datetime.datetime.now()
+
+        for state in states:
+            state.snapshot = compute_snapshot(state, moment)
+
+    def load(self) -> bool:
+        """
+            Load the lines of the watched provinces that were never loaded or of which the schedules expired, at most
+            "load_batch" lines per province at the same time. Returns False if there was nothing to load.
+        """
+
+        with self._lock:
+            states = list(self._provinces.values())
+
+        loaded_any = False
+
+        for state in states:
+            try:
+                state.line_ids = [line['id'] for line in reference.get_lines(state.province_id)]
+            except UpstreamError as e:
+                logger.warning("Cannot retrieve lines of province.", extra={'fields': {'province': state.province_id, 'reason': e.message}})
+                continue
+
+            now = time.monotonic()
+
+            # lines that were never loaded come first
+            due = [line_id for line_id in state.line_ids if now - state.loaded_at.get(line_id, -self.reload_interval) >= self.reload_interval]
+            due.sort(key=lambda line_id: state.loaded_at.get(line_id, -self.reload_interval))
+
+            pending = [(line_id, load_pool.submit(load_line_schedules, state.province_id, line_id)) for line_id in due[:self.load_batch]]
+
+            for line_id, future in pending:
+                try:
+                    state.schedules[line_id] = future.result()
+                except UpstreamError as e:
+                    # the previous schedules (if any) are kept, the line is tried again after the reload interval
+                    logger.warning("Cannot load line schedules.", extra={'fields': {'province': state.province_id, 'line': line_id, 'reason': e.message}})
+
+                state.loaded_at[line_id] = time.monotonic()
+                loaded_any = True
+
+        return loaded_any
+
+    def _tick_loop(self) -> None:
+        while True:
+            with self._lock:
+                idle = len(self._provinces) == 0
+
+            if idle:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            start = time.monotonic()
+
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Cannot update province vehicles.")
+
+            time.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+    def _load_loop(self) -> None:
+        while True:
+            with self._lock:
+                idle = len(self._provinces) == 0
+
+            # NOTE: the tick loop clears the wakeup event, so this loop only relies on it for a second
+            if idle:
+                self._wakeup.wait(1.0)
+                continue
+
+            try:
+                loaded_any = self.load()
+            except Exception:
+                logger.exception("Cannot load province lines.")
+                loaded_any = False
+
+            if not loaded_any:
+                time.sleep(1.0)
+
+
+def load_line_schedules(province_id: int, line_id: int) -> list:
+    """
+        Retrieve the compiled schedules of the directions of a line that have stops, as (direction type, CompiledSchedule).
+        Raises UpstreamError if the line cannot be retrieved.
+    """
+
+    return [
+        (direction.type, direction.get_schedule(count=False))
+        for direction in get_line_directions(province_id, line_id, priority=PRIORITY_BACKGROUND) if len(direction.stops) > 0
+    ]
+
+
+def compute_snapshot(state: ProvinceState, moment: datetime.datetime) -> ProvinceVehicles:
+    """
+        Compute the positions of all vehicles of the loaded lines of a province at the specified moment.
+    """
+
+    seconds = seconds_since_midnight(moment)
+
+    line_ids, dir_types, ride_numbers, lats, longs = [], [], [], [], []
+
+    for line_id, schedules in list(state.schedules.items()):
+        for dir_type, schedule in schedules:
+            active, _, dir_lats, dir_longs = schedule.interpolate(seconds)
+
+            line_ids.append(np.full(len(dir_lats), line_id, dtype=np.int64))
+            dir_types.append(np.full(len(dir_lats), dir_type, dtype=object))
+            ride_numbers.append(schedule.ride_numbers[active])
+            lats.append(dir_lats)
+            longs.append(dir_longs)
+
+    if len(lats) == 0:
+        return ProvinceVehicles.empty(state.province_id, moment, len(state.line_ids))
+
+    return ProvinceVehicles(
+        state.province_id, moment, np.concatenate(line_ids), np.concatenate(dir_types), np.concatenate(ride_numbers),
+        np.concatenate(lats), np.concatenate(longs), len(state.schedules), len(state.line_ids)
+    )
+
+
+province_vehicle_engine = ProvinceVehicleEngine(
+    province_vehicles_interval, province_vehicles_reload_interval, province_vehicles_idle_timeout, province_vehicles_load_batch
+)
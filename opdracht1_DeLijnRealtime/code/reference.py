@@ -0,0 +1,385 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    delijn_api_url, delijn_req_header, reference_pool_size, reference_refresh_interval, reference_retry_interval,
+    reference_snapshot_path, stop_index_cell_size
+)
+from delijn_client import PRIORITY_BACKGROUND
+from log import logger
+from service import Stop, UpstreamError
+from spatial import StopIndex
+from upstream import make_get_request, send_get_request
+
+# runs the calls of a snapshot download (see config.reference_pool_size)
+reference_pool = ThreadPoolExecutor(max_workers=reference_pool_size)
+
+
+class ReferenceSnapshot:
+    """
+        An immutable copy of the De Lijn reference data that hardly ever changes: the provinces (entiteiten),
+        the lines per province, the color codes, the color code of every line and the stops per province.
+    """
+
+    def __init__(self, created: float, provinces: list, lines: dict, colors: dict, line_colors: dict, stops: dict):
+        self.created = created
+        self.provinces = provinces      # [{'id': ..., 'name': ...}]
+        self.lines = lines              # province id -> [{'id': ..., 'name': ...}]
+        self.colors = colors            # color code -> hex
+        self.line_colors = line_colors  # (province id, line id) -> color code
+        self.stops = stops              # province id -> [Stop]
+
+    def to_json(self) -> dict:
+        return {
+            'created': self.created,
+            'provinces': self.provinces,
+            'lines': {str(province_id): lines for province_id, lines in self.lines.items()},
+            'colors': self.colors,
+            'lineColors': {"{}/{}".format(*key): code for key, code in self.line_colors.items()},
+            # stops are stored as [id, name, city, lat, long] to keep the file small
+            'stops': {str(province_id): [list(stop) for stop in stops] for province_id, stops in self.stops.items()},
+        }
+
+    @staticmethod
+    def from_json(data: dict):
+        return ReferenceSnapshot(
+            created=data['created'],
+            provinces=data['provinces'],
+            lines={int(province_id): lines for province_id, lines in data['lines'].items()},
+            colors=data['colors'],
+            line_colors={tuple(int(part) for part in key.split("/")): code for key, code in data['lineColors'].items()},
+            stops={int(province_id): [Stop(*stop) for stop in stops] for province_id, stops in data['stops'].items()}
+        )
+
+
+def get_json(url: str, error_message: str) -> dict:
+    """
+        Retrieve the specified De Lijn URL, bypassing the upstream cache.
+        Raises UpstreamError if this fails.
+    """
+
+    flag, status_code, data = send_get_request(url, priority=PRIORITY_BACKGROUND, headers=delijn_req_header)
+    if not flag:
+        raise UpstreamError(
+            status_code,
+            data["boodschap"] if "boodschap" in data else "",
+            error_message
+        )
+
+    return data
+
+
+def download_snapshot() -> ReferenceSnapshot:
+    """
+        Retrieve a complete new reference snapshot from the DeLijn API.
+        Raises UpstreamError if any part of it except the line colors cannot be retrieved.
+    """
+
+    data_provinces = get_json(delijn_api_url + "/entiteiten", "Cannot retrieve provinces from DeLijn API.")
+    provinces = [
+        {
+            'id': int(entiteit['entiteitnummer']),
+            'name': entiteit['omschrijving'],
+        } for entiteit in data_provinces["entiteiten"]
+    ]
+
+    # the stops of a province are a large download, so these are retrieved while the rest is being retrieved
+    pending_stops = {
+        province['id']: reference_pool.submit(get_json, "{}/entiteiten/{}/haltes".format(delijn_api_url, province['id']), "Cannot retrieve stops from DeLijn API.")
+        for province in provinces
+    }
+
+    data_colors = get_json(delijn_api_url + "/kleuren", "Cannot retrieve color codes from DeLijn API.")
+    colors = {colorcode["code"]: colorcode["hex"] for colorcode in data_colors["kleuren"]}
+
+    lines = {}
+    for province in provinces:
+        url_lines = "{}/entiteiten/{}/lijnen".format(delijn_api_url, province['id'])
+        data_lines = get_json(url_lines, "Cannot retrieve list of lines from DeLijn API.")
+        lines[province['id']] = [
+            {
+                'id': int(lijn["lijnnummer"]),
+                'name': lijn['omschrijving'],
+            } for lijn in data_lines["lijnen"]
+        ]
+
+    # retrieve the color of every line, a line of which the color is missing is looked up on demand
+    pending_colors = {}
+    for province_id, province_lines in lines.items():
+        for line in province_lines:
+            url_line_color = "{}/lijnen/{}/{}/lijnkleuren".format(delijn_api_url, province_id, line['id'])
+            pending_colors[(province_id, line['id'])] = reference_pool.submit(send_get_request, url_line_color, priority=PRIORITY_BACKGROUND, headers=delijn_req_header)
+
+    line_colors = {}
+    for key, future in pending_colors.items():
+        try:
+            flag, _, data_line_color = future.result()
+        except Exception:
+            continue
+
+        if flag:
+            line_colors[key] = data_line_color["achtergrond"]["code"]
+
+    stops = {}
+    for province_id, future in pending_stops.items():
+        stops[province_id] = [
+            Stop(
+                id=int(halte['haltenummer']),
+                name=halte['omschrijving'],
+                city=halte['omschrijvingGemeente'],
+                lat=float(halte['geoCoordinaat']['latitude']),
+                long=float(halte['geoCoordinaat']['longitude'])
+            ) for halte in future.result()["haltes"] if halte.get('geoCoordinaat') is not None
+        ]
+
+    return ReferenceSnapshot(time.time(), provinces, lines, colors, line_colors, stops)
+
+
+def load_snapshot(path: str):
+    """
+        Load a snapshot from disk, or return None if there is no (valid) snapshot at the specified path.
+    """
+
+    try:
+        with open(path) as snapshot_file:
+            return ReferenceSnapshot.from_json(json.load(snapshot_file))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_snapshot(snapshot: ReferenceSnapshot, path: str) -> None:
+    """
+        Write a snapshot to disk. The file is replaced atomically, so a crash never leaves a partial snapshot behind.
+    """
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as snapshot_file:
+        json.dump(snapshot.to_json(), snapshot_file)
+
+    os.replace(tmp_path, path)
+
+
+class ReferenceData:
+    """
+        Holds the current reference snapshot and keeps it up to date on a background thread. Readers
+        always see a complete snapshot: a new one is only made visible by replacing the reference to it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot = None
+        self._thread = None
+        self._listeners = []
+
+        self._stop_index = (None, None)    # (snapshot, index of its stops)
+        self._stop_index_lock = threading.Lock()
+
+    def add_listener(self, listener) -> None:
+        """
+            Register a function that is called with every snapshot that becomes the current one. Listeners
+            are called on the thread that changed the snapshot and must not block for long.
+        """
+
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        """
+            Load the snapshot from disk (if any) and start refreshing it in the background.
+        """
+
+        if self._thread is not None:
+            return
+
+        self.snapshot = load_snapshot(self.path)
+        if self.snapshot is not None:
+            self._notify(self.snapshot)
+
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def refresh(self) -> None:
+        """
+            Download a new snapshot, store it on disk and make it the current one.
+            Raises UpstreamError if the snapshot cannot be downloaded.
+        """
+
+        snapshot = download_snapshot()
+
+        try:
+            save_snapshot(snapshot, self.path)
+        except OSError:
+            logger.error("Cannot store reference snapshot.", extra={'fields': {'path': self.path}})
+
+        self.snapshot = snapshot
+        self._notify(snapshot)
+
+    def get_stop_index(self):
+        """
+            Retrieve the spatial index of the stops of the current snapshot, or None if there is no snapshot yet.
+            The index is built the first time it is needed after the snapshot has changed.
+        """
+
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+
+        with self._stop_index_lock:
+            indexed_snapshot, index = self._stop_index
+
+            if indexed_snapshot is not snapshot:
+                # a stop that is served in several provinces is only indexed once
+                unique_stops = {}
+                for province_id, stops in snapshot.stops.items():
+                    for stop in stops:
+                        unique_stops.setdefault(stop.id, (province_id, stop))
+
+                index = StopIndex(list(unique_stops.values()), stop_index_cell_size)
+                self._stop_index = (snapshot, index)
+
+            return index
+
+    def _notify(self, snapshot: ReferenceSnapshot) -> None:
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logger.exception("Reference snapshot listener failed.")
+
+    def _refresh_loop(self) -> None:
+        while True:
+            snapshot = self.snapshot
+            age = time.time() - snapshot.created if snapshot is not None else reference_refresh_interval
+
+            if age < reference_refresh_interval:
+                time.sleep(reference_refresh_interval - age)
+                continue
+
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("Cannot refresh reference snapshot.", extra={'fields': {'reason': str(e)}})
+                time.sleep(reference_retry_interval)
+
+
+reference_data = ReferenceData(reference_snapshot_path)
+
+
+def get_provinces() -> list:
+    """
+        Retrieve the list of provinces. These come from the reference snapshot, or from the
+        DeLijn API as long as no snapshot is available. Raises UpstreamError on failure.
+    """
+
+    snapshot = reference_data.snapshot
+    if snapshot is not None:
+        return snapshot.provinces
+
+    url_provinces = delijn_api_url + "/entiteiten"
+    flag, status_code, data = make_get_request(url_provinces, headers=delijn_req_header)
+    if not flag:
+        raise UpstreamError(
+            status_code,
+            data["boodschap"] if "boodschap" in data else "",
+            "Cannot retrieve provinces from DeLijn API."
+        )
+
+    return [
+        {
+            'id': int(entiteit['entiteitnummer']),
+            'name': entiteit['omschrijving'],
+        } for entiteit in data["entiteiten"]
+    ]
+
+
+def get_lines(province_id: int) -> list:
+    """
+        Retrieve the list of lines in the specified province. See get_provinces().
+    """
+
+    snapshot = reference_data.snapshot
+    if snapshot is not None and province_id in snapshot.lines:
+        return snapshot.lines[province_id]
+
+    url_lines = "{}/entiteiten/{}/lijnen".format(delijn_api_url, province_id)
+    flag, status_code, data_lines = make_get_request(url_lines, headers=delijn_req_header)
+    if not flag:
+        raise UpstreamError(
+            status_code,
+            data_lines["boodschap"] if "boodschap" in data_lines else "",
+            "Cannot retrieve list of lines from DeLijn API."
+        )
+
+    return [
+        {
+            'id': int(lijn["lijnnummer"]),
+            'name': lijn['omschrijving'],
+        } for lijn in data_lines["lijnen"]
+    ]
+
+
+def get_line_color(province_id: int, line_id: int) -> str:
+    """
+        Retrieve the (hex) background color of the specified line. See get_provinces().
+    """
+
+    snapshot = reference_data.snapshot
+
+    if snapshot is not None:
+        colormap = snapshot.colors
+    else:
+        url_colorcodes = delijn_api_url + "/kleuren"
+        flag, status_code, data_colorcodes = make_get_request(url_colorcodes, headers=delijn_req_header)
+        if not flag:
+            raise UpstreamError(
+                status_code,
+                data_colorcodes["boodschap"] if "boodschap" in data_colorcodes else "",
+                "Cannot retrieve color codes from DeLijn API."
+            )
+
+        colormap = {colorcode["code"]: colorcode["hex"] for colorcode in data_colorcodes["kleuren"]}
+
+    if snapshot is not None and (province_id, line_id) in snapshot.line_colors:
+        color_code = snapshot.line_colors[(province_id, line_id)]
+    else:
+        url_line_color = "{}/lijnen/{}/{}/lijnkleuren".format(delijn_api_url, province_id, line_id)
+        flag, status_code, data_line_color = make_get_request(url_line_color, headers=delijn_req_header)
+        if not flag:
+            raise UpstreamError(
+                status_code,
+                data_line_color["boodschap"] if "boodschap" in data_line_color else "",
+                "Cannot retrieve line colors from DeLijn API."
+            )
+
+        color_code = data_line_color["achtergrond"]["code"]
+
+    return "#" + colormap[color_code]
+
+
+def get_missing_urls(province_id: int = None, line_id: int = None) -> list:
+    """
+        Retrieve the DeLijn URLs that get_provinces() (without arguments), get_lines(province_id) or
+        get_line_color(province_id, line_id) would retrieve, because the current snapshot does not hold their data.
+    """
+
+    snapshot = reference_data.snapshot
+
+    if province_id is None:
+        return [delijn_api_url + "/entiteiten"] if snapshot is None else []
+
+    if line_id is None:
+        if snapshot is not None and province_id in snapshot.lines:
+            return []
+        return ["{}/entiteiten/{}/lijnen".format(delijn_api_url, province_id)]
+
+    urls = [delijn_api_url + "/kleuren"] if snapshot is None else []
+    if snapshot is None or (province_id, line_id) not in snapshot.line_colors:
+        urls.append("{}/lijnen/{}/{}/lijnkleuren".format(delijn_api_url, province_id, line_id))
+
+    return urls
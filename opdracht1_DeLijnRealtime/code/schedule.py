@@ -0,0 +1,205 @@
+import datetime
+
+import numpy as np
+
+# every ride gets its own window of this many seconds in the flattened time array, which allows
+# a single binary search over all rides at once. Rides are assumed to last less than two days.
+RIDE_WINDOW = 4 * 24 * 3600
+
+
+# names of the arrays of a compiled schedule
+SCHEDULE_ARRAYS = (
+    "ride_numbers", "ride_midnights", "offsets", "stop_ids", "lats", "longs", "times", "keyed_times", "begin_times", "end_times"
+)
+
+
+class CompiledSchedule:
+    """
+        The passages of all rides of a single line direction, parsed into flat NumPy arrays.
+
+        The passages of ride r are stored at indices offsets[r] up to (but excluding) offsets[r+1].
+        Passage times are expressed in seconds since midnight of the day on which the ride starts, and
+        ride_midnights holds that midnight for every ride (see local_seconds()).
+    """
+
+    def __init__(self, ride_data: dict, stop_map: dict):
+        """
+            Compile the "ritDoorkomsten" of a dienstregelingen response. Only passages with a scheduled
+            time at one of the stops in "stop_map" (stop id -> Stop) are used, and rides with fewer
+            than two of these passages are left out.
+        """
+
+        self.ride_data = ride_data
+        self.stop_key = make_stop_key(stop_map)
+
+        ride_numbers = []
+        ride_midnights = []
+        offsets = [0]
+        times = []
+        stop_ids = []
+
+        for rit in ride_data["ritDoorkomsten"]:
+            doorkomsten = [doorkomst for doorkomst in rit["doorkomsten"] if "dienstregelingTijdstip" in doorkomst and int(doorkomst["haltenummer"]) in stop_map]
+
+            # rit moet minstens twee haltes hebben
+            if len(doorkomsten) < 2:
+                continue
+
+            passage_times = [datetime.datetime.fromisoformat(doorkomst["dienstregelingTijdstip"]) for doorkomst in doorkomsten]
+            midnight = datetime.datetime.combine(passage_times[0].date(), datetime.time())
+
+            ride_numbers.append(int(rit["ritnummer"]))
+            ride_midnights.append(local_seconds(midnight))
+            times.extend(int((passage_time - midnight).total_seconds()) for passage_time in passage_times)
+            stop_ids.extend(int(doorkomst["haltenummer"]) for doorkomst in doorkomsten)
+            offsets.append(len(times))
+
+        self.ride_numbers = np.array(ride_numbers, dtype=np.int64)
+        self.ride_midnights = np.array(ride_midnights, dtype=np.int64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.stop_ids = np.array(stop_ids, dtype=np.int64)
+        self.lats = np.array([stop_map[stop_id].lat for stop_id in stop_ids], dtype=np.float64)
+        self.longs = np.array([stop_map[stop_id].long for stop_id in stop_ids], dtype=np.float64)
+
+        ride_index = np.repeat(np.arange(len(ride_numbers), dtype=np.int64), np.diff(self.offsets))
+        times = np.array(times, dtype=np.int64)
+
+        # NOTE: a schedule should never go back in time, but the binary search requires sorted passage
+        # times, so every time is raised to at least the time of the preceding passage of the same ride.
+        if len(times) > 0:
+            times = np.maximum.accumulate(times + ride_index * RIDE_WINDOW) - ride_index * RIDE_WINDOW
+
+        self.times = times
+        self.keyed_times = times + ride_index * RIDE_WINDOW
+
+        self.begin_times = self.times[self.offsets[:-1]]
+        self.end_times = self.times[self.offsets[1:] - 1]
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        """
+            Create a schedule from arrays that were compiled before (one for every name in SCHEDULE_ARRAYS), e.g.
+            views on a shared memory segment. Such a schedule has no "ride_data" and "stop_key".
+        """
+
+        schedule = cls.__new__(cls)
+        schedule.ride_data = None
+        schedule.stop_key = None
+
+        for name in SCHEDULE_ARRAYS:
+            setattr(schedule, name, arrays[name])
+
+        return schedule
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in SCHEDULE_ARRAYS)
+
+    def find_segments(self, seconds: float) -> (np.ndarray, np.ndarray):
+        """
+            Find all rides that are under way at the specified time (in seconds since midnight). This returns
+            (ride indices, passage indices) with the passage index that of the last stop before the vehicle.
+            The vehicle is then somewhere between that passage and the next one.
+        """
+
+        active = np.nonzero((self.begin_times <= seconds) & (seconds <= self.end_times))[0]
+
+        return active, self._find_prev_passages(active, seconds)
+
+    def locate(self, seconds: float) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+            Locate all vehicles at the specified time (in seconds since midnight). This returns (ride indices,
+            passage indices, fractions) with the fraction of the way between that passage and the next one.
+        """
+
+        active, prev_index = self.find_segments(seconds)
+
+        return active, prev_index, self._segment_fractions(prev_index, seconds)
+
+    def interpolate(self, seconds: float) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+        """
+            Determine the positions of all vehicles at the specified time (in seconds since midnight) by linear
+            interpolation between the scheduled passages. This returns (ride indices, passage indices, latitudes,
+            longitudes), see find_segments().
+        """
+
+        active, prev_index, time_frac = self.locate(seconds)
+        lats, longs = self._interpolate_segments(prev_index, time_frac)
+
+        return active, prev_index, lats, longs
+
+    def interpolate_range(self, moments: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+            Determine the positions of the vehicles of all rides at every one of the specified moments (see
+            local_seconds()) in a single pass. This returns (latitudes, longitudes) as (moments x rides) matrices
+            with NaN where a ride is not under way. Every ride is evaluated relative to the day on which it
+            starts, so rides that cross midnight (and ranges that do) are handled correctly.
+        """
+
+        # seconds since the midnight of every ride, for every moment
+        seconds = np.asarray(moments, dtype=np.float64)[:, np.newaxis] - self.ride_midnights[np.newaxis, :]
+
+        moment_index, ride_index = np.nonzero((self.begin_times <= seconds) & (seconds <= self.end_times))
+        ride_seconds = seconds[moment_index, ride_index]
+
+        prev_index = self._find_prev_passages(ride_index, ride_seconds)
+        segment_lats, segment_longs = self._interpolate_segments(prev_index, self._segment_fractions(prev_index, ride_seconds))
+
+        lats = np.full(seconds.shape, np.nan)
+        longs = np.full(seconds.shape, np.nan)
+        lats[moment_index, ride_index] = segment_lats
+        longs[moment_index, ride_index] = segment_longs
+
+        return lats, longs
+
+    def _find_prev_passages(self, rides: np.ndarray, seconds) -> np.ndarray:
+        # find the first passage at or after the time, for all (ride, time) pairs at once
+        next_index = np.searchsorted(self.keyed_times, rides * RIDE_WINDOW + seconds, side='left')
+
+        return np.maximum(next_index - 1, self.offsets[rides])
+
+    def _segment_fractions(self, prev_index: np.ndarray, seconds) -> np.ndarray:
+        prev_times = self.times[prev_index]
+        durations = self.times[prev_index + 1] - prev_times
+
+        # a vehicle that passes two stops at the same time is shown at the first of them
+        return np.divide(seconds - prev_times, durations, out=np.zeros(len(prev_index)), where=durations > 0)
+
+    def _interpolate_segments(self, prev_index: np.ndarray, time_frac: np.ndarray) -> (np.ndarray, np.ndarray):
+        next_index = prev_index + 1
+
+        lats = self.lats[prev_index] + (self.lats[next_index] - self.lats[prev_index]) * time_frac
+        longs = self.longs[prev_index] + (self.longs[next_index] - self.longs[prev_index]) * time_frac
+
+        return lats, longs
+
+    def next_departure(self, seconds: float):
+        """
+            Retrieve the time (in seconds since midnight) at which the next ride after the specified time starts,
+            or None if no more rides start.
+        """
+
+        upcoming = self.begin_times[self.begin_times > seconds]
+
+        return int(upcoming.min()) if len(upcoming) > 0 else None
+
+
+def make_stop_key(stop_map: dict) -> tuple:
+    """
+        Retrieve a hashable summary of the stops (and their coordinates) that a schedule was compiled with.
+    """
+
+    return tuple(sorted((stop_id, stop.lat, stop.long) for stop_id, stop in stop_map.items()))
+
+
+def seconds_since_midnight(moment: datetime.datetime) -> float:
+    return moment.hour * 3600 + moment.minute * 60 + moment.second + moment.microsecond / 1e6
+
+
+def local_seconds(moment: datetime.datetime) -> float:
+    """
+        Convert a (local, naive) moment to a number of seconds that can be compared across days: the day number
+        times 86400 plus the seconds since midnight. Daylight saving time is ignored, like the DeLijn API does.
+    """
+
+    return moment.toordinal() * 86400 + seconds_since_midnight(moment)
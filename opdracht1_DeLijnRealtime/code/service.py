@@ -0,0 +1,608 @@
+import asyncio
+import datetime
+import functools
+import inspect
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, NamedTuple
+
+import numpy as np
+from flask import current_app, g, has_app_context
+
+from cache import TTLCache
+from config import batch_pool_size, delijn_api_url, delijn_req_header, schedule_cache_max_bytes
+from delijn_client import PRIORITY_INTERACTIVE
+from negotiation import pack_array
+from schedule import CompiledSchedule, local_seconds, make_stop_key, seconds_since_midnight
+from async_upstream import make_get_request_async
+from popularity import line_popularity
+from shared_schedules import shared_schedules
+from store import schedule_store
+from upstream import get_endpoint_class, make_get_request, upstream_pool
+
+schedule_cache = TTLCache(schedule_cache_max_bytes)
+
+# pool on which the lines of a batch are handled concurrently
+# NOTE: this must not be the upstream pool, since handling a line waits for tasks on the upstream pool.
+line_pool = ThreadPoolExecutor(max_workers=batch_pool_size)
+
+
+class UpstreamError(Exception):
+    """
+        Raised when data cannot be retrieved from an upstream API. "cause_status" and "cause_message" describe
+        the upstream failure, "message" describes what could not be done because of it.
+    """
+
+    def __init__(self, cause_status: int, cause_message: str, message: str):
+        super().__init__(message)
+        self.cause_status = cause_status
+        self.cause_message = cause_message
+        self.message = message
+
+
+class Stop(NamedTuple):
+    id: int
+    name: str
+    city: str
+    lat: float
+    long: float
+
+    def to_json(self) -> dict:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'city': self.city,
+            'coord': {
+                'lat': self.lat,
+                'long': self.long,
+            }
+        }
+
+
+class Direction(NamedTuple):
+    type: str
+    name: str
+    stops: List[Stop]       # in the order in which they are visited, empty if the direction is not scheduled
+    ride_data: dict         # the raw dienstregelingen response, None for a schedule that was compiled before
+    schedule_url: str       # the URL from which "ride_data" was retrieved
+    schedule: CompiledSchedule = None   # the schedule that was compiled before (see shared_schedules.py)
+
+    @property
+    def stop_map(self) -> dict:
+        return {stop.id: stop for stop in self.stops}
+
+    def get_schedule(self, count: bool = True) -> CompiledSchedule:
+        """
+            Retrieve the compiled version of the schedule of this direction. A schedule is only compiled
+            again when the upstream response or the stops of the direction have changed. Background work
+            passes "count" False, so its lookups are not counted in the statistics of the schedule cache.
+        """
+
+        if self.schedule is not None:
+            return self.schedule
+
+        stop_map = self.stop_map
+
+        found, _, schedule = schedule_cache.get(self.schedule_url, count=count)
+        if found and schedule.ride_data is self.ride_data and schedule.stop_key == make_stop_key(stop_map):
+            return schedule
+
+        schedule = CompiledSchedule(self.ride_data, stop_map)
+
+        _, _, ttl, stale_ttl = get_endpoint_class(self.schedule_url)
+        schedule_cache.put(self.schedule_url, schedule, schedule.nbytes, ttl, stale_ttl)
+
+        return schedule
+
+
+class DirectionVehicles(NamedTuple):
+    type: str
+    name: str
+    ride_numbers: np.ndarray
+    lats: np.ndarray
+    longs: np.ndarray
+    schedule: CompiledSchedule
+    prev_index: np.ndarray      # index (in "schedule") of the last passage of every vehicle
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "type": self.type,
+            "vehicles": [
+                {
+                    "seqNr": int(rit_nr),
+                    "coord": {
+                        "lat": float(lat_vehicle),
+                        "long": float(long_vehicle)
+                    }
+                } for rit_nr, lat_vehicle, long_vehicle in zip(self.ride_numbers, self.lats, self.longs)
+            ]
+        }
+
+    def to_columnar(self) -> dict:
+        """
+            Like to_json(), but with the ride numbers and coordinates of the vehicles in packed arrays (see pack_array()).
+        """
+
+        return {
+            "name": self.name,
+            "type": self.type,
+            "seqNrs": pack_array(self.ride_numbers, "<i8"),
+            "lats": pack_array(self.lats, "<f8"),
+            "longs": pack_array(self.longs, "<f8")
+        }
+
+    def to_segments_json(self, midnight: datetime.datetime) -> dict:
+        """
+            Like to_json(), but every vehicle also contains the segment it is driving on: the previous and the
+            next stop with their scheduled times. The client can interpolate positions up to the "to" time itself.
+        """
+
+        retval = self.to_json()
+
+        for vehicle, prev_index in zip(retval["vehicles"], self.prev_index):
+            vehicle["segment"] = {
+                "from": self._passage_json(prev_index, midnight),
+                "to":   self._passage_json(prev_index + 1, midnight)
+            }
+
+        return retval
+
+    def valid_until(self, seconds: float):
+        """
+            Retrieve the moment (in seconds since midnight) up to which the segments of to_segments_json() remain
+            correct: the first time a vehicle reaches its next stop or a new ride starts. None if that never happens.
+        """
+
+        moments = [int(self.schedule.times[index + 1]) for index in self.prev_index]
+
+        next_departure = self.schedule.next_departure(seconds)
+        if next_departure is not None:
+            moments.append(next_departure)
+
+        return min(moments) if len(moments) > 0 else None
+
+    def _passage_json(self, index: int, midnight: datetime.datetime) -> dict:
+        return {
+            "id": int(self.schedule.stop_ids[index]),
+            "coord": {
+                "lat": float(self.schedule.lats[index]),
+                "long": float(self.schedule.longs[index])
+            },
+            "time": format_time(midnight, int(self.schedule.times[index]))
+        }
+
+
+class DirectionTrajectories(NamedTuple):
+    type: str
+    name: str
+    ride_numbers: np.ndarray
+    lats: np.ndarray            # (moments x rides), NaN where a ride is not under way
+    longs: np.ndarray
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "type": self.type,
+            "seqNrs": [int(rit_nr) for rit_nr in self.ride_numbers],
+            "lats": matrix_to_json(self.lats),
+            "longs": matrix_to_json(self.longs)
+        }
+
+    def to_columnar(self) -> dict:
+        """
+            Like to_json(), but with the ride numbers and the (row-major) matrices in packed arrays (see pack_array()).
+        """
+
+        return {
+            "name": self.name,
+            "type": self.type,
+            "seqNrs": pack_array(self.ride_numbers, "<i8"),
+            "lats": pack_array(self.lats, "<f8"),
+            "longs": pack_array(self.longs, "<f8")
+        }
+
+
+def matrix_to_json(matrix: np.ndarray) -> list:
+    """
+        Convert a matrix to a list of rows, with None (null) instead of NaN.
+    """
+
+    return [[None if value != value else value for value in row] for row in matrix.tolist()]
+
+
+def format_time(midnight: datetime.datetime, seconds: int) -> str:
+    """
+        Format a time in seconds since the specified midnight the way the DeLijn API does.
+    """
+
+    return (midnight + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def request_memoized(*ignored: str):
+    """
+        Remember the results of the decorated function for the duration of the current Flask request,
+        so views that are composed of other views share one computation. An UpstreamError is remembered
+        as well. Outside of a request the function is simply called.
+
+        The result is remembered under the name of the function and its arguments (defaults included, however
+        they were passed), except the arguments named in "ignored", which do not change the result (e.g. priority).
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not has_app_context():
+                return func(*args, **kwargs)
+
+            if "service_memo" not in g:
+                g.service_memo = {}
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            key = (func.__name__,) + tuple(value for name, value in bound.arguments.items() if name not in ignored)
+            if key not in g.service_memo:
+                try:
+                    g.service_memo[key] = func(*args, **kwargs)
+                except UpstreamError as e:
+                    g.service_memo[key] = e
+
+            result = g.service_memo[key]
+            if isinstance(result, UpstreamError):
+                raise result
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def submit_with_memo(pool: ThreadPoolExecutor, func, *args) -> Future:
+    """
+        Submit a call to the pool that shares the request memo of the current request (see request_memoized()),
+        e.g. the lines that asgi.py prefetched. The threads of a pool have no app context of their own.
+    """
+
+    if not has_app_context():
+        return pool.submit(func, *args)
+
+    app = current_app._get_current_object()
+    memo = g.setdefault("service_memo", {})
+
+    def call():
+        with app.app_context():
+            g.service_memo = memo
+            return func(*args)
+
+    return pool.submit(call)
+
+
+@request_memoized("priority")
+def get_line_directions(province_id: int, line_id: int, priority: int = PRIORITY_INTERACTIVE) -> List[Direction]:
+    """
+        Retrieve the directions of the specified line, together with their stops and schedule.
+        The line is read locally if it has been imported (see get_local_line_directions()).
+        Raises UpstreamError if any of this cannot be retrieved from the DeLijn API.
+    """
+
+    # only requests count as an access of the line, the background work of the app does not
+    if priority == PRIORITY_INTERACTIVE:
+        line_popularity.record(province_id, line_id)
+
+    url_dirs = "{}/lijnen/{}/{}/lijnrichtingen".format(delijn_api_url, province_id, line_id)
+
+    directions = get_local_line_directions(province_id, line_id, url_dirs)
+    if directions is not None:
+        return directions
+
+    data_dirs = checked_data(
+        make_get_request(url_dirs, priority=priority, headers=delijn_req_header),
+        "Cannot retrieve line directions from DeLijn API."
+    )
+
+    # retrieve the stops and the schedule of every direction at the same time
+    pending_dirs = []
+    for direction in data_dirs["lijnrichtingen"]:
+        url_stops, url_rides = get_direction_urls(url_dirs, direction["richting"])
+
+        pending_dirs.append((
+            direction,
+            url_rides,
+            upstream_pool.submit(make_get_request, url_stops, priority=priority, headers=delijn_req_header),
+            upstream_pool.submit(make_get_request, url_rides, priority=priority, headers=delijn_req_header)
+        ))
+
+    # NOTE: results are checked in the original order, so the first failing call determines the error.
+    return [
+        make_checked_direction(direction, url_rides, stops_future.result(), rides_future.result())
+        for direction, url_rides, stops_future, rides_future in pending_dirs
+    ]
+
+
+async def get_line_directions_async(province_id: int, line_id: int) -> List[Direction]:
+    """
+        Like get_line_directions(), but the upstream calls are made on the event loop (see async_upstream.py).
+    """
+
+    line_popularity.record(province_id, line_id)
+
+    url_dirs = "{}/lijnen/{}/{}/lijnrichtingen".format(delijn_api_url, province_id, line_id)
+
+    directions = get_local_line_directions(province_id, line_id, url_dirs)
+    if directions is not None:
+        return directions
+
+    data_dirs = checked_data(
+        await make_get_request_async(url_dirs, headers=delijn_req_header),
+        "Cannot retrieve line directions from DeLijn API."
+    )
+
+    # retrieve the stops and the schedule of every direction at the same time
+    urls = [get_direction_urls(url_dirs, direction["richting"]) for direction in data_dirs["lijnrichtingen"]]
+    results = await asyncio.gather(*[
+        make_get_request_async(url, headers=delijn_req_header) for url_stops, url_rides in urls for url in (url_stops, url_rides)
+    ])
+
+    return [
+        make_checked_direction(direction, url_rides, results[2 * i], results[2 * i + 1])
+        for i, (direction, (_, url_rides)) in enumerate(zip(data_dirs["lijnrichtingen"], urls))
+    ]
+
+
+def get_local_line_directions(province_id: int, line_id: int, url_dirs: str):
+    """
+        Retrieve the directions of the specified line from the shared schedules (see shared_schedules.py) or else
+        from the schedule store (see store.py), or None if the line is in neither.
+    """
+
+    if shared_schedules is not None:
+        shared = shared_schedules.get_line(province_id, line_id)
+        if shared is not None:
+            return [
+                Direction(
+                    type=dir_type,
+                    name=dir_name,
+                    stops=[Stop(*stop) for stop in stops],
+                    ride_data=None,
+                    schedule_url=get_direction_urls(url_dirs, dir_type)[1],
+                    schedule=schedule
+                ) for dir_type, dir_name, stops, schedule in shared
+            ]
+
+    if schedule_store is not None:
+        stored = schedule_store.get_line(province_id, line_id)
+        if stored is not None:
+            return get_stored_line_directions(url_dirs, *stored)
+
+    return None
+
+
+def get_direction_urls(url_dirs: str, dir_type: str) -> (str, str):
+    """
+        Retrieve the URLs of the haltes and dienstregelingen of a direction.
+    """
+
+    return "{}/{}/haltes".format(url_dirs, dir_type), "{}/{}/dienstregelingen".format(url_dirs, dir_type)
+
+
+def checked_data(result: tuple, message: str) -> dict:
+    """
+        Retrieve the data of the result of make_get_request(). Raises UpstreamError with the specified message
+        if the call was not successful.
+    """
+
+    flag, status_code, data = result
+    if not flag:
+        raise UpstreamError(
+            status_code,
+            data["boodschap"] if "boodschap" in data else "",
+            message
+        )
+
+    return data
+
+
+def make_checked_direction(direction: dict, url_rides: str, stops_result: tuple, rides_result: tuple) -> Direction:
+    # determine haltes
+    # retrieve list of stops with corresponding information
+    data_stops = checked_data(stops_result, "Cannot retrieve stops from DeLijn API.")
+
+    # retrieve list of stop ids in correct order
+    data_rides = checked_data(rides_result, "Cannot retrieve schedule from DeLijn API.")
+
+    return make_direction(direction, data_stops, data_rides, url_rides)
+
+
+def get_stored_line_directions(url_dirs: str, data_dirs: dict, stored_dirs: dict) -> List[Direction]:
+    """
+        Retrieve the directions of a line from its data in the schedule store (see ScheduleStore.get_line()).
+        Directions of which the stops or schedule were not imported are not scheduled.
+    """
+
+    directions = []
+
+    for direction in data_dirs["lijnrichtingen"]:
+        dir_type = direction["richting"]
+        data_stops, data_rides = stored_dirs.get(dir_type, ({"haltes": []}, {"ritDoorkomsten": []}))
+
+        # the URL is only used as the key of the compiled schedule, so it is the one of the DeLijn API
+        _, url_rides = get_direction_urls(url_dirs, dir_type)
+
+        directions.append(make_direction(direction, data_stops, data_rides, url_rides))
+
+    return directions
+
+
+def make_direction(direction: dict, data_stops: dict, data_rides: dict, url_rides: str) -> Direction:
+    """
+        Build a direction from an element of the lijnrichtingen response and the haltes and dienstregelingen
+        responses of the direction.
+    """
+
+    if len(data_rides["ritDoorkomsten"]) > 0:
+        dir_stops = get_sorted_stoplist(data_stops, data_rides)
+    else:
+        dir_stops = []  # do not return an error, since the other direction could be working fine.
+
+    return Direction(
+        type=direction["richting"],
+        name=direction["omschrijving"],
+        stops=dir_stops,
+        ride_data=data_rides,
+        schedule_url=url_rides
+    )
+
+
+def get_sorted_stoplist(stop_data: dict, ride_data: dict) -> List[Stop]:
+    """
+        Given data about stops and rides, retrieve a list of stops
+        that are sorted in the order that they appear on the ride.
+    """
+
+    # NOTE: we only show the user stops which are part of a ride. This is correct since the animated
+    # vehicles will also depend on rides and will never stop at unused stops.
+
+    # retrieve a list of stop id's in correct order
+    sorted_stop_ids = [int(stop["haltenummer"]) for stop in ride_data["ritDoorkomsten"][0]["doorkomsten"]]
+
+    # map stop ids to stop data
+    stop_map = {
+        int(stop["haltenummer"]): stop for stop in stop_data["haltes"]
+    }
+
+    # compile list of stops
+    return [
+        Stop(
+            id=int(halte['haltenummer']),
+            name=halte['omschrijving'],
+            city=halte['omschrijvingGemeente'],
+            lat=float(halte['geoCoordinaat']['latitude']),
+            long=float(halte['geoCoordinaat']['longitude'])
+        ) for halte in [stop_map[stop_id] for stop_id in sorted_stop_ids if stop_id in stop_map]
+    ]
+
+
+def stops_json(directions: List[Direction]) -> dict:
+    """
+        Retrieve the JSON document with the stops of every direction of a line.
+    """
+
+    return {
+        'dirs': [
+            {
+                'type':  direction.type,
+                'name':  direction.name,
+                'stops': [stop.to_json() for stop in direction.stops]
+            } for direction in directions
+        ]
+    }
+
+
+def stops_to_columnar(stops: List[Stop]) -> dict:
+    """
+        Retrieve the stops as parallel columns, with the ids and coordinates in packed arrays (see pack_array()).
+    """
+
+    return {
+        'ids': pack_array([stop.id for stop in stops], "<i8"),
+        'names': [stop.name for stop in stops],
+        'cities': [stop.city for stop in stops],
+        'lats': pack_array([stop.lat for stop in stops], "<f8"),
+        'longs': pack_array([stop.long for stop in stops], "<f8"),
+    }
+
+
+def find_stop(directions: List[Direction], stop_id: int):
+    """
+        Retrieve the Stop with the specified id from any of the specified directions, or None if there is no such stop.
+    """
+
+    for direction in directions:
+        for stop in direction.stops:
+            if stop.id == stop_id:
+                return stop
+
+    return None
+
+
+def get_vehicle_positions(province_id: int, line_id: int, moment: datetime.datetime, priority: int = PRIORITY_INTERACTIVE) -> List[DirectionVehicles]:
+    """
+        Determine the positions of all vehicles on the specified line at the specified moment.
+        Directions without stops are left out. Raises UpstreamError if the line cannot be retrieved.
+        Background work passes PRIORITY_BACKGROUND, which does not count as a use of the line.
+    """
+
+    return line_vehicle_positions(get_line_directions(province_id, line_id, priority=priority), moment)
+
+
+def line_vehicle_positions(directions: List[Direction], moment: datetime.datetime) -> List[DirectionVehicles]:
+    """
+        Determine the positions of all vehicles on the specified directions of a line at the specified moment.
+    """
+
+    retval = []
+
+    # foreach direction
+    for direction in directions:
+
+        # there are not stops for this direction => this direction is useless
+        if len(direction.stops) == 0:
+            continue
+
+        schedule = direction.get_schedule()
+
+        # interpolate the positions of all vehicles that are under way between two stops
+        active, prev_index, lats, longs = schedule.interpolate(seconds_since_midnight(moment))
+
+        retval.append(DirectionVehicles(direction.type, direction.name, schedule.ride_numbers[active], lats, longs, schedule, prev_index))
+
+    return retval
+
+
+def get_vehicle_positions_range(province_id: int, line_id: int, moments: List[datetime.datetime]) -> List[DirectionTrajectories]:
+    """
+        Determine the positions of all vehicles on the specified line at every one of the specified moments, in one pass
+        per direction. Only the rides that are under way at one of the moments are included. Directions without stops
+        are left out. Raises UpstreamError if the line cannot be retrieved.
+    """
+
+    moment_seconds = np.array([local_seconds(moment) for moment in moments], dtype=np.float64)
+
+    retval = []
+
+    for direction in get_line_directions(province_id, line_id):
+        if len(direction.stops) == 0:
+            continue
+
+        schedule = direction.get_schedule()
+        lats, longs = schedule.interpolate_range(moment_seconds)
+
+        under_way = ~np.all(np.isnan(lats), axis=0)
+
+        retval.append(DirectionTrajectories(direction.type, direction.name, schedule.ride_numbers[under_way], lats[:, under_way], longs[:, under_way]))
+
+    return retval
+
+
+def get_vehicle_positions_batch(keys: list, moment: datetime.datetime) -> dict:
+    """
+        Determine the positions of all vehicles on several lines, specified as (province id, line id), at the same
+        moment. This returns a dict that maps every key to its result of get_vehicle_positions(), or to the
+        UpstreamError that prevented it. Upstream calls that are shared between lines are only made once.
+    """
+
+    pending_lines = {
+        key: submit_with_memo(line_pool, get_vehicle_positions, key[0], key[1], moment) for key in keys
+    }
+
+    retval = {}
+    for key, future in pending_lines.items():
+        try:
+            retval[key] = future.result()
+        except UpstreamError as e:
+            retval[key] = e
+
+    return retval
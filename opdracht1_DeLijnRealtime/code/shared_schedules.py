@@ -0,0 +1,226 @@
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from config import shared_schedules_check_interval, shared_schedules_dir
+from schedule import SCHEDULE_ARRAYS, CompiledSchedule
+
+# first bytes of a segment file, followed by the length of the index (little-endian uint64)
+MAGIC = b"DLSCHED1"
+HEADER = struct.Struct("<8sQ")
+
+# name of the file in the segment directory that holds the file name of the current segment
+POINTER_NAME = "current"
+
+# schedules in a segment are compiled as if their first ride takes place on this day
+REFERENCE_DAY = datetime.date(2000, 1, 1)
+
+
+def write_segment(directory: str, lines: dict) -> str:
+    """
+        Publish the compiled schedules of lines as a new generation of the segment in the specified directory.
+        "lines" maps (province id, line id) to a list of (direction type, direction name, stops, CompiledSchedule or
+        None), with the stops as (id, name, city, lat, long). The schedules must be compiled with their first ride on
+        REFERENCE_DAY. The new generation replaces the current one atomically, and generations before the previous
+        one are removed. Returns the file name of the new generation.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    current = read_pointer(directory)
+    generation = int(current.split("-")[1].split(".")[0]) + 1 if current is not None else 1
+    name = "schedules-{}.bin".format(generation)
+
+    # every array is stored at an offset (from the end of the index) that is a multiple of 8
+    arrays = []
+    offset = 0
+
+    def add_array(array: np.ndarray) -> list:
+        nonlocal offset
+        array = np.ascontiguousarray(array)
+        arrays.append(array)
+        entry = [offset, len(array), array.dtype.str]
+        offset += (array.nbytes + 7) // 8 * 8
+        return entry
+
+    index = {
+        'generation': generation,
+        'created': time.time(),
+        'lines': {
+            "{}/{}".format(*key): [
+                {
+                    'type': dir_type,
+                    'name': dir_name,
+                    'stops': [list(stop) for stop in stops],
+                    'schedule': {array_name: add_array(getattr(schedule, array_name)) for array_name in SCHEDULE_ARRAYS} if schedule is not None else None,
+                } for dir_type, dir_name, stops, schedule in directions
+            ] for key, directions in lines.items()
+        },
+    }
+
+    index_bytes = json.dumps(index, separators=(",", ":")).encode()
+    index_bytes += b" " * (-(HEADER.size + len(index_bytes)) % 8)
+
+    temp_path = os.path.join(directory, name + ".tmp")
+    with open(temp_path, "wb") as segment_file:
+        segment_file.write(HEADER.pack(MAGIC, len(index_bytes)))
+        segment_file.write(index_bytes)
+        for array in arrays:
+            segment_file.write(array.tobytes())
+            segment_file.write(b"\0" * (-array.nbytes % 8))
+        segment_file.flush()
+        os.fsync(segment_file.fileno())
+    os.replace(temp_path, os.path.join(directory, name))
+
+    # NOTE: workers that still map an older generation keep it until they switch, removing the file does not affect them
+    pointer_path = os.path.join(directory, POINTER_NAME)
+    with open(pointer_path + ".tmp", "w") as pointer_file:
+        pointer_file.write(name)
+    os.replace(pointer_path + ".tmp", pointer_path)
+
+    for old_name in os.listdir(directory):
+        if old_name.startswith("schedules-") and old_name not in (name, current):
+            os.remove(os.path.join(directory, old_name))
+
+    return name
+
+
+def read_pointer(directory: str):
+    try:
+        with open(os.path.join(directory, POINTER_NAME)) as pointer_file:
+            return pointer_file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class Segment:
+    """
+        A generation of the schedules, mapped read-only into memory. The arrays of its schedules are views on the
+        mapping, so the pages are shared by all processes that map the same file.
+    """
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+
+        with open(path, "rb") as segment_file:
+            self.mapping = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, index_length = HEADER.unpack_from(self.mapping, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a schedule segment".format(path))
+
+        self.index = json.loads(self.mapping[HEADER.size:HEADER.size + index_length])
+        self.data_start = HEADER.size + index_length
+
+        self._lines = {}    # (province id, line id) -> (day, directions)
+
+    def get_line(self, province_id: int, line_id: int, day: datetime.date):
+        """
+            Retrieve the directions of a line as (type, name, stops, CompiledSchedule or None), with the rides
+            on the specified day, or None if the line is not in this segment.
+        """
+
+        key = (province_id, line_id)
+
+        found = self._lines.get(key)
+        if found is not None and found[0] == day:
+            return found[1]
+
+        entries = self.index['lines'].get("{}/{}".format(province_id, line_id))
+        if entries is None:
+            return None
+
+        shift = (day.toordinal() - REFERENCE_DAY.toordinal()) * 86400
+
+        directions = []
+        for entry in entries:
+            schedule = None
+            if entry['schedule'] is not None:
+                arrays = {name: self._array(*location) for name, location in entry['schedule'].items()}
+                arrays['ride_midnights'] = arrays['ride_midnights'] + shift   # a (small) private copy
+                schedule = CompiledSchedule.from_arrays(arrays)
+
+            directions.append((entry['type'], entry['name'], [tuple(stop) for stop in entry['stops']], schedule))
+
+        self._lines[key] = (day, directions)
+
+        return directions
+
+    def _array(self, offset: int, length: int, dtype: str) -> np.ndarray:
+        return np.frombuffer(self.mapping, dtype=np.dtype(dtype), count=length, offset=self.data_start + offset)
+
+
+class SharedSchedules:
+    """
+        The compiled schedules that importer.py published in a directory (see write_segment()). Every process maps
+        the current generation read-only, so the memory that the schedules take does not grow with the number of
+        worker processes. A new generation is picked up at most config.shared_schedules_check_interval seconds
+        after it was published, requests that are still using the previous generation finish with it.
+    """
+
+    def __init__(self, directory: str, check_interval: float):
+        self.directory = directory
+        self.check_interval = check_interval
+
+        self.segment = None
+        self.checked = 0.0
+        self.swaps = 0
+
+        self._lock = threading.Lock()
+
+    def get_line(self, province_id: int, line_id: int):
+        """
+            Retrieve the directions of a line (see Segment.get_line()) with the rides on the current day,
+            or None if the line has not been published.
+        """
+
+        segment = self.get_segment()
+        if segment is None:
+            return None
+
+        return segment.get_line(province_id, line_id, datetime.date.today())
+
+    def get_segment(self):
+        now = time.monotonic()
+
+        if now - self.checked >= self.check_interval:
+            with self._lock:
+                if now - self.checked >= self.check_interval:
+                    self.checked = now
+                    self._swap()
+
+        return self.segment
+
+    def _swap(self) -> None:
+        # NOTE: the lock must be held by the caller
+        name = read_pointer(self.directory)
+        if name is None or (self.segment is not None and self.segment.name == name):
+            return
+
+        try:
+            # NOTE: replacing the reference is atomic, the previous mapping is closed once nobody uses it
+            self.segment = Segment(os.path.join(self.directory, name))
+            self.swaps += 1
+        except (OSError, ValueError):
+            pass    # the pointer was replaced while reading it, the next check picks up the newest generation
+
+    def stats(self) -> dict:
+        segment = self.segment
+
+        return {
+            'directory': self.directory,
+            'generation': segment.index['generation'] if segment is not None else None,
+            'lines': len(segment.index['lines']) if segment is not None else 0,
+            'bytes': len(segment.mapping) if segment is not None else 0,
+            'swaps': self.swaps,
+        }
+
+
+# None if the schedules are not shared between processes
+shared_schedules = SharedSchedules(shared_schedules_dir, shared_schedules_check_interval) if shared_schedules_dir else None
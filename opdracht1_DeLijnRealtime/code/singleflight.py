@@ -0,0 +1,142 @@
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """
+        Raised when a caller gives up waiting for a call that another caller is making.
+    """
+
+
+class Call:
+    """
+        A call that is in progress, together with its outcome once it is done.
+    """
+
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+        Coalesces concurrent identical calls: while a call for some key is in progress, other callers with
+        the same key do not make the call themselves but wait for it and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def do(self, key, func, timeout: float = None):
+        """
+            Return func(), or the result of the call for the same key that is already in progress. A caller that
+            waits for another caller raises SingleFlightTimeout after "timeout" seconds (None waits forever).
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is None:
+                call = Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise SingleFlightTimeout("timed out waiting for an identical call in progress")
+
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'inFlight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'timeouts': self.timeouts,
+            }
+
+
+class AsyncSingleFlight:
+    """
+        Like SingleFlight, but for coroutines that run on a single event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}    # key -> asyncio.Future
+
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    async def do(self, key, func, timeout: float = None):
+        """
+            Return await func(), or the result of the call for the same key that is already in progress. A caller that
+            waits for another caller raises SingleFlightTimeout after "timeout" seconds (None waits forever).
+        """
+
+        call = self._calls.get(key)
+
+        if call is not None:
+            self.followers += 1
+            try:
+                # NOTE: shielded, so a follower that gives up does not cancel the call of the leader
+                return await asyncio.wait_for(asyncio.shield(call), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise SingleFlightTimeout("timed out waiting for an identical call in progress")
+
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        self.leaders += 1
+
+        try:
+            result = await func()
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            call.exception()    # the followers (if any) get the exception, so it must not be reported as unretrieved
+            raise
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            'inFlight': len(self._calls),
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+
+# mean radius of the earth in meters
+EARTH_RADIUS = 6371008.8
+
+# length of one degree of latitude in meters
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def haversine(lat: float, long: float, lats: np.ndarray, longs: np.ndarray) -> np.ndarray:
+    """
+        Retrieve the great-circle distances in meters between a coordinate and an array of coordinates.
+    """
+
+    lat1, long1 = math.radians(lat), math.radians(long)
+    lats2, longs2 = np.radians(lats), np.radians(longs)
+
+    a = np.sin((lats2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats2) * np.sin((longs2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class StopIndex:
+    """
+        A grid index of stops. The stops are sorted by grid cell, so the stops of a cell form a contiguous
+        slice. Queries collect the stops of the cells around a coordinate as candidates and compute their
+        exact (haversine) distance.
+    """
+
+    def __init__(self, stops: list, cell_size: float):
+        """
+            Build the index of the specified (province id, Stop) pairs with square cells of "cell_size" degrees.
+        """
+
+        self.cell_size = cell_size
+
+        lats = np.array([stop.lat for _, stop in stops], dtype=np.float64)
+        longs = np.array([stop.long for _, stop in stops], dtype=np.float64)
+        cells_lat = np.floor(lats / cell_size).astype(np.int64)
+        cells_long = np.floor(longs / cell_size).astype(np.int64)
+
+        order = np.lexsort((cells_long, cells_lat))
+
+        self.stops = [stops[i] for i in order]
+        self.lats = lats[order]
+        self.longs = longs[order]
+
+        # cell -> (start, end) of its stops
+        self._cells = {}
+        cells_lat, cells_long = cells_lat[order], cells_long[order]
+        boundaries = np.flatnonzero((np.diff(cells_lat) != 0) | (np.diff(cells_long) != 0)) + 1
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(order)]))):
+            if end > start:
+                self._cells[(int(cells_lat[start]), int(cells_long[start]))] = (int(start), int(end))
+
+    def __len__(self) -> int:
+        return len(self.stops)
+
+    def nearest(self, lat: float, long: float, k: int, max_distance: float = math.inf) -> list:
+        """
+            Retrieve the (at most) "k" stops that are closest to the specified coordinate and at most "max_distance"
+            meters away, as (province id, Stop, distance in meters), closest first. The rings of cells around the
+            coordinate are searched until no unsearched cell can contain a stop that is closer than the k-th
+            candidate, or than "max_distance".
+        """
+
+        if len(self.stops) == 0 or k <= 0:
+            return []
+
+        cell_lat, cell_long = math.floor(lat / self.cell_size), math.floor(long / self.cell_size)
+
+        candidates = []
+        ring = 0
+        while True:
+            # the rings searched so far hold more cells than there are cells with stops => give up on the grid
+            if (2 * ring + 1) ** 2 > len(self._cells):
+                return self._results(np.arange(len(self.stops)), lat, long, k, max_distance=max_distance)
+
+            candidates.extend(self._ring_slices(cell_lat, cell_long, ring))
+            searched_radius = self._searched_radius(lat, long, cell_lat, cell_long, ring)
+
+            if sum(end - start for start, end in candidates) >= k or searched_radius >= max_distance:
+                indices = np.concatenate([np.arange(start, end) for start, end in candidates] + [np.zeros(0, dtype=np.int64)])
+                distances = haversine(lat, long, self.lats[indices], self.longs[indices])
+                kth_distance = np.partition(distances, k - 1)[k - 1] if len(distances) >= k else math.inf
+
+                if min(kth_distance, max_distance) <= searched_radius:
+                    return self._results(indices, lat, long, k, distances, max_distance)
+
+            ring += 1
+
+    def within(self, lat: float, long: float, radius: float) -> list:
+        """
+            Retrieve all stops within "radius" meters of the specified coordinate as (province id, Stop, distance in
+            meters), closest first.
+        """
+
+        if len(self.stops) == 0:
+            return []
+
+        radius_lat = radius / METERS_PER_DEGREE
+        radius_long = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(min(abs(lat) + radius_lat, 89.0))), 1e-6))
+
+        slices = []
+        for cell_lat in range(math.floor((lat - radius_lat) / self.cell_size), math.floor((lat + radius_lat) / self.cell_size) + 1):
+            for cell_long in range(math.floor((long - radius_long) / self.cell_size), math.floor((long + radius_long) / self.cell_size) + 1):
+                if (cell_lat, cell_long) in self._cells:
+                    slices.append(self._cells[(cell_lat, cell_long)])
+
+        if len(slices) == 0:
+            return []
+
+        indices = np.concatenate([np.arange(start, end) for start, end in slices])
+        distances = haversine(lat, long, self.lats[indices], self.longs[indices])
+
+        inside = distances <= radius
+        return self._results(indices[inside], lat, long, int(np.count_nonzero(inside)), distances[inside])
+
+    def in_bounds(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """
+            Retrieve the positions (in "stops", "lats" and "longs") of all stops inside the specified bounding box.
+        """
+
+        cells_lat = range(math.floor(south / self.cell_size), math.floor(north / self.cell_size) + 1)
+        cells_long = range(math.floor(west / self.cell_size), math.floor(east / self.cell_size) + 1)
+
+        # a large box contains more cells than there are cells with stops => check every stop instead
+        if len(cells_lat) * len(cells_long) > len(self._cells):
+            indices = np.arange(len(self.stops))
+        else:
+            slices = [self._cells[(cell_lat, cell_long)] for cell_lat in cells_lat for cell_long in cells_long if (cell_lat, cell_long) in self._cells]
+            if len(slices) == 0:
+                return np.zeros(0, dtype=np.int64)
+            indices = np.concatenate([np.arange(start, end) for start, end in slices])
+
+        lats, longs = self.lats[indices], self.longs[indices]
+        return indices[(lats >= south) & (lats <= north) & (longs >= west) & (longs <= east)]
+
+    def _ring_slices(self, cell_lat: int, cell_long: int, ring: int) -> list:
+        if ring == 0:
+            cells = [(cell_lat, cell_long)]
+        else:
+            cells = [(cell_lat + d_lat, cell_long + d_long) for d_lat in (-ring, ring) for d_long in range(-ring, ring + 1)]
+            cells += [(cell_lat + d_lat, cell_long + d_long) for d_lat in range(-ring + 1, ring) for d_long in (-ring, ring)]
+
+        return [self._cells[cell] for cell in cells if cell in self._cells]
+
+    def _searched_radius(self, lat: float, long: float, cell_lat: int, cell_long: int, ring: int) -> float:
+        """
+            Retrieve (approximately) the distance in meters from the coordinate to the closest point outside the
+            square of cells that has been searched up to and including the specified ring.
+        """
+
+        low_lat, high_lat = (cell_lat - ring) * self.cell_size, (cell_lat + ring + 1) * self.cell_size
+        low_long, high_long = (cell_long - ring) * self.cell_size, (cell_long + ring + 1) * self.cell_size
+
+        # a degree of longitude is shortest at the edge of the square that is farthest from the equator
+        long_scale = math.cos(math.radians(min(max(abs(low_lat), abs(high_lat)), 90.0)))
+
+        return min(
+            (lat - low_lat) * METERS_PER_DEGREE,
+            (high_lat - lat) * METERS_PER_DEGREE,
+            (long - low_long) * METERS_PER_DEGREE * long_scale,
+            (high_long - long) * METERS_PER_DEGREE * long_scale,
+        )
+
+    def _results(self, indices: np.ndarray, lat: float, long: float, k: int, distances: np.ndarray = None, max_distance: float = math.inf) -> list:
+        if distances is None:
+            distances = haversine(lat, long, self.lats[indices], self.longs[indices])
+
+        if max_distance < math.inf:
+            inside = distances <= max_distance
+            indices, distances = indices[inside], distances[inside]
+
+        order = np.argsort(distances, kind="stable")[:k]
+
+        return [self.stops[indices[i]] + (float(distances[i]),) for i in order]
@@ -0,0 +1,169 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+from config import schedule_store_cache_max_bytes, schedule_store_path, schedule_store_ttl
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS lines (
+        province_id INTEGER NOT NULL,
+        line_id INTEGER NOT NULL,
+        directions TEXT NOT NULL,       -- the lijnrichtingen response
+        imported REAL NOT NULL,         -- time.time() of the import
+        PRIMARY KEY (province_id, line_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS directions (
+        province_id INTEGER NOT NULL,
+        line_id INTEGER NOT NULL,
+        dir_type TEXT NOT NULL,
+        stops TEXT NOT NULL,            -- the haltes response
+        rides TEXT NOT NULL,            -- the dienstregelingen response
+        PRIMARY KEY (province_id, line_id, dir_type)
+    );
+"""
+
+
+def shift_to_day(data: dict, day: datetime.date) -> dict:
+    """
+        Move all scheduled times of a dienstregelingen response by a whole number of days, so the first ride
+        takes place on the specified day. Rides that cross midnight keep doing so.
+    """
+
+    rides = data.get("ritDoorkomsten", [])
+    times = [doorkomst["dienstregelingTijdstip"] for rit in rides for doorkomst in rit["doorkomsten"] if "dienstregelingTijdstip" in doorkomst]
+    if len(times) == 0:
+        return data
+
+    offset = day - datetime.datetime.fromisoformat(min(times)).date()
+    if offset.days == 0:
+        return data
+
+    for rit in rides:
+        for doorkomst in rit["doorkomsten"]:
+            if "dienstregelingTijdstip" in doorkomst:
+                moment = datetime.datetime.fromisoformat(doorkomst["dienstregelingTijdstip"]) + offset
+                doorkomst["dienstregelingTijdstip"] = moment.strftime("%Y-%m-%dT%H:%M:%S")
+
+    return data
+
+
+class ScheduleStore:
+    """
+        A local SQLite file with the directions, stops and schedules of lines, stored as the responses of the
+        DeLijn API and keyed by (province, line, direction). It is filled by importer.py, so lines can be served
+        without calling the DeLijn API.
+
+        An imported timetable is used as the timetable of every day: the scheduled times are moved to the
+        current day when a line is read. Lines that were read are kept in memory for config.schedule_store_ttl
+        seconds, so a new import is picked up after at most that time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.cache = TTLCache(schedule_store_cache_max_bytes)
+
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # NOTE: a connection cannot be shared between threads
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(self.path)
+            self._local.connection.executescript(SCHEMA)
+
+        return self._local.connection
+
+    def put_line(self, province_id: int, line_id: int, data_dirs: dict, directions: dict) -> None:
+        """
+            Store a line, replacing any previous import of it. "directions" maps the direction type to the
+            (haltes response, dienstregelingen response) of the direction.
+        """
+
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM directions WHERE province_id = ? AND line_id = ?", (province_id, line_id))
+            connection.execute(
+                "INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?)",
+                (province_id, line_id, json.dumps(data_dirs), time.time())
+            )
+            connection.executemany(
+                "INSERT INTO directions VALUES (?, ?, ?, ?, ?)",
+                [
+                    (province_id, line_id, dir_type, json.dumps(data_stops), json.dumps(data_rides))
+                    for dir_type, (data_stops, data_rides) in directions.items()
+                ]
+            )
+
+    def get_line(self, province_id: int, line_id: int):
+        """
+            Retrieve (lijnrichtingen response, {direction type: (haltes response, dienstregelingen response)}) of
+            the specified line, or None if the line was never imported. Directions without stops or schedule
+            are missing from the dict.
+            NOTE: the returned data is shared between requests and must never be modified by the caller.
+        """
+
+        today = datetime.date.today()
+        key = (province_id, line_id, today)
+
+        found, _, line = self.cache.get(key)
+        if found:
+            return line
+
+        line, size = self.read_line(province_id, line_id, today)
+        if line is not None:
+            self.cache.put(key, line, size, schedule_store_ttl)
+
+        return line
+
+    def read_line(self, province_id: int, line_id: int, day: datetime.date):
+        """
+            Read a line like get_line() does, with the scheduled times moved to the specified day and without
+            using the cache. This returns (line or None, approximate size in bytes).
+        """
+
+        connection = self._connection()
+
+        row = connection.execute(
+            "SELECT directions FROM lines WHERE province_id = ? AND line_id = ?", (province_id, line_id)
+        ).fetchone()
+        if row is None:
+            return None, 0
+
+        size = len(row[0])
+        directions = {}
+
+        for dir_type, stops, rides in connection.execute(
+            "SELECT dir_type, stops, rides FROM directions WHERE province_id = ? AND line_id = ?", (province_id, line_id)
+        ):
+            directions[dir_type] = (json.loads(stops), shift_to_day(json.loads(rides), day))
+            size += len(stops) + len(rides)
+
+        return (json.loads(row[0]), directions), size
+
+    def line_keys(self) -> list:
+        """
+            Retrieve the (province id, line id) of all imported lines.
+        """
+
+        return self._connection().execute("SELECT province_id, line_id FROM lines ORDER BY province_id, line_id").fetchall()
+
+    def stats(self) -> dict:
+        connection = self._connection()
+
+        lines, oldest = connection.execute("SELECT COUNT(*), MIN(imported) FROM lines").fetchone()
+        directions, = connection.execute("SELECT COUNT(*) FROM directions").fetchone()
+
+        return {
+            'path': self.path,
+            'lines': lines,
+            'directions': directions,
+            'oldestImport': datetime.datetime.fromtimestamp(oldest).isoformat(timespec="seconds") if oldest is not None else None,
+            'cache': self.cache.stats(),
+        }
+
+
+# None if lines are read from the DeLijn API
+schedule_store = ScheduleStore(schedule_store_path) if schedule_store_path else None
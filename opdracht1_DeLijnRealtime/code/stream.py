@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import json
+import queue
+import threading
+import time
+
+from config import vehicle_stream_interval, vehicle_stream_keepalive
+from delijn_client import PRIORITY_BACKGROUND
+from log import logger
+from service import UpstreamError, get_vehicle_positions
+
+
+def vehicles_error_json(error: UpstreamError) -> dict:
+    """
+        Retrieve the error document that is returned when the vehicles of a line cannot be determined.
+    """
+
+    return {
+        'causeErrorStatus': 500,
+        'causeErrorMessage': error.message,
+        'errorMessage': "Cannot retrieve vehicles: cannot retrieve stops from internal API.",
+        'responseCode': 500
+    }
+
+
+class QueueSubscriber:
+    """
+        A subscriber of the vehicle broadcaster that is read by a thread. Only the most recent event is kept.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=1)
+
+    def offer(self, event: str) -> None:
+        # NOTE: only the broadcaster offers events (under its lock), so the queue has room after emptying it
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put_nowait(event)
+
+    def get(self, timeout: float):
+        """
+            Wait for the next event, or return None if there is none within "timeout" seconds.
+        """
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LoopSubscriber:
+    """
+        A subscriber of the vehicle broadcaster that is read by a coroutine on the specified event loop.
+        Only the most recent event is kept.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.event = None
+        self._ready = asyncio.Event()
+
+    def offer(self, event: str) -> None:
+        # NOTE: the broadcaster runs on its own thread
+        self.loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: str) -> None:
+        self.event = event
+        self._ready.set()
+
+    async def get(self, timeout: float):
+        """
+            Wait for the next event, or return None if there is none within "timeout" seconds.
+        """
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        self._ready.clear()
+        event, self.event = self.event, None
+        return event
+
+
+class VehicleBroadcaster:
+    """
+        Computes the vehicle positions of every line that is being watched once per tick and sends
+        the result to all subscribers of that line. Lines without subscribers are not computed.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+
+        self._subscribers = {}      # (province id, line id) -> set of subscribers (see QueueSubscriber)
+        self._last_events = {}      # (province id, line id) -> last event that was sent
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self, province_id: int, line_id: int, subscriber=None):
+        """
+            Start receiving the events of the specified line. This returns the subscriber, which is a new
+            QueueSubscriber unless one is specified. A subscriber only ever holds the most recent event.
+        """
+
+        if subscriber is None:
+            subscriber = QueueSubscriber()
+        key = (province_id, line_id)
+
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+
+            if key in self._last_events:
+                subscriber.offer(self._last_events[key])
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._tick_loop, daemon=True)
+                self._thread.start()
+
+        self._wakeup.set()
+
+        return subscriber
+
+    def unsubscribe(self, province_id: int, line_id: int, subscriber) -> None:
+        key = (province_id, line_id)
+
+        with self._lock:
+            subscribers = self._subscribers.get(key, set())
+            subscribers.discard(subscriber)
+
+            # this line is no longer watched => drop it from the tick loop
+            if len(subscribers) == 0:
+                self._subscribers.pop(key, None)
+                self._last_events.pop(key, None)
+
+    def stream(self, province_id: int, line_id: int):
+        """
+            Generate the Server-Sent Events of the specified line until the client disconnects.
+        """
+
+        subscriber = self.subscribe(province_id, line_id)
+
+        try:
+            while True:
+                event = subscriber.get(vehicle_stream_keepalive)
+                yield event if event is not None else ": keepalive\n\n"
+        finally:
+            self.unsubscribe(province_id, line_id, subscriber)
+
+    def tick(self) -> None:
+        """
+            Compute and send the positions of all lines that currently have subscribers.
+        """
+
+        with self._lock:
+            keys = list(self._subscribers.keys())
+
+        current_time = datetime.datetime.now()
+
+        for key in keys:
+            try:
+                # NOTE: ticks are not requests of users, so they neither count as uses of the line nor take interactive tokens
+                positions = get_vehicle_positions(key[0], key[1], current_time, priority=PRIORITY_BACKGROUND)
+                event = "data: {}\n\n".format(json.dumps({
+                    'dirs': [direction_vehicles.to_json() for direction_vehicles in positions],
+                    'responseCode': 200
+                }))
+            except UpstreamError as e:
+                event = "event: error\ndata: {}\n\n".format(json.dumps(vehicles_error_json(e)))
+
+            self._broadcast(key, event)
+
+    def _broadcast(self, key, event: str) -> None:
+        with self._lock:
+            if key not in self._subscribers:
+                return
+
+            self._last_events[key] = event
+
+            # a slow client skips the positions it did not get to, only the newest ones matter
+            for subscriber in self._subscribers[key]:
+                subscriber.offer(event)
+
+    def _tick_loop(self) -> None:
+        while True:
+            with self._lock:
+                idle = len(self._subscribers) == 0
+
+            if idle:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            start = time.monotonic()
+
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Cannot update vehicle streams.")
+
+            time.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+
+vehicle_broadcaster = VehicleBroadcaster(vehicle_stream_interval)
@@ -0,0 +1,115 @@
+import datetime
+import os
+import random
+import sys
+import time
+
+import pytest
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the tests never call the upstream APIs, the background threads of the app that try get a connection error right away
+os.environ.setdefault("DELIJN_API_URL", "http://127.0.0.1:9/delijn")
+os.environ.setdefault("OPEN_WEATHER_API_URL", "http://127.0.0.1:9/owm")
+
+sys.path.insert(0, CODE_DIR)
+sys.path.insert(0, os.path.join(CODE_DIR, "bench"))
+
+from service import Direction, get_sorted_stoplist  # noqa: E402
+from synthetic import make_dienstregelingen, make_haltes  # noqa: E402
+
+
+def make_line_directions(province_id: int, line_id: int, day: datetime.date, num_stops: int = 10, num_rides: int = 50,
+                         seed: int = 42) -> list:
+    """
+        Generate the directions of a line, as get_line_directions() retrieves them, from synthetic responses.
+    """
+
+    rng = random.Random(seed)
+
+    data_stops = make_haltes(1000 * line_id, num_stops, rng)
+    stop_ids = [int(halte["haltenummer"]) for halte in data_stops["haltes"]]
+
+    directions = []
+    for dir_type, dir_stop_ids in (("HEEN", stop_ids), ("TERUG", stop_ids[::-1])):
+        data_rides = make_dienstregelingen(dir_stop_ids, num_rides, day, rng)
+
+        directions.append(Direction(
+            type=dir_type,
+            name="Lijn {} {}".format(line_id, dir_type.lower()),
+            stops=get_sorted_stoplist(data_stops, data_rides),
+            ride_data=data_rides,
+            schedule_url="test/lijnen/{}/{}/lijnrichtingen/{}/dienstregelingen".format(province_id, line_id, dir_type)
+        ))
+
+    return directions
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    """
+        Wait (in real time) until the condition is met, and fail the test if it takes longer than the timeout.
+    """
+
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition not met in time"
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def no_upstream(monkeypatch):
+    """
+        Make every synchronous upstream call fail the test, and collect the URLs that were requested.
+    """
+
+    import service
+
+    calls = []
+
+    def make_get_request(url, *args, **kwargs):
+        calls.append(url)
+        raise AssertionError("Unexpected upstream call: {}".format(url))
+
+    monkeypatch.setattr(service, "make_get_request", make_get_request)
+
+    return calls
+
+
+class FakeClock:
+    """
+        Stands in for the time module of the modules under test: monotonic() only moves when the test advances it
+        or when the code under test sleeps. Everything else is that of the time module.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+        Replace the clock of the cache and of the upstream clients by a FakeClock.
+        NOTE: code that waits on a threading primitive still waits in real time.
+    """
+
+    import cache
+    import delijn_client
+
+    fake_clock = FakeClock()
+
+    monkeypatch.setattr(cache, "time", fake_clock)
+    monkeypatch.setattr(delijn_client, "time", fake_clock)
+
+    return fake_clock
@@ -0,0 +1,51 @@
+"""
+    The views of app.py must use the lines that asgi.py prefetched for their request (see request_memoized()),
+    instead of retrieving them again on the render thread.
+"""
+
+import datetime
+
+from conftest import make_line_directions
+from app import PREFETCHED_ENVIRON_KEY, app
+from service import UpstreamError
+
+
+def get_prefetched(path: str, memo: dict):
+    return app.test_client().get(path, environ_overrides={PREFETCHED_ENVIRON_KEY: memo})
+
+
+def test_vehicles_use_prefetched_line(no_upstream):
+    directions = make_line_directions(1, 2, datetime.date.today())
+
+    response = get_prefetched("/api/provinces/1/lines/2/vehicles/", {("get_line_directions", 1, 2): directions})
+
+    assert response.status_code == 200
+    assert [direction['type'] for direction in response.get_json()['dirs']] == ["HEEN", "TERUG"]
+    assert no_upstream == []
+
+
+def test_vehicles_use_prefetched_error(no_upstream):
+    error = UpstreamError(503, "Service Unavailable", "Cannot retrieve line directions from DeLijn API.")
+
+    response = get_prefetched("/api/provinces/1/lines/2/vehicles/", {("get_line_directions", 1, 2): error})
+
+    assert response.status_code == 500
+    assert response.get_json()['causeErrorMessage'] == error.message
+    assert no_upstream == []
+
+
+def test_batch_uses_prefetched_lines(no_upstream):
+    error = UpstreamError(503, "Service Unavailable", "Cannot retrieve line directions from DeLijn API.")
+    memo = {
+        ("get_line_directions", 1, 2): make_line_directions(1, 2, datetime.date.today()),
+        ("get_line_directions", 1, 3): error,
+    }
+
+    response = get_prefetched("/api/vehicles/?lines=1:2,1:3", memo)
+
+    assert response.status_code == 200
+    lines = {(line['province'], line['line']): line for line in response.get_json()['lines']}
+    assert lines[(1, 2)]['responseCode'] == 200
+    assert lines[(1, 3)]['responseCode'] == 500
+    assert lines[(1, 3)]['causeErrorMessage'] == error.message
+    assert no_upstream == []
@@ -0,0 +1,79 @@
+from cache import TTLCache
+
+
+def test_entry_is_fresh_then_stale_then_gone(clock):
+    cache = TTLCache(1000)
+    cache.put("a", "value", 10, ttl=60, stale_ttl=30)
+
+    assert cache.get("a") == (True, True, "value")
+
+    clock.advance(61)
+    assert cache.get("a") == (True, False, "value")
+
+    clock.advance(30)
+    assert cache.get("a") == (False, False, None)
+    assert cache.current_bytes == 0
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['staleHits'], stats['misses']) == (1, 1, 1)
+
+
+def test_least_recently_used_entries_are_evicted_to_stay_within_budget(clock):
+    cache = TTLCache(100)
+    cache.put("a", 1, 40, ttl=60)
+    cache.put("b", 2, 40, ttl=60)
+
+    cache.get("a")              # "b" is now the least recently used
+    cache.put("c", 3, 40, ttl=60)
+
+    assert cache.get("a")[0]
+    assert not cache.get("b")[0]
+    assert cache.get("c")[0]
+    assert cache.current_bytes == 80
+    assert cache.stats()['evictions'] == 1
+
+
+def test_one_entry_can_evict_several(clock):
+    cache = TTLCache(100)
+    for key in "abcd":
+        cache.put(key, key, 25, ttl=60)
+
+    cache.put("e", "e", 60, ttl=60)
+
+    assert [key for key in "abcde" if cache.get(key)[0]] == ["d", "e"]
+    assert cache.current_bytes == 85
+
+
+def test_values_larger_than_the_budget_are_not_stored(clock):
+    cache = TTLCache(100)
+    cache.put("a", 1, 40, ttl=60)
+    cache.put("big", 2, 101, ttl=60)
+
+    assert not cache.get("big")[0]
+    assert cache.get("a")[0]
+    assert cache.current_bytes == 40
+
+
+def test_replacing_an_entry_replaces_its_size(clock):
+    cache = TTLCache(100)
+    cache.put("a", 1, 40, ttl=60)
+    cache.put("a", 2, 30, ttl=60)
+
+    assert cache.get("a") == (True, True, 2)
+    assert cache.current_bytes == 30
+
+
+def test_time_to_live_and_uncounted_lookups_leave_the_counters_alone(clock):
+    cache = TTLCache(100)
+    cache.put("a", 1, 10, ttl=60, stale_ttl=30)
+
+    assert cache.time_to_live("a") == 60
+    clock.advance(70)
+    assert cache.time_to_live("a") == -10
+    assert cache.time_to_live("b") is None
+
+    assert cache.get("a", count=False) == (True, False, 1)
+    assert cache.get("b", count=False) == (False, False, None)
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['staleHits'], stats['misses']) == (0, 0, 0)
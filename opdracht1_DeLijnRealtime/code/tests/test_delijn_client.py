@@ -0,0 +1,210 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from config import upstream_max_retries
+from delijn_client import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, CircuitBreaker, TokenBucket, UpstreamClient, UpstreamUnavailable
+from conftest import wait_until
+
+
+def test_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.advance(0.5)
+    assert bucket.try_acquire() == 0.0
+
+    # tokens do not pile up beyond the burst
+    clock.advance(60)
+    assert [bucket.try_acquire() for _ in range(4)][-1] > 0.0
+
+
+def test_bucket_gives_up_at_the_deadline():
+    bucket = TokenBucket(rate=0.1, burst=1)
+    assert bucket.acquire(PRIORITY_INTERACTIVE, time.monotonic() + 1)
+
+    start = time.monotonic()
+    assert not bucket.acquire(PRIORITY_INTERACTIVE, start + 0.05)
+    assert time.monotonic() - start < 1
+
+
+def test_bucket_serves_interactive_waiters_before_background_waiters():
+    bucket = TokenBucket(rate=5, burst=1)
+    assert bucket.acquire(PRIORITY_INTERACTIVE, time.monotonic() + 1)
+
+    served = []
+
+    def wait_for_token(name: str, priority: int):
+        assert bucket.acquire(priority, time.monotonic() + 5)
+        served.append(name)
+
+    background = threading.Thread(target=wait_for_token, args=("background", PRIORITY_BACKGROUND))
+    background.start()
+    wait_until(lambda: len(bucket._waiters) == 1)
+
+    # arrives later, but before the next token (after 0.2 seconds)
+    interactive = threading.Thread(target=wait_for_token, args=("interactive", PRIORITY_INTERACTIVE))
+    interactive.start()
+
+    background.join()
+    interactive.join()
+
+    assert served == ["interactive", "background"]
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker(window=30, error_rate=0.5, min_calls=4, cooldown=15)
+
+
+def record_calls(breaker: CircuitBreaker, outcomes: list) -> None:
+    for ok in outcomes:
+        breaker.record(breaker.allow(), ok)
+
+
+def test_breaker_opens_above_the_error_rate_after_min_calls(clock):
+    breaker = make_breaker()
+
+    record_calls(breaker, [False, False, False])
+    assert breaker.state == "closed"    # fewer than min_calls
+
+    record_calls(breaker, [False])
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+
+
+def test_breaker_only_counts_outcomes_within_the_window(clock):
+    breaker = make_breaker()
+
+    record_calls(breaker, [False, False, False])
+    clock.advance(31)
+    record_calls(breaker, [True, True, False, True])
+
+    assert breaker.state == "closed"
+
+
+def test_breaker_lets_a_single_trial_call_through_after_the_cooldown(clock):
+    breaker = make_breaker()
+    record_calls(breaker, [False] * 4)
+
+    clock.advance(15)
+    trial = breaker.allow()
+
+    assert trial is not None
+    assert breaker.state == "half-open"
+    assert breaker.allow() is None
+
+    breaker.record(trial, True)
+    assert breaker.state == "closed"
+
+
+def test_failed_trial_call_opens_the_breaker_again(clock):
+    breaker = make_breaker()
+    record_calls(breaker, [False] * 4)
+
+    clock.advance(15)
+    breaker.record(breaker.allow(), False)
+
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+    assert breaker.times_opened == 2
+
+
+def test_calls_from_before_the_breaker_opened_do_not_decide_the_trial(clock):
+    breaker = make_breaker()
+    slow_call = breaker.allow()
+    record_calls(breaker, [False] * 4)
+
+    clock.advance(15)
+    trial = breaker.allow()
+
+    # the slow call succeeds after all, but it was allowed in an earlier epoch
+    breaker.record(slow_call, True)
+    assert breaker.state == "half-open"
+
+    breaker.record(trial, False)
+    assert breaker.state == "open"
+
+
+class FakeSession:
+    def __init__(self, outcomes: list):
+        self.outcomes = outcomes
+        self.calls = 0
+
+    def get(self, url, timeout=None, **kwargs):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+
+def make_client(outcomes: list) -> UpstreamClient:
+    client = UpstreamClient("test API", rate=100, burst=100)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def test_client_retries_server_errors(clock):
+    client = make_client([503, 200])
+
+    assert client.get("http://test/").status_code == 200
+    assert (client.calls, client.retries) == (2, 1)
+
+
+def test_client_returns_the_last_error_response_after_the_retries(clock):
+    client = make_client([503])
+
+    assert client.get("http://test/").status_code == 503
+    assert client.calls == upstream_max_retries + 1
+
+
+def test_client_raises_when_the_upstream_cannot_be_reached(clock):
+    client = make_client([requests.ConnectionError()])
+
+    with pytest.raises(UpstreamUnavailable) as e:
+        client.get("http://test/")
+
+    assert e.value.status_code == 502
+
+
+def test_client_does_not_retry_client_errors(clock):
+    client = make_client([404])
+
+    assert client.get("http://test/").status_code == 404
+    assert client.calls == 1
+
+
+def test_client_rejects_calls_while_the_breaker_is_open(clock):
+    client = make_client([200])
+    record_calls(client.breaker, [False] * client.breaker.min_calls)
+
+    with pytest.raises(UpstreamUnavailable) as e:
+        client.get("http://test/")
+
+    assert e.value.status_code == 503
+    assert client.session.calls == 0
+
+
+def test_background_calls_only_get_their_share_of_the_rate_limit():
+    client = UpstreamClient("test API", rate=10, burst=10, background_share=0.5)
+    client.session = FakeSession([200])
+
+    for _ in range(5):
+        client.get("http://test/", priority=PRIORITY_BACKGROUND)
+
+    with pytest.raises(UpstreamUnavailable) as e:
+        client.get("http://test/", priority=PRIORITY_BACKGROUND, deadline=time.monotonic() + 0.05)
+    assert e.value.status_code == 429
+
+    # the rest of the burst is still there for interactive calls
+    for _ in range(5):
+        client.get("http://test/", deadline=time.monotonic() + 0.05)
+    assert client.session.calls == 10
@@ -0,0 +1,150 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import make_line_directions
+from schedule import CompiledSchedule, local_seconds
+from service import Stop
+
+DAY = datetime.date(2020, 3, 2)
+
+STOPS = {
+    1: Stop(id=1, name="A", city="Gent", lat=51.0, long=4.0),
+    2: Stop(id=2, name="B", city="Gent", lat=51.1, long=4.1),
+    3: Stop(id=3, name="C", city="Gent", lat=51.2, long=4.3),
+}
+
+
+def make_ride(ride_number: int, passages: list) -> dict:
+    """
+        Make a ride of a dienstregelingen response from (stop id, day offset, "HH:MM") passages.
+    """
+
+    return {
+        "ritnummer": str(ride_number),
+        "doorkomsten": [
+            {
+                "haltenummer": str(stop_id),
+                "dienstregelingTijdstip": "{}T{}:00".format(DAY + datetime.timedelta(days=day_offset), clock_time)
+            } for stop_id, day_offset, clock_time in passages
+        ]
+    }
+
+
+def make_schedule(*rides) -> CompiledSchedule:
+    return CompiledSchedule({"ritDoorkomsten": list(rides)}, STOPS)
+
+
+def hours(value: str) -> int:
+    hour, minute = value.split(":")
+    return int(hour) * 3600 + int(minute) * 60
+
+
+def positions(schedule: CompiledSchedule, seconds: float) -> dict:
+    active, _, lats, longs = schedule.interpolate(seconds)
+    return {int(schedule.ride_numbers[ride]): (lat, long) for ride, lat, long in zip(active, lats, longs)}
+
+
+def test_vehicles_are_interpolated_between_their_stops():
+    schedule = make_schedule(
+        make_ride(10, [(1, 0, "08:00"), (2, 0, "08:10"), (3, 0, "08:30")]),
+        make_ride(11, [(1, 0, "08:20"), (2, 0, "08:30"), (3, 0, "08:50")]),
+    )
+
+    assert positions(schedule, hours("08:05")) == {10: pytest.approx((51.05, 4.05))}
+    assert positions(schedule, hours("08:25")) == {10: pytest.approx((51.175, 4.25)), 11: pytest.approx((51.05, 4.05))}
+    assert positions(schedule, hours("07:59")) == {}
+    assert positions(schedule, hours("08:50")) == {11: pytest.approx((51.2, 4.3))}
+
+
+def test_vehicles_at_a_stop_are_shown_at_that_stop():
+    schedule = make_schedule(make_ride(10, [(1, 0, "08:00"), (2, 0, "08:10"), (3, 0, "08:30")]))
+
+    assert positions(schedule, hours("08:00")) == {10: pytest.approx((51.0, 4.0))}
+    assert positions(schedule, hours("08:10")) == {10: pytest.approx((51.1, 4.1))}
+
+
+def test_passages_that_go_back_in_time_are_raised():
+    schedule = make_schedule(make_ride(10, [(1, 0, "08:00"), (2, 0, "08:10"), (3, 0, "08:05")]))
+
+    assert list(schedule.times) == [hours("08:00"), hours("08:10"), hours("08:10")]
+    assert positions(schedule, hours("08:10")) == {10: pytest.approx((51.1, 4.1))}
+
+
+def test_rides_with_fewer_than_two_known_stops_are_left_out():
+    schedule = make_schedule(
+        make_ride(10, [(1, 0, "08:00"), (99, 0, "08:10")]),
+        make_ride(11, [(1, 0, "09:00"), (2, 0, "09:10")]),
+    )
+
+    assert list(schedule.ride_numbers) == [11]
+
+
+def test_rides_that_cross_midnight_are_evaluated_on_the_day_they_start():
+    schedule = make_schedule(
+        make_ride(10, [(1, 0, "23:50"), (2, 1, "00:10"), (3, 1, "00:30")]),
+        make_ride(11, [(1, 1, "00:05"), (2, 1, "00:15"), (3, 1, "00:35")]),
+    )
+
+    # the ride of the previous day is found after midnight, in seconds since the midnight on which it started
+    assert positions(schedule, 24 * 3600 + hours("00:00")) == {10: pytest.approx((51.05, 4.05))}
+
+    moments = [
+        local_seconds(datetime.datetime.combine(DAY, datetime.time(23, 55))),
+        local_seconds(datetime.datetime.combine(DAY + datetime.timedelta(days=1), datetime.time(0, 10))),
+        local_seconds(datetime.datetime.combine(DAY + datetime.timedelta(days=1), datetime.time(0, 40))),
+    ]
+    lats, longs = schedule.interpolate_range(np.array(moments))
+
+    assert lats[0, 0] == pytest.approx(51.025) and np.isnan(lats[0, 1])
+    assert lats[1, 0] == pytest.approx(51.1) and lats[1, 1] == pytest.approx(51.05)
+    assert np.all(np.isnan(lats[2])) and np.all(np.isnan(longs[2]))
+
+
+def test_next_departure():
+    schedule = make_schedule(
+        make_ride(10, [(1, 0, "08:00"), (2, 0, "08:10")]),
+        make_ride(11, [(1, 0, "09:00"), (2, 0, "09:10")]),
+    )
+
+    assert schedule.next_departure(hours("07:00")) == hours("08:00")
+    assert schedule.next_departure(hours("08:00")) == hours("09:00")
+    assert schedule.next_departure(hours("09:00")) is None
+
+
+def brute_force_positions(schedule: CompiledSchedule, seconds: float) -> dict:
+    """
+        Interpolate every ride by walking its passages, without the index.
+    """
+
+    retval = {}
+
+    for ride, ride_number in enumerate(schedule.ride_numbers):
+        begin, end = schedule.offsets[ride], schedule.offsets[ride + 1]
+        times = schedule.times[begin:end]
+
+        for i in range(len(times) - 1):
+            if times[i] <= seconds <= times[i + 1]:
+                duration = times[i + 1] - times[i]
+                frac = (seconds - times[i]) / duration if duration > 0 else 0.0
+                lat = schedule.lats[begin + i] + (schedule.lats[begin + i + 1] - schedule.lats[begin + i]) * frac
+                long = schedule.longs[begin + i] + (schedule.longs[begin + i + 1] - schedule.longs[begin + i]) * frac
+                retval[int(ride_number)] = (lat, long)
+                break
+
+    return retval
+
+
+def test_index_agrees_with_brute_force_over_the_whole_day():
+    direction = make_line_directions(1, 2, DAY, num_stops=20, num_rides=80)[0]
+    schedule = direction.get_schedule()
+
+    # the last rides run after midnight, so the day is followed into the next one
+    for seconds in range(4 * 3600, 26 * 3600, 97):
+        expected = brute_force_positions(schedule, seconds)
+        actual = positions(schedule, seconds)
+
+        assert actual.keys() == expected.keys()
+        for ride_number, position in expected.items():
+            assert actual[ride_number] == pytest.approx(position)
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from conftest import wait_until
+from singleflight import SingleFlight, SingleFlightTimeout
+
+
+def start_followers(flight: SingleFlight, key, count: int, results: list, timeout: float = None) -> list:
+    """
+        Start "count" threads that call flight.do() for the key, and wait until all of them follow the call in progress.
+        Every thread appends its result (or exception) to "results".
+    """
+
+    followers_before = flight.stats()['followers']
+
+    def follow():
+        try:
+            results.append(flight.do(key, lambda: "own call", timeout))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=follow) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+
+    wait_until(lambda: flight.stats()['followers'] == followers_before + count)
+
+    return threads
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def leader_call():
+        calls.append(1)
+        release.wait()
+        return "shared"
+
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", leader_call)))
+    leader.start()
+    wait_until(lambda: flight.stats()['inFlight'] == 1)
+
+    followers = start_followers(flight, "key", 5, results)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["shared"] * 6
+    assert flight.stats() == {'inFlight': 0, 'leaders': 1, 'followers': 5, 'timeouts': 0}
+
+
+def test_followers_get_the_exception_of_the_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def leader_call():
+        release.wait()
+        raise ValueError("upstream failed")
+
+    leader = threading.Thread(target=lambda: pytest.raises(ValueError, flight.do, "key", leader_call))
+    leader.start()
+    wait_until(lambda: flight.stats()['inFlight'] == 1)
+
+    followers = start_followers(flight, "key", 3, results)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_follower_gives_up_after_timeout_without_stopping_the_leader():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader_results = []
+    results = []
+
+    def leader_call():
+        release.wait()
+        return "late"
+
+    leader = threading.Thread(target=lambda: leader_results.append(flight.do("key", leader_call)))
+    leader.start()
+    wait_until(lambda: flight.stats()['inFlight'] == 1)
+
+    followers = start_followers(flight, "key", 1, results, timeout=0.05)
+    followers[0].join()
+    release.set()
+    leader.join()
+
+    assert isinstance(results[0], SingleFlightTimeout)
+    assert leader_results == ["late"]
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_calls_after_completion_and_other_keys_are_not_shared():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("a", lambda: 2) == 2
+    assert flight.do("b", lambda: 3) == 3
+    assert flight.stats()['followers'] == 0
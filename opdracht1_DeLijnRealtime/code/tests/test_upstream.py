@@ -0,0 +1,147 @@
+import json
+import threading
+
+import pytest
+
+import upstream
+from conftest import wait_until
+from cache import TTLCache
+from config import delijn_api_url, upstream_cache_max_bytes, upstream_endpoint_classes
+from delijn_client import PRIORITY_BACKGROUND
+
+# a URL of a cacheable endpoint (lijnrichtingen) and of one that is never cached
+CACHED_URL = "{}/lijnen/1/2/lijnrichtingen".format(delijn_api_url)
+UNCACHED_URL = "{}/lijnen/1/2/lijnrichtingen/HEEN/real-time".format(delijn_api_url)
+
+TTL, STALE_TTL = next((ttl, stale_ttl) for name, _, ttl, stale_ttl in upstream_endpoint_classes if name == "lijnrichtingen")
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, data: dict):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode()
+
+
+class FakeClient:
+    """
+        Answers the calls of upstream.py instead of the upstream clients: every call gets the next response of the
+        URL, the last one is repeated. Calls block while "gate" is cleared.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def get(self, url, priority=None, **kwargs):
+        with self._lock:
+            self.calls.append((url, priority))
+            responses = self.responses[url]
+            response = responses.pop(0) if len(responses) > 1 else responses[0]
+
+        self.gate.wait()
+        return response
+
+
+@pytest.fixture
+def client(monkeypatch, clock):
+    fake_client = FakeClient()
+
+    monkeypatch.setattr(upstream, "get_client", lambda url: fake_client)
+    monkeypatch.setattr(upstream, "upstream_cache", TTLCache(upstream_cache_max_bytes))
+
+    return fake_client
+
+
+def lookups() -> tuple:
+    stats = upstream.upstream_cache.stats()
+    return stats['hits'], stats['staleHits'], stats['misses']
+
+
+def test_cacheable_responses_are_served_from_the_cache(client):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1})]
+
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 1})
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 1})
+
+    assert len(client.calls) == 1
+    assert lookups() == (1, 0, 1)
+
+
+def test_uncacheable_responses_and_errors_are_not_cached(client):
+    client.responses[UNCACHED_URL] = [FakeResponse(200, {'version': 1})]
+    client.responses[CACHED_URL] = [FakeResponse(404, {'boodschap': "not found"}), FakeResponse(200, {'version': 1})]
+
+    upstream.make_get_request(UNCACHED_URL)
+    upstream.make_get_request(UNCACHED_URL)
+    assert upstream.make_get_request(CACHED_URL) == (False, 404, {'boodschap': "not found"})
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 1})
+
+    assert len(client.calls) == 4
+
+
+def test_stale_responses_are_served_while_revalidated_in_the_background(client, clock):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1}), FakeResponse(200, {'version': 2})]
+    upstream.make_get_request(CACHED_URL)
+
+    clock.advance(TTL + 1)
+
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 1})
+    wait_until(lambda: len(upstream.revalidating_keys) == 0 and len(client.calls) == 2)
+
+    assert client.calls[1] == (CACHED_URL, PRIORITY_BACKGROUND)
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 2})
+
+
+def test_expired_responses_are_retrieved_again(client, clock):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1}), FakeResponse(200, {'version': 2})]
+    upstream.make_get_request(CACHED_URL)
+
+    clock.advance(TTL + STALE_TTL + 1)
+
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 2})
+    assert len(client.calls) == 2
+
+
+def test_concurrent_identical_calls_are_coalesced(client):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1})]
+    client.gate.clear()
+
+    followers_before = upstream.upstream_flight.stats()['followers']
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(upstream.make_get_request(CACHED_URL))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+
+    wait_until(lambda: upstream.upstream_flight.stats()['followers'] == followers_before + 4)
+    client.gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(client.calls) == 1
+    assert results == [(True, 200, {'version': 1})] * 5
+
+
+def test_background_lookups_are_not_counted(client):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1})]
+
+    upstream.make_get_request(CACHED_URL, priority=PRIORITY_BACKGROUND)
+    upstream.make_get_request(CACHED_URL, priority=PRIORITY_BACKGROUND)
+
+    assert lookups() == (0, 0, 0)
+
+
+def test_refresh_before_expiry_only_calls_near_the_end_of_the_ttl(client, clock):
+    client.responses[CACHED_URL] = [FakeResponse(200, {'version': 1}), FakeResponse(200, {'version': 2})]
+
+    assert upstream.refresh_before_expiry(CACHED_URL, 60)
+    assert not upstream.refresh_before_expiry(CACHED_URL, 60)
+
+    clock.advance(TTL - 30)
+
+    assert upstream.refresh_before_expiry(CACHED_URL, 60)
+    assert upstream.make_get_request(CACHED_URL) == (True, 200, {'version': 2})
+    assert [priority for _, priority in client.calls] == [PRIORITY_BACKGROUND, PRIORITY_BACKGROUND]
+    assert lookups() == (1, 0, 0)
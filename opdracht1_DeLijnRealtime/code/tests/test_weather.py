@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+import weather
+from conftest import make_line_directions
+from app import PREFETCHED_ENVIRON_KEY, app
+from service import UpstreamError
+
+WEATHER_DATA = {
+    "clouds": {"all": 20},
+    "wind": {"speed": 5.0},
+    "main": {"humidity": 80, "temp": 12.5},
+    "weather": [{"icon": "02d"}],
+}
+
+
+@pytest.fixture
+def failing_cells(monkeypatch):
+    """
+        Answer the weather calls without the OpenWeatherMap API, failing those of the cells in the returned set.
+    """
+
+    failing = set()
+
+    def make_get_request(url, *args, **kwargs):
+        if any(url == weather.get_cell_url(cell) for cell in failing):
+            return False, 429, {"message": "rate limited"}
+        return True, 200, WEATHER_DATA
+
+    monkeypatch.setattr(weather, "make_get_request", make_get_request)
+    weather.weather_cache.clear()
+    yield failing
+    weather.weather_cache.clear()
+
+
+def test_bulk_keeps_cells_that_succeed(failing_cells):
+    coords = [(51.0, 4.0), (51.1, 4.1), (51.0, 4.0)]
+    failing_cells.add(weather.get_cell(51.1, 4.1))
+
+    result = weather.get_weather_bulk(coords)
+
+    assert result[0].temp == 12.5
+    assert isinstance(result[1], UpstreamError)
+    assert result[1].cause_status == 429
+    assert result[2] is result[0]
+
+
+def test_line_weather_reports_failing_stops(failing_cells):
+    directions = make_line_directions(1, 2, datetime.date.today())
+    stops = {stop.id: stop for direction in directions for stop in direction.stops}
+    failing_stop = next(iter(stops.values()))
+    failing_cells.add(weather.get_cell(failing_stop.lat, failing_stop.long))
+
+    response = app.test_client().get("/api/provinces/1/lines/2/weather/",
+                                     environ_overrides={PREFETCHED_ENVIRON_KEY: {("get_line_directions", 1, 2): directions}})
+
+    assert response.status_code == 200
+    stop_weather = {stop['id']: stop for stop in response.get_json()['stops']}
+    assert stop_weather[failing_stop.id]['weather'] is None
+    assert stop_weather[failing_stop.id]['causeErrorStatus'] == 429
+    assert any(stop['weather'] is not None for stop in stop_weather.values())
+
+
+def test_line_weather_fails_when_no_stop_succeeds(failing_cells):
+    directions = make_line_directions(1, 2, datetime.date.today())
+    failing_cells.update(weather.get_cell(stop.lat, stop.long) for direction in directions for stop in direction.stops)
+
+    response = app.test_client().get("/api/provinces/1/lines/2/weather/",
+                                     environ_overrides={PREFETCHED_ENVIRON_KEY: {("get_line_directions", 1, 2): directions}})
+
+    assert response.status_code == 500
+    assert response.get_json()['errorMessage'] == "Cannot retrieve weather from OpenWeatherMap API."
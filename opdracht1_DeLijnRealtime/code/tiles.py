@@ -0,0 +1,165 @@
+import json
+import math
+import threading
+
+import numpy as np
+
+import reference
+from cache import TTLCache
+from config import tile_cache_max_bytes, tile_cluster_max_zoom, tile_cluster_size, tile_max_zoom, tile_pregenerate_max_zoom, tile_ttl
+from log import logger
+from spatial import StopIndex
+
+# width and height of a tile in pixels
+TILE_SIZE = 256
+
+# tiles of stops as serialized GeoJSON, keyed on (snapshot creation time, z, x, y)
+tile_cache = TTLCache(tile_cache_max_bytes)
+
+
+def tile_bounds(z: int, x: int, y: int) -> (float, float, float, float):
+    """
+        Retrieve the (south, west, north, east) bounds in degrees of the specified Web Mercator tile.
+    """
+
+    n = 2 ** z
+
+    def tile_lat(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return tile_lat(y + 1), x / n * 360.0 - 180.0, tile_lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def tile_pixels(z: int, x: int, y: int, lats: np.ndarray, longs: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+        Retrieve the pixel coordinates of the specified coordinates within the specified tile.
+    """
+
+    world_size = TILE_SIZE * 2 ** z
+    lats = np.radians(lats)
+
+    pixels_x = (longs + 180.0) / 360.0 * world_size - x * TILE_SIZE
+    pixels_y = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / math.pi) / 2.0 * world_size - y * TILE_SIZE
+
+    return pixels_x, pixels_y
+
+
+def stop_feature(province_id: int, stop) -> dict:
+    return {
+        'type': "Feature",
+        'geometry': {'type': "Point", 'coordinates': [stop.long, stop.lat]},
+        'properties': {'id': stop.id, 'name': stop.name, 'city': stop.city, 'province': province_id},
+    }
+
+
+def build_stop_tile(index: StopIndex, z: int, x: int, y: int) -> dict:
+    """
+        Build the GeoJSON FeatureCollection of the stops in the specified tile. Up to config.tile_cluster_max_zoom,
+        the stops in every square of config.tile_cluster_size pixels are merged into a single cluster feature
+        (with properties "cluster" and "count") at their mean position. A square with a single stop keeps the stop.
+    """
+
+    indices = index.in_bounds(*tile_bounds(z, x, y))
+
+    if z > tile_cluster_max_zoom or len(indices) == 0:
+        return {
+            'type': "FeatureCollection",
+            'features': [stop_feature(*index.stops[i]) for i in indices]
+        }
+
+    lats, longs = index.lats[indices], index.longs[indices]
+    pixels_x, pixels_y = tile_pixels(z, x, y, lats, longs)
+
+    squares_per_row = TILE_SIZE // tile_cluster_size
+    squares_x = np.clip((pixels_x // tile_cluster_size).astype(np.int64), 0, squares_per_row - 1)
+    squares_y = np.clip((pixels_y // tile_cluster_size).astype(np.int64), 0, squares_per_row - 1)
+
+    squares, first_stop, square_of_stop, counts = np.unique(
+        squares_y * squares_per_row + squares_x, return_index=True, return_inverse=True, return_counts=True
+    )
+    mean_lats = np.bincount(square_of_stop, weights=lats) / counts
+    mean_longs = np.bincount(square_of_stop, weights=longs) / counts
+
+    features = []
+    for square in range(len(squares)):
+        if counts[square] == 1:
+            features.append(stop_feature(*index.stops[indices[first_stop[square]]]))
+        else:
+            features.append({
+                'type': "Feature",
+                'geometry': {'type': "Point", 'coordinates': [round(float(mean_longs[square]), 6), round(float(mean_lats[square]), 6)]},
+                'properties': {'cluster': True, 'count': int(counts[square])},
+            })
+
+    return {
+        'type': "FeatureCollection",
+        'features': features
+    }
+
+
+def get_stop_tile(z: int, x: int, y: int):
+    """
+        Retrieve the serialized GeoJSON of the specified tile, or None if there are no stops yet (no reference snapshot).
+        Tiles are cached until the reference snapshot changes.
+    """
+
+    snapshot = reference.reference_data.snapshot
+    if snapshot is None:
+        return None
+
+    key = (snapshot.created, z, x, y)
+
+    found, _, body = tile_cache.get(key)
+    if found:
+        return body
+
+    index = reference.reference_data.get_stop_index()
+    body = json.dumps(build_stop_tile(index, z, x, y), separators=(",", ":")).encode()
+    tile_cache.put(key, body, len(body), tile_ttl)
+
+    return body
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= tile_max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def pregenerate_stop_tiles() -> None:
+    """
+        Generate the tiles of all zoom levels up to config.tile_pregenerate_max_zoom that contain stops,
+        so the overview of the map never waits for tiles to be built.
+    """
+
+    index = reference.reference_data.get_stop_index()
+    if index is None or len(index) == 0:
+        return
+
+    south, north = float(index.lats.min()), float(index.lats.max())
+    west, east = float(index.longs.min()), float(index.longs.max())
+
+    for z in range(tile_pregenerate_max_zoom + 1):
+        pixels_x, pixels_y = tile_pixels(z, 0, 0, np.array([north, south]), np.array([west, east]))
+        tiles_x = range(int(pixels_x[0] // TILE_SIZE), int(pixels_x[1] // TILE_SIZE) + 1)
+        tiles_y = range(int(pixels_y[0] // TILE_SIZE), int(pixels_y[1] // TILE_SIZE) + 1)
+
+        for x in tiles_x:
+            for y in tiles_y:
+                if is_valid_tile(z, x, y):
+                    get_stop_tile(z, x, y)
+
+
+def on_reference_snapshot(snapshot) -> None:
+    """
+        Listener of the reference data: the tiles of the previous snapshot are dropped and the overview
+        tiles of the new snapshot are generated in the background.
+    """
+
+    tile_cache.clear()
+
+    def pregenerate():
+        try:
+            pregenerate_stop_tiles()
+        except Exception:
+            logger.exception("Cannot pregenerate stop tiles.")
+
+    threading.Thread(target=pregenerate, daemon=True).start()
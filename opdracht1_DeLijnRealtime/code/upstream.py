@@ -0,0 +1,205 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from cache import TTLCache
+from config import singleflight_timeout, upstream_cache_max_bytes, upstream_endpoint_classes, upstream_pool_size
+from delijn_client import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, UpstreamUnavailable, get_client
+from log import logger
+from metrics import upstream_errors, upstream_request_duration, upstream_requests_in_flight
+from singleflight import SingleFlight, SingleFlightTimeout
+
+upstream_cache = TTLCache(upstream_cache_max_bytes)
+
+# upstream calls that are in progress, so identical concurrent calls can share them
+upstream_flight = SingleFlight()
+
+# pool on which concurrent upstream calls are made
+upstream_pool = ThreadPoolExecutor(max_workers=upstream_pool_size)
+
+# keys of cache entries that are currently being refreshed in the background
+revalidating_keys = set()
+revalidating_lock = threading.Lock()
+
+
+def get_endpoint_class(url: str):
+    """
+        Retrieve the cacheable endpoint class (name, pattern, TTL, stale period) of the specified URL,
+        or None if responses of this URL must not be cached.
+    """
+
+    path = url.split("?", 1)[0]
+    for endpoint_class in upstream_endpoint_classes:
+        if endpoint_class[1].search(path):
+            return endpoint_class
+
+    return None
+
+
+def get_metric_labels(url: str) -> (str, str):
+    """
+        Retrieve the host and endpoint name under which calls to the specified URL are measured. The endpoint
+        is the name of the endpoint class, or the last part of the path for URLs that are not cached.
+    """
+
+    parts = urlsplit(url)
+    endpoint_class = get_endpoint_class(url)
+
+    if endpoint_class is not None:
+        return parts.netloc, endpoint_class[0]
+
+    endpoint = parts.path.rstrip("/").rsplit("/", 1)[-1]
+    return parts.netloc, endpoint if endpoint != "" and not endpoint.isdigit() else "other"
+
+
+def get_cache_key(url, **kwargs) -> tuple:
+    """
+        Retrieve the key under which the response of a GET request with the specified arguments is cached.
+    """
+
+    return url, tuple(sorted(kwargs.get("headers", {}).items()))
+
+
+def make_get_request(url, priority=PRIORITY_INTERACTIVE, **kwargs) -> (bool, dict):
+    """
+        Send a GET request to the specified URL with the specified arguments. This
+        will return (False, status code None) in case of a problem, or (True, status code, data) in case of
+        success with "data" a dict representation of the JSON response and "status code" the HTTP status code.
+
+        Successful responses of cacheable De Lijn endpoints are served from the upstream cache. A stale
+        response is still returned immediately while a fresh copy is retrieved in the background.
+        Concurrent identical requests are coalesced into a single upstream call. Calls with a background
+        priority never delay interactive calls when the rate limit of the upstream API is reached, and their
+        lookups are not counted in the statistics of the upstream cache.
+        NOTE: cached data is shared between requests and must never be modified by the caller.
+    """
+
+    endpoint_class = get_endpoint_class(url)
+    cache_key = get_cache_key(url, **kwargs)
+
+    if endpoint_class is None:
+        return send_coalesced_get_request(cache_key, url, priority=priority, **kwargs)
+
+    found, fresh, data = upstream_cache.get(cache_key, count=priority == PRIORITY_INTERACTIVE)
+
+    if found:
+        if not fresh:
+            revalidate_in_background(cache_key, endpoint_class, url, **kwargs)
+        return True, 200, data
+
+    return send_coalesced_get_request(cache_key, url, priority=priority, cache_key=cache_key, endpoint_class=endpoint_class, **kwargs)
+
+
+def send_coalesced_get_request(key, url, **kwargs) -> (bool, dict):
+    """
+        Send a GET request like send_get_request(), unless an identical request (same key) is already in progress.
+        In that case, wait for that request and share its result. A caller that waits longer than
+        config.singleflight_timeout gets an error result with status code 504.
+    """
+
+    try:
+        return upstream_flight.do(key, lambda: send_get_request(url, **kwargs), singleflight_timeout)
+    except SingleFlightTimeout:
+        return False, 504, {
+            "boodschap": "timed out waiting for an identical request to '{}'".format(url)
+        }
+
+
+def send_get_request(url, cache_key=None, endpoint_class=None, priority=PRIORITY_INTERACTIVE, **kwargs) -> (bool, dict):
+    """
+        Send a GET request to the specified URL without consulting the cache. See make_get_request()
+        for the return value. If a cache key and endpoint class are specified, a successful response
+        will be stored in the upstream cache.
+    """
+
+    host, endpoint = get_metric_labels(url)
+
+    upstream_requests_in_flight.inc((host,))
+    start = time.perf_counter()
+    try:
+        resp = get_client(url).get(url, priority=priority, **kwargs)
+    except UpstreamUnavailable as e:
+        upstream_errors.inc((host, endpoint, str(e.status_code)))
+        logger.warning("Cannot make upstream call.", extra={'fields': {'url': url, 'status': e.status_code, 'reason': e.message}})
+        return False, e.status_code, {
+            "boodschap": e.message
+        }
+    finally:
+        duration = time.perf_counter() - start
+        upstream_request_duration.observe(duration, (host, endpoint))
+        upstream_requests_in_flight.dec((host,))
+
+    logger.debug("Upstream call.", extra={'fields': {'url': url, 'status': resp.status_code, 'duration': duration}})
+
+    return handle_response(url, resp.status_code, resp.content, cache_key, endpoint_class)
+
+
+def handle_response(url, status_code: int, content: bytes, cache_key=None, endpoint_class=None) -> (bool, dict):
+    """
+        Turn the response of an upstream call into the return value of send_get_request(), and store it in the
+        upstream cache if a cache key and endpoint class are specified.
+    """
+
+    if status_code >= 400:
+        host, endpoint = get_metric_labels(url)
+        upstream_errors.inc((host, endpoint, str(status_code)))
+        try:
+            return False, status_code, json.loads(content)
+        except:
+            logger.error("Upstream error response without JSON error data.", extra={'fields': {'url': url, 'status': status_code}})
+            return False, status_code, {
+                "boodschap": "unknown error (server did not respond with JSON error data)"
+            }
+
+    data = json.loads(content)
+
+    if cache_key is not None:
+        _, _, ttl, stale_ttl = endpoint_class
+        upstream_cache.put(cache_key, data, len(content), ttl, stale_ttl)
+
+    return True, status_code, data
+
+
+def revalidate_in_background(cache_key, endpoint_class, url, **kwargs) -> None:
+    """
+        Retrieve a fresh copy of a stale cache entry on a background thread. At most one
+        refresh per cache entry is running at any time.
+    """
+
+    with revalidating_lock:
+        if cache_key in revalidating_keys:
+            return
+        revalidating_keys.add(cache_key)
+
+    def revalidate():
+        try:
+            send_get_request(url, cache_key=cache_key, endpoint_class=endpoint_class, priority=PRIORITY_BACKGROUND, **kwargs)
+        except Exception:
+            pass  # the stale entry is kept until it expires
+        finally:
+            with revalidating_lock:
+                revalidating_keys.discard(cache_key)
+
+    threading.Thread(target=revalidate, daemon=True).start()
+
+
+def refresh_before_expiry(url, margin: float, **kwargs) -> bool:
+    """
+        Retrieve a fresh copy of a cacheable URL with background priority if it is not cached, or if its cache entry
+        stops being fresh within "margin" seconds. Returns whether a call was made.
+    """
+
+    endpoint_class = get_endpoint_class(url)
+    if endpoint_class is None:
+        return False
+
+    cache_key = get_cache_key(url, **kwargs)
+
+    ttl = upstream_cache.time_to_live(cache_key)
+    if ttl is not None and ttl >= margin:
+        return False
+
+    send_coalesced_get_request(cache_key, url, cache_key=cache_key, endpoint_class=endpoint_class, priority=PRIORITY_BACKGROUND, **kwargs)
+    return True
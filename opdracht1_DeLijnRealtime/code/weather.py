@@ -0,0 +1,128 @@
+import json
+import math
+from typing import NamedTuple
+
+from cache import TTLCache
+from config import open_weather_api_url, open_weather_key, weather_cache_max_bytes, weather_cell_size, weather_ttl
+from async_upstream import make_get_request_async
+from service import UpstreamError
+from upstream import make_get_request, upstream_pool
+
+weather_cache = TTLCache(weather_cache_max_bytes)
+
+
+class Weather(NamedTuple):
+    clouds: float
+    wind_speed: float   # km/h
+    humidity: float
+    temp: float
+    icon: str
+
+    def to_json(self) -> dict:
+        return {
+            'clouds':    self.clouds,
+            'windSpeed': self.wind_speed,
+            'humidity':  self.humidity,
+            'temp':      self.temp,
+            'OWM_icon_url': "http://openweathermap.org/img/wn/{}@2x.png".format(self.icon),
+        }
+
+
+def get_cell(lat: float, long: float) -> (int, int):
+    """
+        Retrieve the grid cell that contains the specified coordinate. All coordinates
+        in the same cell share a single weather report.
+    """
+
+    return math.floor(lat / weather_cell_size), math.floor(long / weather_cell_size)
+
+
+def get_cell_weather(cell: (int, int)) -> Weather:
+    """
+        Retrieve the weather in the center of the specified grid cell.
+        Raises UpstreamError if it cannot be retrieved from the OpenWeatherMap API.
+    """
+
+    found, _, weather = weather_cache.get(cell)
+    if found:
+        return weather
+
+    # make call to weather API
+    return make_cell_weather(cell, make_get_request(get_cell_url(cell)))
+
+
+async def get_cell_weather_async(cell: (int, int)) -> Weather:
+    """
+        Like get_cell_weather(), but the call is made on the event loop (see async_upstream.py).
+    """
+
+    found, _, weather = weather_cache.get(cell)
+    if found:
+        return weather
+
+    return make_cell_weather(cell, await make_get_request_async(get_cell_url(cell)))
+
+
+def get_cell_url(cell: (int, int)) -> str:
+    lat = round((cell[0] + 0.5) * weather_cell_size, 6)
+    long = round((cell[1] + 0.5) * weather_cell_size, 6)
+
+    return "{}/weather?lat={}&lon={}&units=metric&appid={}".format(open_weather_api_url, lat, long, open_weather_key)
+
+
+def make_cell_weather(cell: (int, int), result: tuple) -> Weather:
+    """
+        Build the weather of a cell from the result of its call to the weather API, and cache it.
+        Raises UpstreamError if the call failed.
+    """
+
+    flag, status_code, data_weather = result
+    if not flag:
+        raise UpstreamError(
+            status_code,
+            data_weather["message"] if "message" in data_weather else "",
+            "Cannot retrieve weather from OpenWeatherMap API."
+        )
+
+    weather = Weather(
+        clouds=float(data_weather["clouds"]["all"]),
+        wind_speed=(float(data_weather["wind"]["speed"]) * 3600.0) / 1000.0,
+        humidity=float(data_weather["main"]["humidity"]),
+        temp=float(data_weather["main"]["temp"]),
+        icon=data_weather["weather"][0]["icon"]
+    )
+
+    weather_cache.put(cell, weather, len(json.dumps(weather)), weather_ttl)
+
+    return weather
+
+
+def get_weather(lat: float, long: float) -> Weather:
+    """
+        Retrieve the weather at the specified coordinate. See get_cell_weather().
+    """
+
+    return get_cell_weather(get_cell(lat, long))
+
+
+def get_weather_bulk(coords: list) -> list:
+    """
+        Retrieve the weather at every (lat, long) in the specified list, in the same order. Every grid
+        cell is only looked up once and the cells that are not cached are retrieved at the same time.
+        A coordinate of which the weather cannot be retrieved gets the UpstreamError that prevented it.
+    """
+
+    cells = [get_cell(lat, long) for lat, long in coords]
+
+    pending_cells = {
+        cell: upstream_pool.submit(get_cell_weather, cell) for cell in set(cells)
+    }
+
+    weather_map = {}
+    for cell, future in pending_cells.items():
+        try:
+            weather_map[cell] = future.result()
+        except UpstreamError as e:
+            weather_map[cell] = e
+
+    return [weather_map[cell] for cell in cells]
@@ -0,0 +1,61 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+# NOTE: this is installed as a package by every service that uses auth tokens (users, vehicles, vehiclereviews, stopreviews), see setup.py
+
+
+def issue_token(user_id:int, key:bytes, ttl:int) -> str:
+    """
+        Create a token that proves that the user with the specified id logged in. The token is valid for 'ttl' seconds
+        and is signed (HMAC-SHA256) with the specified key, so any service that has the key can verify it without
+        contacting the users service.
+
+        The token has the form '<payload>.<signature>', both base64url encoded. The payload is JSON: {"userId", "expires"}.
+    """
+
+    if not key:
+        raise ValueError("No key to sign auth tokens is configured (AUTH_TOKEN_KEY).")
+
+    payload = _encode(json.dumps({'userId': user_id, 'expires': int(time.time()) + ttl}, separators=(',', ':')).encode())
+
+    return payload + "." + _sign(payload, key)
+
+
+def verify_token(token:str, key:bytes) -> (bool, int, str):
+    """
+        Verify a token that was created by issue_token() with the same key.
+
+        The return value is a tuple (bool, user_id, reason). 'bool' will be True if the token is valid, False otherwise.
+        'user_id' contains the id of the user that logged in, or -1 if the token is not valid. 'reason' explains why
+        the token is not valid ('N/A' if it is).
+    """
+
+    if not key:
+        raise ValueError("No key to verify auth tokens is configured (AUTH_TOKEN_KEY).")
+
+    payload, _, signature = token.partition(".")
+
+    if not hmac.compare_digest(signature.encode(), _sign(payload, key).encode()):
+        return False, -1, 'Invalid token.'
+
+    data = json.loads(_decode(payload))
+
+    if data['expires'] <= time.time():
+        return False, -1, 'Token has expired.'
+
+    return True, data['userId'], 'N/A'
+
+
+def _sign(payload:str, key:bytes) -> str:
+    return _encode(hmac.new(key, payload.encode(), hashlib.sha256).digest())
+
+
+def _encode(data:bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _decode(data:str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
@@ -0,0 +1,9 @@
+from setuptools import setup
+
+# the auth tokens that users issues and vehicles, vehiclereviews and stopreviews verify,
+# every service image installs this (see their Dockerfile) so they all use the same code
+setup(
+    name='auth_token',
+    version='1.0.0',
+    py_modules=['auth_token'],
+)
@@ -10,6 +10,8 @@ from sqlalchemy import exc
 from passlib.hash import sha256_crypt
 import requests
 
+from auth_token import verify_token
+
 ############### FLASK INIT & CONFIG ###############
 
 app = Flask(__name__)
@@ -17,25 +19,9 @@ app = Flask(__name__)
 app_settings = os.getenv('APP_SETTINGS')
 app.config.from_object(app_settings)
 
-def make_get_request(url:str, **kwargs) -> (bool, dict):
-    """
-        Send a GET request to the specified URL with the specified arguments. 
-
-        The return value is a tuple (bool, status, data). 'bool' will be true in case the call returns code 200, False otherwise.
-        'status' contains the HTTP status code of the response. 'data' contains the reponse data, or error data in case of an error.
-
-        Note: 'headers' parameter contains a dict with header data.
-    """
-
-    print("Making call to '{}'...".format(url))
-    resp = requests.get(url, **kwargs)
-    print("Received response.")
-
-    if not resp.ok:
-        return False, resp.status_code, json.loads(resp.content)
-
-    return True, resp.status_code, json.loads(resp.content)
-
+# the auth tokens (see services/auth_token) cannot be used without a key, refuse to start instead of failing every request that needs one
+if not app.config['AUTH_TOKEN_KEY']:
+    raise RuntimeError("AUTH_TOKEN_KEY is not set: it must contain the key that signs the auth tokens, the same for every service that uses them.")
 
 def make_post_request(url:str, post_params:dict, **kwargs):
     """
@@ -96,44 +82,24 @@ class CreateReview(Resource):
     
     def post(self):
         try:
-            # authenticate user: False => 400
-            if not 'username' in request.headers:
+            # authenticate user: the token is verified locally (see services/auth_token), missing => 400, rejected => 401
+            if not 'token' in request.headers:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'username' entry in HTTP request header.",
+                    'errorMessage': "Missing 'token' entry in HTTP request header. Log in at the users service to get one.",
                     'responseCode': 400
                 }, 400
 
-            if not 'password' in request.headers:
-                return {
-                    'causeErrorMessage': 'N/A',
-                    'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'password' entry in HTTP request header.",
-                    'responseCode': 400
-                }, 400
-
-            username = request.headers['username']
-            password = request.headers['password']
-
-            flag, status_code, auth_data = make_get_request('http://users:5000/auth/', headers={'username': username, 'password': password})
+            token_ok, user_id, reason = verify_token(request.headers['token'], app.config['AUTH_TOKEN_KEY'])
 
-            if not flag:
-                # ERROR while authenticating user => "Cannot authenticate user"
-                return {
-                    'causeErrorMessage': auth_data['errorMessage'],
-                    'causeErrorStatus': status_code,
-                    'errorMessage': 'Error while authenticating user.',
-                    'responseCode': 500
-                }, 500
-            elif not auth_data['result']:
-                # user is not valid
+            if not token_ok:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': 'Cannot authenticate user: ' + auth_data['reason'] + ' Please specify a valid username and password.',
-                    'responseCode': 400
-                }, 400
+                    'errorMessage': 'Cannot authenticate user: ' + reason + ' Please log in again.',
+                    'responseCode': 401
+                }, 401
 
             # check if form is ok
             if not 'stopId' in request.form:
@@ -158,7 +124,7 @@ class CreateReview(Resource):
             stop_score = request.form['score']
 
             # place in DB
-            new_review = StopReview(stop_id=stop_id, reviewer_id=auth_data['userId'], score=stop_score)
+            new_review = StopReview(stop_id=stop_id, reviewer_id=user_id, score=stop_score)
 
             db.session.add(new_review)
             db.session.commit()
@@ -7,6 +7,8 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import exc
 from passlib.hash import sha256_crypt
 
+from auth_token import issue_token
+
 ############### FLASK INIT & CONFIG ###############
 
 app = Flask(__name__)
@@ -14,6 +16,10 @@ app = Flask(__name__)
 app_settings = os.getenv('APP_SETTINGS')
 app.config.from_object(app_settings)
 
+# the auth tokens (see services/auth_token) cannot be used without a key, refuse to start instead of failing every request that needs one
+if not app.config['AUTH_TOKEN_KEY']:
+    raise RuntimeError("AUTH_TOKEN_KEY is not set: it must contain the key that signs the auth tokens, the same for every service that uses them.")
+
 ############### DB SETTINGS ###############
 
 # init DB
@@ -137,44 +143,60 @@ class CreateUser(Resource):
             }, 500
 
 
-class AuthUser(Resource):
+class LoginUser(Resource):
     """
-        API call for authenticating users.
+        API call for logging in users.
+
+        On success, this returns a signed auth token that the other services verify locally (see services/auth_token),
+        so the password only has to be checked once per token instead of on every request.
     """
-    
-    def get(self):
+
+    def post(self):
 
         try:
-            username = request.headers['username']
-            password = request.headers['password']
+            # verify input
+            if not 'username' in request.form:
+                # username not in form
+                return {
+                    'causeErrorMessage': 'N/A',
+                    'causeErrorStatus': -1,
+                    'errorMessage': "Missing 'username' entry in HTTP request body.",
+                    'responseCode': 400
+                }, 400
+
+            if not 'password' in request.form:
+                # password not in form
+                return {
+                    'causeErrorMessage': 'N/A',
+                    'causeErrorStatus': -1,
+                    'errorMessage': "Missing 'password' entry in HTTP request body.",
+                    'responseCode': 400
+                }, 400
+
+            user = User.query.filter_by(username=request.form['username']).first()
 
-            user = User.query.filter_by(username=username).first()
-            
             if user is None:
                 return {
-                    'userId': -1,
-                    'result': False,
-                    'reason': 'Username does not exist.',
-                    'responseCode': 200
-                }, 200
-            else:
-                password_ok = sha256_crypt.verify(password, user.password)
-
-                if password_ok:
-                    return {
-                        'userId': user.id,
-                        'result': True,
-                        'reason': 'N/A',
-                        'responseCode': 200
-                    }, 200
-
-                else:
-                    return {
-                        'userId': -1,
-                        'result': False,
-                        'reason': 'Invalid password.',
-                        'responseCode': 200
-                    }, 200
+                    'causeErrorMessage': 'N/A',
+                    'causeErrorStatus': -1,
+                    'errorMessage': 'Cannot log in: Username does not exist.',
+                    'responseCode': 400
+                }, 400
+
+            if not sha256_crypt.verify(request.form['password'], user.password):
+                return {
+                    'causeErrorMessage': 'N/A',
+                    'causeErrorStatus': -1,
+                    'errorMessage': 'Cannot log in: Invalid password.',
+                    'responseCode': 400
+                }, 400
+
+            return {
+                'token': issue_token(user.id, app.config['AUTH_TOKEN_KEY'], app.config['AUTH_TOKEN_TTL']),
+                'userId': user.id,
+                'expiresIn': app.config['AUTH_TOKEN_TTL'],
+                'responseCode': 200
+            }, 200
 
         except exc.SQLAlchemyError as e:
             db.session().rollback()
@@ -182,7 +204,7 @@ class AuthUser(Resource):
             return {
                 'causeErrorMessage': str(e), 
                 'causeErrorStatus': -1,
-                'errorMessage': 'Cannot verify user: unknown SQLA exception.', 
+                'errorMessage': 'Cannot log in: unknown SQLA exception.', 
                 'responseCode': 500
             }, 500
 
@@ -192,7 +214,7 @@ class AuthUser(Resource):
             return {
                 'causeErrorMessage': str(e), 
                 'causeErrorStatus': -1,
-                'errorMessage': 'Cannot verify user: unknown Python exception.', 
+                'errorMessage': 'Cannot log in: unknown Python exception.', 
                 'responseCode': 500
             }, 500
 
@@ -200,7 +222,7 @@ class AuthUser(Resource):
             return {
                 'causeErrorMessage': 'N/A',
                 'causeErrorStatus': -1,
-                'errorMessage': 'Cannot verify user: unknown exception.',
+                'errorMessage': 'Cannot log in: unknown exception.',
                 'responseCode': 500
             }, 500
 
@@ -310,6 +332,6 @@ class GetUser(Resource):
 
 api.add_resource(UsersHW, '/hello_world/')
 api.add_resource(CreateUser, '/create/')
-api.add_resource(AuthUser, '/auth/')
+api.add_resource(LoginUser, '/login/')
 api.add_resource(ListUsers, '/list/')
 api.add_resource(GetUser, '/get/<int:user_id>/')
@@ -8,6 +8,11 @@ class ProductionConfig:
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+	# key that signs the auth tokens, shared by all services that use them (see services/auth_token), required to start
+	AUTH_TOKEN_KEY = os.environ.get('AUTH_TOKEN_KEY', '').encode()
+	# number of seconds during which an auth token is valid
+	AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 15 * 60))
+
 class DevelopmentConfig:
 	"""
 		Development config.
@@ -16,3 +21,8 @@ class DevelopmentConfig:
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+	# key that signs the auth tokens, shared by all services that use them (see services/auth_token), required to start
+	AUTH_TOKEN_KEY = os.environ.get('AUTH_TOKEN_KEY', '').encode()
+	# number of seconds during which an auth token is valid
+	AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', 15 * 60))
+
@@ -8,6 +8,9 @@ class ProductionConfig:
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+	# key that signs the auth tokens, shared by all services that use them (see services/auth_token), required to start
+	AUTH_TOKEN_KEY = os.environ.get('AUTH_TOKEN_KEY', '').encode()
+
 class DevelopmentConfig:
 	"""
 		Development config.
@@ -16,3 +19,6 @@ class DevelopmentConfig:
 	SQLALCHEMY_TRACK_MODIFICATIONS = False
 	SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+	# key that signs the auth tokens, shared by all services that use them (see services/auth_token), required to start
+	AUTH_TOKEN_KEY = os.environ.get('AUTH_TOKEN_KEY', '').encode()
+
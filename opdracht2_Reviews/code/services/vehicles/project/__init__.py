@@ -10,6 +10,8 @@ from sqlalchemy import exc
 from passlib.hash import sha256_crypt
 import requests
 
+from auth_token import verify_token
+
 ############### FLASK INIT & CONFIG ###############
 
 app = Flask(__name__)
@@ -17,6 +19,10 @@ app = Flask(__name__)
 app_settings = os.getenv('APP_SETTINGS')
 app.config.from_object(app_settings)
 
+# the auth tokens (see services/auth_token) cannot be used without a key, refuse to start instead of failing every request that needs one
+if not app.config['AUTH_TOKEN_KEY']:
+    raise RuntimeError("AUTH_TOKEN_KEY is not set: it must contain the key that signs the auth tokens, the same for every service that uses them.")
+
 def make_get_request(url:str, **kwargs) -> (bool, dict):
     """
         Send a GET request to the specified URL with the specified arguments. 
@@ -113,46 +119,24 @@ class CreateVehicle(Resource):
     def post(self):
         try:
 
-            if not 'username' in request.headers:
-                return {
-                    'causeErrorMessage': 'N/A',
-                    'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'username' entry in HTTP request header.",
-                    'responseCode': 400
-                }, 400
-
-            if not 'password' in request.headers:
+            # authenticate user: the token is verified locally (see services/auth_token), missing => 400, rejected => 401
+            if not 'token' in request.headers:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'password' entry in HTTP request header.",
+                    'errorMessage': "Missing 'token' entry in HTTP request header. Log in at the users service to get one.",
                     'responseCode': 400
                 }, 400
 
-            # authenticate user
-            # NOTE: this can cause a 400 error if this data is not present!
-            username = request.headers['username']
-            password = request.headers['password']
-
-            # authenticate user
-            flag, status_code, auth_data = make_get_request('http://users:5000/auth/', headers={'username': username, 'password': password})
+            token_ok, user_id, reason = verify_token(request.headers['token'], app.config['AUTH_TOKEN_KEY'])
 
-            if not flag:
-                # ERROR while authenticating user => "Cannot authenticate user"
-                return {
-                    'causeErrorMessage': auth_data['errorMessage'],
-                    'causeErrorStatus': status_code,
-                    'errorMessage': 'Error while authenticating user.',
-                    'responseCode': 500
-                }, 500
-            elif not auth_data['result']:
-                # user is not valid
+            if not token_ok:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': 'Cannot authenticate user: ' + auth_data['reason'] + ' Please specify a valid username and password.',
-                    'responseCode': 400
-                }, 400
+                    'errorMessage': 'Cannot authenticate user: ' + reason + ' Please log in again.',
+                    'responseCode': 401
+                }, 401
 
             if not 'vehicleNr' in request.form:
                 # vehicleNr not in form
@@ -175,7 +159,7 @@ class CreateVehicle(Resource):
             # retrieve vehicle info
             vehicle_nr   = request.form["vehicleNr"]
             vehicle_type = EnumVehicleType[request.form["vehicleType"]]
-            owner_id     = auth_data['userId']
+            owner_id     = user_id
 
             # add to DB
             new_vehicle = Vehicle(vehicle_nr=vehicle_nr, vehicle_type=vehicle_type, owner_id=owner_id)
@@ -305,48 +289,27 @@ class DeleteVehicle(Resource):
                         'responseCode': 500
                     }, 500
 
-            # authenticate user
-            if not 'username' in request.headers:
-                return {
-                    'causeErrorMessage': 'N/A',
-                    'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'username' entry in HTTP request header.",
-                    'responseCode': 400
-                }, 400
-
-            if not 'password' in request.headers:
+            # authenticate user: the token is verified locally (see services/auth_token), missing => 400, rejected => 401
+            if not 'token' in request.headers:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': "Missing 'password' entry in HTTP request header.",
+                    'errorMessage': "Missing 'token' entry in HTTP request header. Log in at the users service to get one.",
                     'responseCode': 400
                 }, 400
 
-            # NOTE: this can cause a 400 error if this data is not present!
-            username = request.headers['username']
-            password = request.headers['password']
+            token_ok, user_id, reason = verify_token(request.headers['token'], app.config['AUTH_TOKEN_KEY'])
 
-            # authenticate user
-            flag, status_code, auth_data = make_get_request('http://users:5000/auth/', headers={'username': username, 'password': password})
-
-            if not flag:
-                # ERROR while authenticating user => "Cannot authenticate user"
-                return {
-                    'causeErrorMessage': auth_data['errorMessage'],
-                    'causeErrorStatus': status_code,
-                    'errorMessage': 'Error while authenticating user.',
-                    'responseCode': 500
-                }, 500
-            elif not auth_data['result']:
+            if not token_ok:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
-                    'errorMessage': 'Cannot authenticate user: ' + auth_data['reason'] + ' Please specify a valid username and password.',
-                    'responseCode': 400
-                }, 400
+                    'errorMessage': 'Cannot authenticate user: ' + reason + ' Please log in again.',
+                    'responseCode': 401
+                }, 401
 
             # check if user is the owner of the vehicle
-            if auth_data['userId'] != vehicle_data['ownerId']:
+            if user_id != vehicle_data['ownerId']:
                 return {
                     'causeErrorMessage': 'N/A',
                     'causeErrorStatus': -1,
@@ -374,13 +337,13 @@ class DeleteVehicle(Resource):
                     'responseCode': 500
                 }, 500
 
+            # the vehiclereviews service verifies the same token
             delete_request_headers = {
-                'username': username,
-                'password': password
+                'token': request.headers['token']
             }
 
             # delete vehicle
-            flag, status_code, delete_result = make_delete_request('http://vehiclereviews:5000/vehicle/{}/reviews/delete/'.format(vehicle_nr), headers=request.headers)
+            flag, status_code, delete_result = make_delete_request('http://vehiclereviews:5000/vehicle/{}/reviews/delete/'.format(vehicle_nr), headers=delete_request_headers)
 
             if not flag:
                 return {